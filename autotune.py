@@ -0,0 +1,298 @@
+"""
+relay feedback (astrom-hagglund) autotuning for PID outputs. the output
+is switched fully on and off around the set point until the input settles
+into a steady oscillation, whose amplitude and period give the ultimate
+gain and period. gains from a tuning rule are then checked with a step
+of the set point, measuring rise time, overshoot and settling time
+"""
+import math
+import beerery.pid as PID
+
+# rule: (kp / ku, ti / tu, td / tu)
+TUNING_RULES = {
+    "ziegler_nichols": (0.6, 0.5, 0.125),
+    "tyreus_luyben": (1 / 2.2, 2.2, 1 / 6.3),
+    "pessen_integral": (0.7, 0.4, 0.15),
+    "some_overshoot": (0.33, 0.5, 1 / 3.0),
+    "no_overshoot": (0.2, 0.5, 1 / 3.0)
+}
+DEFAULT_RULE = "tyreus_luyben"
+
+MINUTE_MS = 60 * 1000
+
+# session states
+RELAY = "relay"
+VERIFY = "verify"
+DONE = "done"
+FAILED = "failed"
+
+
+def tuning_gains(ultimate_gain, ultimate_period_s, rule=DEFAULT_RULE):
+    """
+    kp, ki (per second) and kd (seconds) for PidController from the
+    ultimate gain and period using a tuning rule
+    """
+    if rule not in TUNING_RULES:
+        raise Exception("Unknown tuning rule '{}'".format(rule))
+
+    kp_ratio, ti_ratio, td_ratio = TUNING_RULES[rule]
+    kp = kp_ratio * ultimate_gain
+
+    return {
+        "kp": kp,
+        "ki": kp / (ti_ratio * ultimate_period_s),
+        "kd": kp * td_ratio * ultimate_period_s
+    }
+
+
+def mean(values):
+    """average of a list"""
+    return sum(values) / float(len(values))
+
+
+class RelayExperiment(object):
+
+    """
+    switches the output between high and low as the input crosses the
+    set point, with hysteresis so noise doesn't chatter the relay.
+    the first heat up is ignored, then cycles oscillations are measured
+    """
+
+    def __init__(self, set_point, output_high=100, output_low=0,
+                 hysteresis=0.5, cycles=4):
+        self.set_point = set_point
+        self.output_high = output_high
+        self.output_low = output_low
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.relay_high = True
+        self.maximums = []
+        self.minimums = []
+        self.switch_low_ms = []  # times the input rose through the band
+        self.peak = None
+
+    def update(self, now_ms, value):
+        """the relay output for the input value"""
+        if self.relay_high:
+            if self.switch_low_ms:
+                self.peak = min(self.peak, value)
+
+            if value > self.set_point + self.hysteresis:
+                if self.switch_low_ms:
+                    self.minimums.append(self.peak)
+
+                self.relay_high = False
+                self.switch_low_ms.append(now_ms)
+                self.peak = value
+        else:
+            self.peak = max(self.peak, value)
+
+            if value < self.set_point - self.hysteresis:
+                self.maximums.append(self.peak)
+                self.relay_high = True
+                self.peak = value
+
+        return self.output_high if self.relay_high else self.output_low
+
+    def complete(self):
+        """True once enough oscillations were measured"""
+        return len(self.switch_low_ms) > self.cycles and \
+            len(self.minimums) >= self.cycles
+
+    def amplitude(self):
+        """half the peak to peak size of the oscillation"""
+        maximums = self.maximums[-self.cycles:]
+        minimums = self.minimums[-self.cycles:]
+        return (mean(maximums) - mean(minimums)) / 2.0
+
+    def ultimate_period_s(self):
+        """average period of the oscillation in seconds"""
+        switches = self.switch_low_ms[-(self.cycles + 1):]
+        periods = [b - a for a, b in zip(switches, switches[1:])]
+        return mean(periods) / 1000.0
+
+    def ultimate_gain(self):
+        """
+        ultimate gain from the describing function of a relay with
+        hysteresis, 4d / (pi * sqrt(a^2 - e^2))
+        """
+        relay_amplitude = (self.output_high - self.output_low) / 2.0
+        amplitude = self.amplitude()
+        if amplitude > self.hysteresis:
+            amplitude = math.sqrt(amplitude ** 2 - self.hysteresis ** 2)
+
+        return 4 * relay_amplitude / (math.pi * amplitude)
+
+
+class StepResponse(object):
+
+    """
+    rise time, overshoot and settling time of the input after the set
+    point steps from start_value to target
+    """
+
+    def __init__(self, started_ms, start_value, target, settle_band):
+        self.started_ms = started_ms
+        self.start_value = start_value
+        self.target = target
+        self.settle_band = settle_band
+        self.rise_start_ms = None
+        self.rise_end_ms = None
+        self.peak = start_value
+        self.last_outside_ms = started_ms
+        self.last_ms = started_ms
+
+    def update(self, now_ms, value):
+        """record an input value"""
+        step = self.target - self.start_value
+        progress = (value - self.start_value) / step if step else 1.0
+
+        if self.rise_start_ms is None and progress >= 0.1:
+            self.rise_start_ms = now_ms
+        if self.rise_end_ms is None and progress >= 0.9:
+            self.rise_end_ms = now_ms
+
+        if step >= 0:
+            self.peak = max(self.peak, value)
+        else:
+            self.peak = min(self.peak, value)
+
+        if abs(value - self.target) > self.settle_band:
+            self.last_outside_ms = now_ms
+        self.last_ms = now_ms
+
+    def report(self):
+        """the measured response"""
+        rise_time_s = None
+        if self.rise_start_ms is not None and self.rise_end_ms is not None:
+            rise_time_s = (self.rise_end_ms - self.rise_start_ms) / 1000.0
+
+        step = self.target - self.start_value
+        overshoot = max(0.0, (self.peak - self.target) *
+                        (1 if step >= 0 else -1))
+
+        settled = self.last_outside_ms < self.last_ms
+        settling_time_s = (self.last_outside_ms - self.started_ms) / 1000.0
+
+        return {
+            "step": step,
+            "rise_time_s": rise_time_s,
+            "overshoot": overshoot,
+            "overshoot_percent": overshoot / abs(step) * 100 if step else None,
+            "settling_time_s": settling_time_s if settled else None
+        }
+
+
+class AutotuneSession(object):
+
+    """
+    autotunes one output's PidController. runs the relay experiment,
+    then verifies the new gains with a step of the set point. config
+    comes from the output's "autotune" config
+    """
+
+    def __init__(self, name, set_point, autotune_config, original_config):
+        self.name = name
+        self.set_point = set_point
+        self.rule = autotune_config.get("rule", DEFAULT_RULE)
+        self.verify_step = autotune_config.get("verify_step", 5.0)
+        self.verify_ms = autotune_config.get("verify_minutes", 30) * MINUTE_MS
+        self.max_relay_ms = autotune_config.get("max_minutes", 240) * \
+            MINUTE_MS
+        self.settle_band = autotune_config.get("settle_band", 0.5)
+        self.original_config = original_config
+        self.relay = RelayExperiment(
+            set_point, autotune_config.get("output_high", 100),
+            autotune_config.get("output_low", 0),
+            autotune_config.get("hysteresis", 0.5),
+            autotune_config.get("cycles", 4))
+        self.state = RELAY
+        self.error = None
+        self.started_ms = None
+        self.verify_started_ms = None
+        self.finished_ms = None
+        self.gains = None
+        self.response = None
+
+        if self.rule not in TUNING_RULES:
+            raise Exception("Unknown tuning rule '{}'".format(self.rule))
+
+    def finished(self):
+        """True once the session is done or failed"""
+        return self.state in (DONE, FAILED)
+
+    def succeeded(self):
+        """True if new gains were found"""
+        return self.state == DONE
+
+    def control(self, controller, now_ms, value):
+        """
+        drive the controller for a loop tick, called instead of letting
+        the PID run on its own
+        """
+        if self.finished() or value is None:
+            return
+
+        if self.started_ms is None:
+            self.started_ms = now_ms
+
+        if self.state == RELAY:
+            self.control_relay(controller, now_ms, value)
+        elif self.state == VERIFY:
+            self.response.update(now_ms, value)
+            if now_ms - self.verify_started_ms >= self.verify_ms:
+                controller.set_point = self.set_point
+                self.finish(DONE, now_ms)
+
+    def control_relay(self, controller, now_ms, value):
+        """run the relay experiment"""
+        output = self.relay.update(now_ms, value)
+
+        if self.relay.complete():
+            self.gains = tuning_gains(self.relay.ultimate_gain(),
+                                      self.relay.ultimate_period_s(),
+                                      self.rule)
+            controller.set_params(**self.gains)
+            controller.set_point = self.set_point + self.verify_step
+            controller.set_mode(PID.PidController.AUTO_MODE)
+
+            self.state = VERIFY
+            self.verify_started_ms = now_ms
+            self.response = StepResponse(now_ms, value, controller.set_point,
+                                         self.settle_band)
+        elif now_ms - self.started_ms > self.max_relay_ms:
+            self.error = "No steady oscillation within the time limit."
+            controller.update_config(self.original_config)
+            self.finish(FAILED, now_ms)
+        else:
+            controller.set_mode(PID.PidController.MANUAL_MODE)
+            controller.output = output
+
+    def finish(self, state, now_ms):
+        """end the session"""
+        self.state = state
+        self.finished_ms = now_ms
+
+    def report(self):
+        """results of the session"""
+        report = {
+            "name": self.name,
+            "state": self.state,
+            "error": self.error,
+            "rule": self.rule,
+            "set_point": self.set_point,
+            "started_ms": self.started_ms,
+            "finished_ms": self.finished_ms,
+            "gains": self.gains,
+            "ultimate_gain": None,
+            "ultimate_period_s": None,
+            "amplitude": None,
+            "response": self.response.report() if self.response else None
+        }
+
+        if self.relay.complete():
+            report["ultimate_gain"] = self.relay.ultimate_gain()
+            report["ultimate_period_s"] = self.relay.ultimate_period_s()
+            report["amplitude"] = self.relay.amplitude()
+
+        return report
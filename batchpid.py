@@ -0,0 +1,195 @@
+"""
+batch PID engine, holds the state of many PID controllers in NumPy
+arrays and computes them all in one vectorized step. each controller
+is used through a BatchPidSlot, which behaves like a PidController
+"""
+import threading
+import beerery.pid as PID
+
+try:
+    import numpy
+except ImportError:  # optional, only needed for the batch engine
+    numpy = None
+
+INITIAL_CAPACITY = 16
+
+# per controller state, name: dtype
+FIELDS = [
+    ("set_point", "float64"),
+    ("kp", "float64"),
+    ("ki", "float64"),
+    ("kd", "float64"),
+    ("i_term", "float64"),
+    ("last_input", "float64"),
+    ("last_time", "float64"),
+    ("sample_time_ms", "float64"),
+    ("min_out", "float64"),
+    ("max_out", "float64"),
+    ("full_cycle_threshold", "float64"),
+    ("mode", "int8"),
+    ("input", "float64"),  # NaN when there is no input value
+    ("output", "float64"),
+    ("computed", "bool")
+]
+
+
+class BatchPidController(object):
+
+    """
+    state of many PID controllers in arrays. compute matches
+    PidController.compute for every controller, including manual mode
+    and full_cycle_threshold
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        if numpy is None:
+            raise Exception("The batch PID engine requires NumPy.")
+
+        self.lock = threading.Lock()
+        self.capacity = 0
+        self.arrays = {}
+        self.free = []
+        self.slots = {}
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """resize the arrays, existing state is kept"""
+        for name, dtype in FIELDS:
+            array = numpy.zeros(capacity, dtype=dtype)
+            if name in self.arrays:
+                array[:self.capacity] = self.arrays[name]
+            self.arrays[name] = array
+
+        # unused slots stay in manual mode, they compute to nothing
+        self.free.extend(reversed(xrange(self.capacity, capacity)))
+        self.capacity = capacity
+
+    def add(self, **kwargs):
+        """
+        add a controller, takes the same arguments as PidController.
+        returns its BatchPidSlot
+        """
+        with self.lock:
+            if not self.free:
+                self.grow(self.capacity * 2)
+
+            index = self.free.pop()
+            for name, _ in FIELDS:
+                self.arrays[name][index] = 0
+
+            slot = BatchPidSlot(self, index, **kwargs)
+            self.slots[index] = slot
+            return slot
+
+    def release(self, slot):
+        """remove a controller, its slot is reused"""
+        with self.lock:
+            if self.slots.pop(slot.index, None) is None:
+                return
+
+            self.arrays["mode"][slot.index] = PID.PidController.MANUAL_MODE
+            self.free.append(slot.index)
+
+    def set_inputs(self, slots, values):
+        """set the input of many controllers at once, None is no input"""
+        indices = numpy.fromiter((s.index for s in slots), dtype="intp",
+                                 count=len(slots))
+        self.arrays["input"][indices] = numpy.array(
+            [numpy.nan if v is None else v for v in values], dtype="float64")
+
+    def __len__(self):
+        return len(self.slots)
+
+    def compute(self, now_ms=None):
+        """
+        compute every controller for the current time. each slot's
+        compute then returns what PidController.compute would have
+        """
+        now = PID.millis() if now_ms is None else now_ms
+
+        with self.lock:
+            a = self.arrays
+            auto = a["mode"] == PID.PidController.AUTO_MODE
+            has_input = ~numpy.isnan(a["input"])
+            error = a["set_point"] - a["input"]
+
+            with numpy.errstate(invalid="ignore"):
+                running = auto & has_input
+                full = running & (error > a["full_cycle_threshold"])
+                due = running & ~full & \
+                    (now - a["last_time"] >= a["sample_time_ms"] *
+                     (1 - PID.SAMPLE_TIME_TOLERANCE))
+
+                i_term = numpy.clip(a["i_term"] + a["ki"] * error,
+                                    a["min_out"], a["max_out"])
+                d_input = a["input"] - a["last_input"]
+                pid_output = numpy.clip(
+                    a["kp"] * error + i_term - a["kd"] * d_input,
+                    a["min_out"], a["max_out"])
+
+            numpy.copyto(a["i_term"], i_term, where=due)
+            numpy.copyto(a["last_input"], a["input"], where=due)
+            a["last_time"][due] = now
+            numpy.copyto(a["output"], pid_output, where=due)
+            numpy.copyto(a["output"], a["max_out"], where=full)
+
+            # manual mode always computes, auto without an input never does
+            a["computed"][:] = ~auto | full | due
+
+
+def slot_field(name, to_value=float):
+    """property reading and writing one controller's array element"""
+    def getter(self):
+        return to_value(self.batch.arrays[name][self.index])
+
+    def setter(self, value):
+        self.batch.arrays[name][self.index] = value
+
+    return property(getter, setter)
+
+
+def input_getter(self):
+    value = self.batch.arrays["input"][self.index]
+    return None if numpy.isnan(value) else float(value)
+
+
+def input_setter(self, value):
+    self.batch.arrays["input"][self.index] = \
+        numpy.nan if value is None else value
+
+
+class BatchPidSlot(PID.PidController):
+
+    """
+    a PidController whose state lives in a BatchPidController. the
+    config methods are PidController's, compute returns the result of
+    the last batch compute
+    """
+    # pylint: disable=R0902
+
+    def __init__(self, batch, index, **kwargs):
+        self.batch = batch
+        self.index = index
+        super(BatchPidSlot, self).__init__(**kwargs)
+
+    set_point = slot_field("set_point")
+    kp = slot_field("kp")
+    ki = slot_field("ki")
+    kd = slot_field("kd")
+    i_term = slot_field("i_term")
+    last_input = slot_field("last_input")
+    last_time = slot_field("last_time")
+    sample_time_ms = slot_field("sample_time_ms")
+    min_out = slot_field("min_out")
+    max_out = slot_field("max_out")
+    full_cycle_threshold = slot_field("full_cycle_threshold")
+    mode = slot_field("mode", int)
+    output = slot_field("output")
+    input = property(input_getter, input_setter)
+
+    def compute(self, now_ms=None):
+        return bool(self.batch.arrays["computed"][self.index])
+
+    def release(self):
+        """remove the controller from the batch"""
+        self.batch.release(self)
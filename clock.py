@@ -0,0 +1,92 @@
+"""
+the clock used for control timing. the system clock is used normally,
+simulations swap in a VirtualClock so they run faster than real time
+"""
+import sys
+import threading
+import time
+from datetime import datetime
+
+# 2016-01-01 00:00:00 utc, virtual clocks start at a fixed time so
+# simulations are repeatable
+VIRTUAL_EPOCH_MS = 1451606400000
+
+
+class SystemClock(object):
+
+    """wall clock time"""
+
+    virtual = False
+
+    def millis(self):
+        """returns current time as milliseconds"""
+        return int(round(time.time() * 1000))
+
+    def time(self):
+        """returns current time as seconds"""
+        return time.time()
+
+
+class VirtualClock(object):
+
+    """
+    clock that only moves when it is advanced. the control loop
+    advances it to the next deadline instead of sleeping
+    """
+
+    virtual = True
+
+    def __init__(self, start_ms=VIRTUAL_EPOCH_MS):
+        self.now_ms = start_ms
+        self.lock = threading.Lock()
+
+    def millis(self):
+        """returns current time as milliseconds"""
+        return self.now_ms
+
+    def time(self):
+        """returns current time as seconds"""
+        return self.now_ms / 1000.0
+
+    def advance(self, milliseconds):
+        """move time forward"""
+        with self.lock:
+            self.now_ms += milliseconds
+
+    def advance_to(self, now_ms):
+        """move time forward to now_ms, time never goes backwards"""
+        with self.lock:
+            self.now_ms = max(self.now_ms, now_ms)
+
+
+sys.modules[__name__].current = SystemClock()
+
+
+def set_clock(new_clock):
+    """replace the clock used for control timing"""
+    sys.modules[__name__].current = new_clock
+
+
+def use_system_clock():
+    """go back to the system clock"""
+    set_clock(SystemClock())
+
+
+def is_virtual():
+    """True if a virtual clock is in use"""
+    return sys.modules[__name__].current.virtual
+
+
+def millis():
+    """returns current time as milliseconds"""
+    return sys.modules[__name__].current.millis()
+
+
+def now():
+    """current local time as a datetime"""
+    return datetime.fromtimestamp(sys.modules[__name__].current.time())
+
+
+def utcnow():
+    """current utc time as a datetime"""
+    return datetime.utcfromtimestamp(sys.modules[__name__].current.time())
@@ -0,0 +1,181 @@
+"""
+process wide, versioned cache of config files. readers share immutable
+snapshots of the parsed config, writers commit copy-on-write changes
+that are checked against the version they were based on
+"""
+import threading
+import beerery.fileio as fileio
+
+OUTPUTS_CONFIG_FILE = "config/outputs.json"
+# attempts to commit when another writer got there first
+COMMIT_ATTEMPTS = 3
+
+
+class ConfigConflict(Exception):
+
+    """raised when a commit is based on a snapshot that is out of date"""
+    pass
+
+
+class FrozenDict(dict):
+
+    """dict that can't be changed, used for config snapshots"""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Config snapshots are immutable.")
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+
+def freeze(value):
+    """recursively convert parsed json into immutable containers"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+
+    return value
+
+
+def thaw(value):
+    """recursively convert frozen config back into editable containers"""
+    if isinstance(value, dict):
+        return dict((k, thaw(v)) for k, v in value.items())
+    elif isinstance(value, tuple):
+        return [thaw(v) for v in value]
+
+    return value
+
+
+class ConfigSnapshot(object):
+
+    """
+    immutable version of a config file. entries with a name
+    are indexed by it
+    """
+
+    def __init__(self, version, content_hash, config):
+        self.version = version
+        self.content_hash = content_hash
+        self.config = freeze(config)
+        self.index = {}
+
+        if isinstance(self.config, tuple):
+            self.index = dict((e["name"], e) for e in self.config
+                              if isinstance(e, dict) and "name" in e)
+
+    def get(self, name):
+        """the entry with a name or None"""
+        return self.index.get(name)
+
+
+class ConfigRepository(object):
+
+    """
+    shared config for one config file. the file is only re-parsed when
+    it has been invalidated and its content changed
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.current = None
+        self.stale = True
+
+    def invalidate(self):
+        """the file changed on disk, check it on the next read"""
+        self.stale = True
+
+    def snapshot(self):
+        """the current snapshot of the config"""
+        with self.lock:
+            if self.stale:
+                self.stale = False
+                known_hash = self.current.content_hash if self.current \
+                    else None
+                content_hash, config = fileio.load_config_if_changed(
+                    self.file_path, known_hash)
+
+                if config is not None:
+                    self.current = ConfigSnapshot(self.next_version(),
+                                                  content_hash, config)
+
+            return self.current
+
+    def next_version(self):
+        """version number for a new snapshot"""
+        return self.current.version + 1 if self.current else 1
+
+    def commit(self, base_version, update):
+        """
+        apply update to an editable copy of the config and save it.
+        raises ConfigConflict if the config has changed since
+        base_version was read. returns the new snapshot
+        """
+        self.snapshot()
+
+        with self.lock:
+            if self.current.version != base_version:
+                raise ConfigConflict(
+                    "'{}' changed since version {}, now {}".format(
+                        self.file_path, base_version, self.current.version))
+
+            config = thaw(self.current.config)
+            update(config)
+
+            content_hash = fileio.save_config(self.file_path, config)
+            self.current = ConfigSnapshot(self.next_version(),
+                                          content_hash, config)
+
+            return self.current
+
+    def commit_latest(self, update, attempts=COMMIT_ATTEMPTS):
+        """
+        commit update against the latest snapshot, retrying with a
+        fresh snapshot if another writer got there first
+        """
+        for attempt in xrange(attempts):
+            try:
+                return self.commit(self.snapshot().version, update)
+            except ConfigConflict:
+                if attempt == attempts - 1:
+                    raise
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def repository(file_path):
+    """returns the process wide repository for a config file"""
+    # keyed by the full path so changing the base directory
+    # never hands out another directory's config
+    key = fileio.full_fileio_path(file_path)
+    with _repositories_lock:
+        config_repository = _repositories.get(key)
+        if config_repository is None:
+            config_repository = ConfigRepository(file_path)
+            _repositories[key] = config_repository
+
+        return config_repository
+
+
+def outputs_repository():
+    """returns the repository for the outputs config"""
+    return repository(OUTPUTS_CONFIG_FILE)
+
+
+def invalidate(file_path):
+    """mark a config file as changed on disk"""
+    with _repositories_lock:
+        config_repository = _repositories.get(
+            fileio.full_fileio_path(file_path))
+
+    if config_repository:
+        config_repository.invalidate()
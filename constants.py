@@ -8,5 +8,16 @@ TMP36_TEMP_INPUT_TYPE = "TMP36"
 PID_OUTPUT_CONTROLLER_TYPE = "PID"
 TPC_OUTPUT = "TPC"  # time proportional control
 PWM_OUTPUT = "PWM"  # pulse width modulation control
+CONTINUOUS_ACQUISITION = "continuous"  # sensor read in the background
+ON_DEMAND_ACQUISITION = "on_demand"  # sensor read when the input calculates
 MONGODB_LOG = "mongodb"
+FILE_LOG = "file"
+LOG_OVERFLOW_DROP_OLDEST = "drop_oldest"
+LOG_OVERFLOW_DROP_NEWEST = "drop_newest"
+LOG_OVERFLOW_SPILL = "spill"  # overflow is written to a local spill file
+PROGRAM_IDLE = "idle"
+PROGRAM_RUNNING = "running"
+PROGRAM_WAITING = "waiting"  # waiting for the alarm to be acknowledged
+PROGRAM_COMPLETE = "complete"
+PROGRAM_FAILED = "failed"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -3,31 +3,76 @@ module for control server processes
 """
 import time
 import os
-from datetime import datetime
+import errno
+import fcntl
+import heapq
+import select
+import collections
 import beerery.sensors.tempsensors as tempsensors
 import beerery.loggers as loggers
 import beerery.pid as PID
+import beerery.batchpid as batchpid
+import beerery.autotune as autotune
 import beerery.constants as constants
 import beerery.fileio as fileio
 import beerery.program as program
-from pprint import pprint
+import beerery.pwm as pwm
+import beerery.tpcload as tpcload
+import beerery.liveapi as liveapi
+import beerery.pindriver as pindriver
+import beerery.configstore as configstore
+import beerery.workers as workers
+import beerery.history as history
+import beerery.clock as clock
+import beerery.metrics as metrics
+import beerery.records as records
+import beerery.tracelog as tracelog
 import threading
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileModifiedEvent
+from watchdog.events import FileSystemEventHandler, FileModifiedEvent, \
+    FileMovedEvent
 import RPIO  # only available on the raspberry pi, pylint: disable=F0401
 
+# write debug events out, when False only info and above are written
 DEV_LOGGING = True
 
+LOG = tracelog.get_logger("controller")
+CONFIG_LOG = tracelog.get_logger("config")
+INPUT_LOG = tracelog.get_logger("inputs")
+OUTPUT_LOG = tracelog.get_logger("outputs")
+LOOP_LOG = tracelog.get_logger("loop")
 
-def log(message):
-    """log a dev debug message"""
-    if DEV_LOGGING:
-        pprint(message)
+# where the trace ring is dumped on demand (SIGUSR1) and on a crash
+TRACE_DUMP_FILE = "state/trace.bin"
+TRACE_CRASH_FILE = "state/trace_crash.bin"
 
 
 def millis():
     """returns current time as milliseconds"""
-    return int(round(time.time() * 1000))
+    return clock.millis()
+
+
+def rpio_pin_driver():
+    """a pin driver for the RPIO gpio pins"""
+    return pindriver.PinDriver(pindriver.RpioBackend(RPIO))
+
+
+# config key, file for the app config that can change while running
+CONFIG_FILES = [
+    ("controller", "config/controller.json"),
+    ("inputs", "config/inputs.json"),
+    ("outputs", "config/outputs.json"),
+    ("logs", "config/logs.json")
+]
+
+# restart_required_config pid_engine for the numpy batch pid engine
+PID_ENGINE_BATCH = "batch"
+
+# how often output changes made by programs are saved to outputs.json
+PROGRAM_SAVE_INTERVAL_MS = 60 * 1000
+
+# how often the loop timing metrics are written to the state directory
+METRICS_INTERVAL_MS = 60 * 1000
 
 
 class Input(object):
@@ -40,7 +85,9 @@ class Input(object):
         self.name = name
         self.input_impl = None
         self.last_value = 0
+        self.read_ms = 0
         self.adjustment = adjustment
+        self.config = None
 
     def set_type(self, input_type, input_config):
         """
@@ -48,36 +95,45 @@ class Input(object):
         """
         if input_type == constants.THERMISTOR_INPUT_TYPE:
             input_handler = tempsensors.ThermistorSensor(
-                input_config["adc_channel"])
+                input_config["adc_channel"],
+                coefficients=input_config.get("coefficients"),
+                series_resistor=input_config.get("series_resistor", 10000),
+                reference_voltage=input_config.get("reference_voltage"),
+                max_sample_age_ms=input_config.get("max_sample_age_ms"))
         elif input_type == constants.ONEWIRE_TEMP_INPUT_TYPE:
+            acquisition = input_config.get(
+                "acquisition", constants.CONTINUOUS_ACQUISITION)
             input_handler = tempsensors.OneWireTempSensor(
-                input_config["address"])
+                input_config["address"],
+                acquisition == constants.CONTINUOUS_ACQUISITION,
+                input_config.get("max_sample_age_ms"))
         elif input_type == constants.TMP36_TEMP_INPUT_TYPE:
             input_handler = tempsensors.TMP36TempSensor(
-                input_config["adc_channel"])
+                input_config["adc_channel"],
+                reference_voltage=input_config.get("reference_voltage"),
+                max_sample_age_ms=input_config.get("max_sample_age_ms"))
         else:
             raise Exception("Unknown input type '{}'".format(input_type))
 
         self.input_impl = input_handler
 
-    def calculate(self, callback=None):
+    def calculate(self, callback=None, tick=None):
         """
-        retrieve sensor value
+        retrieve sensor value, returns an InputRecord for the tick
         """
-        log("calculating {}".format(self.name))
+        INPUT_LOG.debug("calculating {}", self.name)
 
+        started_ms = metrics.now_ms()
         self.last_value = self.input_impl.get_temp()
+        self.read_ms = metrics.now_ms() - started_ms
 
-        if self.adjustment:
+        # a stale sensor reads None, the outputs using it stop computing
+        if self.adjustment and self.last_value is not None:
             self.last_value += self.adjustment
 
-        input_state = {
-            "name": self.name,
-            "value": self.last_value,
-            "units": self.input_impl.units(),
-            "date_servertime": datetime.now().strftime(constants.DATE_FORMAT),
-            "date_utc": datetime.utcnow().strftime(constants.DATE_FORMAT)
-        }
+        input_state = records.InputRecord(
+            tick or records.LoopTick.now(), self.name, self.last_value,
+            self.input_impl.units(), self.input_impl.sample_age_ms())
 
         fileio.log_input_state(self.name, input_state)
 
@@ -86,10 +142,25 @@ class Input(object):
 
         return input_state
 
-    def calculate_async(self, complete):
-        """calculate the input sensor value asynchronously"""
-        thread = threading.Thread(target=self.calculate, args=[complete])
-        thread.start()
+    def close(self):
+        """stop any background work done by the sensor"""
+        if self.input_impl:
+            self.input_impl.close()
+
+    def worker_key(self):
+        """
+        key of the worker that reads this input, inputs of the same sensor
+        class share a worker
+        """
+        return self.input_impl.__class__.__name__
+
+    def calculate_async(self, worker_pool, complete=None, tick=None):
+        """
+        calculate the input sensor value asynchronously on the pool,
+        returns a future for the input state
+        """
+        return worker_pool.submit(self.worker_key(), self.calculate, complete,
+                                  tick)
 
 
 class Output(object):
@@ -100,19 +171,36 @@ class Output(object):
 
     def __init__(self, output_config):
         self.name = output_config["name"]
+        self.config = output_config
         self.controller = None
         self.input = output_config.get("input", None)
         self.mode = output_config["mode"]
         self.pin = output_config["pin"]
+        self.watts = output_config.get("watts", 0)
+        self.autotune = None
+        self.pwm_scheduler = None
+        self.tpc_scheduler = None
+        self.pin_driver = None
         self.debug_millis = 0
 
-    def set_type(self, output_type, output_config, sample_ms):
-        """creates the controller object based on the config settings"""
+    def set_type(self, output_type, output_config, sample_ms, pid_batch=None,
+                 pwm_scheduler=None, pin_driver=None, tpc_scheduler=None):
+        """
+        creates the controller object based on the config settings,
+        pid controllers are added to pid_batch if there is one.
+        PWM outputs are driven by pwm_scheduler, the pin is written
+        through pin_driver, an RPIO driver if not given. TPC windows
+        are placed by tpc_scheduler when there is one
+        """
         output_handler = None
         output_type_controller = output_type["controller"]
         if output_type_controller == constants.PID_OUTPUT_CONTROLLER_TYPE:
-            output_handler = PID.PidController(sample_time_ms=sample_ms,
+            if pid_batch is not None:
+                output_handler = pid_batch.add(sample_time_ms=sample_ms,
                                                **output_type["config"])
+            else:
+                output_handler = PID.PidController(sample_time_ms=sample_ms,
+                                                   **output_type["config"])
 
             if output_config["mode"] == constants.TPC_OUTPUT:
                 output_handler.set_output_limits(0, 100)
@@ -121,14 +209,49 @@ class Output(object):
         else:
             raise Exception("Unknown output type '{}'".format(output_type))
 
+        if output_config["mode"] == constants.PWM_OUTPUT:
+            if pwm_scheduler is None:
+                raise Exception("PWM output '{}' requires a PWM scheduler"
+                                .format(self.name))
+            self.pwm_scheduler = pwm_scheduler
+        elif output_config["mode"] == constants.TPC_OUTPUT:
+            self.tpc_scheduler = tpc_scheduler
+
         # setup the gpio pin
-        RPIO.setup(output_config["pin"], RPIO.OUT, initial=RPIO.LOW)
+        self.pin_driver = pin_driver or rpio_pin_driver()
+        self.pin_driver.setup_output(output_config["pin"], False)
 
         self.controller = output_handler
+        self.start_autotune_if_configured(output_config)
+
+    def start_autotune_if_configured(self, config):
+        """
+        start autotuning if the config has an "autotune" section, a
+        session that is already running carries on
+        """
+        type_config = config["type"].get("config", {})
+        autotune_config = type_config.get("autotune")
+
+        if autotune_config is None:
+            self.autotune = None
+        elif self.autotune is None:
+            OUTPUT_LOG.info("autotuning output: {}", self.name)
+            self.autotune = autotune.AutotuneSession(
+                self.name, type_config["set_point"], autotune_config,
+                type_config)
+
+    def can_update_with(self, config):
+        """
+        True if the new config can be applied in place, the pin, mode
+        and controller type must stay the same
+        """
+        return config["pin"] == self.pin and config["mode"] == self.mode and \
+            config["type"]["controller"] == \
+            self.config["type"]["controller"]
 
     def update_with_config(self, config):
         """update with new config"""
-        log(config)
+        OUTPUT_LOG.debug("updating {} with {}", self.name, config)
         output_type = config["type"]
         output_type_controller = output_type["controller"]
         if output_type_controller == constants.PID_OUTPUT_CONTROLLER_TYPE:
@@ -136,56 +259,143 @@ class Output(object):
         else:
             raise Exception("Unknown output type '{}'".format(output_type))
 
+        self.input = config.get("input", None)
+        self.watts = config.get("watts", 0)
+        self.config = config
+        self.start_autotune_if_configured(config)
+
+    def set_control(self, mode, set_point=None, output=None):
+        """
+        change the controller mode, set point and manual output in
+        memory, used by programs. takes effect on the next calculate.
+        returns True if anything changed
+        """
+        controller = self.controller
+        changed = controller.mode != mode
+
+        if set_point is not None and controller.set_point != set_point:
+            controller.set_point = set_point
+            changed = True
+
+        # switching to auto starts from the current output
+        controller.set_mode(mode)
+
+        if mode == PID.PidController.MANUAL_MODE and output is not None \
+                and controller.output != output:
+            controller.output = output
+            changed = True
+
+        return changed
+
+    def control_settings(self):
+        """the in memory controller settings, as saved to the config"""
+        settings = {
+            "mode": self.controller.mode,
+            "set_point": self.controller.set_point
+        }
+
+        if self.controller.mode == PID.PidController.MANUAL_MODE:
+            settings["output"] = self.controller.output
+
+        return settings
+
+    def close(self, loop_manager=None):
+        """
+        release the controller and the pin. edges still scheduled on
+        loop_manager are cancelled and the pin is left low
+        """
+        if isinstance(self.controller, batchpid.BatchPidSlot):
+            self.controller.release()
+
+        if self.tpc_scheduler is not None:
+            self.tpc_scheduler.remove(self)
+
+        if self.pwm_scheduler is not None:
+            self.pwm_scheduler.remove(self.pin, self)
+
+        if loop_manager is not None:
+            loop_manager.cancel_group(self.name)
+
+        if self.pin_driver is not None:
+            self.pin_driver.write(self.pin, False)
+
+    def turn_off(self, loop_manager):
+        """
+        stop driving the output, the pin is left low until the
+        next window is computed
+        """
+        if self.mode == constants.PWM_OUTPUT:
+            self.pwm_scheduler.set_duty(self.pin, 0, self)
+        else:
+            loop_manager.cancel_group(self.name)
+            self.set_pin_low()
+
     def set_pin_high(self):
         """set the gpio pin high"""
         self.debug_millis = millis()
-        log("set_pin_high: {}".format(self.name))
-        if RPIO.gpio_function(self.pin) == RPIO.OUT:
-            RPIO.output(self.pin, True)
+        OUTPUT_LOG.debug("set_pin_high: {}", self.name)
+        self.pin_driver.write(self.pin, True)
 
     def set_pin_low(self):
         """set the gpio pin low"""
-        mils = millis() - self.debug_millis
-        log("set_pin_low: {}".format(self.name))
-        if RPIO.gpio_function(self.pin) == RPIO.OUT:
-            RPIO.output(self.pin, False)
+        OUTPUT_LOG.debug("set_pin_low: {}", self.name)
+        self.pin_driver.write(self.pin, False)
 
-    def calculate(self, input_object, input_value, period_ms, loop_manager):
+    def calculate(self, input_object, input_value, period_ms, loop_manager,
+                  tick=None):
         """
-        calculate and set output pin if required
+        calculate and set output pin if required, returns an OutputRecord
+        for the tick or None when there was nothing to compute
         """
         self.controller.input = input_value
-        value_computed = self.controller.compute()
+        if self.autotune is not None:
+            self.autotune.control(self.controller, millis(), input_value)
+
+        value_computed = self.controller.compute(
+            tick.tick_ms if tick else None)
+
+        if value_computed == False and input_value is None and \
+                self.controller.mode == PID.PidController.AUTO_MODE:
+            # no reading to control from, a 100% output has no low edge
+            self.turn_off(loop_manager)
+            return
 
         if self.controller.output == None or value_computed == False:
             return  # nothing to do with this controller
 
-        if self.mode == constants.TPC_OUTPUT:
-            # log("self.controller.output: {}".format(self.controller.output))
+        if self.mode == constants.TPC_OUTPUT and \
+                self.tpc_scheduler is not None:
+            # placed with the other TPC outputs once they have calculated
+            self.tpc_scheduler.request(
+                self, self.controller.output / 100.0 * period_ms)
+        elif self.mode == constants.TPC_OUTPUT:
+            # a new window supersedes any edges left from the previous one
+            loop_manager.cancel_group(self.name)
+
             if self.controller.output != 0:
-                loop_manager.schedule_callback(self.set_pin_high, 0)
+                loop_manager.schedule_callback(
+                    self.set_pin_high, 0, self.name)
 
             # special case 100%, don't set it back low
             if self.controller.output != 100:
                 loop_manager.schedule_callback(
-                    self.set_pin_low, self.controller.output / 100.0 * period_ms)
+                    self.set_pin_low, self.controller.output / 100.0 * period_ms,
+                    self.name)
         elif self.mode == constants.PWM_OUTPUT:
-            # not yet implemented, tpc is probably adequate
-            pass
+            # takes effect at the start of the next carrier period
+            self.pwm_scheduler.set_duty(self.pin, self.controller.output, self)
 
         # write output values to state files
-        output_state = {
-            "name": self.name,
-            "mode": self.mode,
-            "output_value": self.controller.output,
-            "input_value": self.controller.input,
-            "input_name": input_object.name if input_object != None else None,
-            "date_servertime": datetime.now().strftime(constants.DATE_FORMAT),
-            "date_utc": datetime.utcnow().strftime(constants.DATE_FORMAT)
-        }
+        output_state = records.OutputRecord(
+            tick or records.LoopTick.now(), self.name, self.mode,
+            self.controller.output, self.controller.input,
+            self.controller.set_point,
+            input_object.name if input_object != None else None)
 
         fileio.log_output_state(self.name, output_state)
 
+        return output_state
+
 
 class ConfigFileWatcher(FileSystemEventHandler):
 
@@ -206,110 +416,198 @@ class Controller(object):
     Controller class
     """
 
-    def __init__(self, config_base_directory=None):
+    def __init__(self, config_base_directory=None, pin_driver=None):
         self.controller_config = {}
         self.controller_config["config_current"] = False
         self.controller_config["programs_current"] = False
         self.controller_config["config_file_observer"] = None
+        self.config_hashes = {}
+        self.config_builder = None
+        self.config_stats = {
+            "swaps": 0,
+            "last_build_ms": 0,
+            "last_swap_ms": 0,
+            "max_swap_ms": 0
+        }
 
         self.sample_ms = None
+        self.pid_batch = None
+        self.pwm_scheduler = None
+        self.tpc_scheduler = None
+        self.live_api = None
+        self.pin_driver = pin_driver or rpio_pin_driver()
         self.inputs = {}
         self.outputs = {}
         self.programs = {}
+        self.unsaved_outputs = set()
+        self.outputs_saved_ms = 0
+        self.alarm_pin = None
+        self.alarm_sounding = False
         self.logs = []
         self.loop_manager = None
+        self.input_workers = None
+        self.history = None
+        self.snapshot = None  # LoopSnapshot of the last iteration
+        self.loop_metrics = metrics.LoopMetrics()
+        self.metrics_written_ms = 0
         self.cnfg_base_dir = config_base_directory or ""
 
         fileio.set_base_directory(self.cnfg_base_dir)
 
     def on_config_file_event(self, event):
-        log("config file event: {}".format(event))
         """called when a change occurs to any of the config files"""
-        if isinstance(event, FileModifiedEvent):
-            if "programs.js" in event.src_path:
-                self.controller_config["programs_current"] = False
-            else:
-                self.controller_config["config_current"] = False
+        CONFIG_LOG.debug("config file event: {}", event)
+        if isinstance(event, FileMovedEvent):
+            # config files saved via a temp file and rename
+            path = event.dest_path
+        elif isinstance(event, FileModifiedEvent):
+            path = event.src_path
+        else:
+            return
+
+        if path.endswith(".tmp"):
+            return
+
+        configstore.invalidate("config/{}".format(os.path.basename(path)))
+
+        if "programs.js" in path:
+            self.controller_config["programs_current"] = False
+        else:
+            self.controller_config["config_current"] = False
 
-    def connect_logs(self, logs):
-        """read the log config and create associated log objects"""
-        del logs[:]
+    def connect_logs(self, logging_enabled=None, log_configs=None):
+        """
+        read the log config and create associated log objects,
+        returns the new list of loggers. the config defaults to the
+        controller's
+        """
+        logs = []
 
-        if not self.controller_config["logging_enabled"]:
+        if logging_enabled is None:
+            logging_enabled = self.controller_config["logging_enabled"]
+        if not logging_enabled:
             return logs
 
-        for log_config in self.controller_config["logs"]:
+        if log_configs is None:
+            log_configs = self.controller_config["logs"]
+
+        for log_config in log_configs:
             logger = None
             log_type = log_config["type"]
             if log_type == constants.MONGODB_LOG:
+                batch_config = dict(
+                    (k, log_config[k]) for k in loggers.BATCH_CONFIG_KEYS
+                    if k in log_config)
+                if batch_config.get("spill_path"):
+                    batch_config["spill_path"] = fileio.full_fileio_path(
+                        batch_config["spill_path"])
                 logger = loggers.MongoDBLogger(
-                    log_config["db_uri"], log_config["database"])
+                    log_config["db_uri"], log_config["database"],
+                    **batch_config)
+            elif log_type == constants.FILE_LOG:
+                store_config = dict(
+                    (k, log_config[k]) for k in loggers.FILE_CONFIG_KEYS
+                    if k in log_config)
+                logger = loggers.FileLogger(
+                    fileio.full_fileio_path(log_config["directory"]),
+                    **store_config)
             else:
                 raise Exception("Unknown log type '{}'".format(log_type))
 
             logs.append(logger)
 
-    def connect_inputs(self, input_dict):
+        return logs
+
+    def connect_inputs(self, input_dict, input_configs=None):
         """
-        read the input config and create associated input reading objects
+        read the input config and create associated input reading objects.
+        inputs whose config is unchanged keep their sensor objects.
+        returns the removed inputs, they still need to be closed
         """
-        input_dict.clear()
-
-        for input_config in self.controller_config["inputs"]:
-            if input_config["active"] != True:
+        if input_configs is None:
+            input_configs = self.controller_config["inputs"]
+
+        new_input_configs = dict(
+            (i["name"], i) for i in input_configs if i["active"] == True)
+
+        # remove inputs that are no longer config'd or have changed
+        removed = []
+        for name, io_input in input_dict.items():
+            if new_input_configs.get(name) != io_input.config:
+                CONFIG_LOG.info("removing input: {}", name)
+                removed.append(io_input)
+                del input_dict[name]
+
+        # create new and changed inputs
+        for name, input_config in new_input_configs.items():
+            if name in input_dict:
                 continue
 
+            CONFIG_LOG.info("creating input: {}", name)
             adjustment = None
             if "adjustment" in input_config:
                 adjustment = input_config["adjustment"]
 
-            io_input = Input(input_config["name"], adjustment)
+            io_input = Input(name, adjustment)
+            io_input.config = input_config
             io_input.set_type(input_config["type"], input_config)
 
-            input_dict[input_config["name"]] = io_input
+            input_dict[name] = io_input
 
-    def connect_outputs(self, output_dict):
+        return removed
+
+    def connect_outputs(self, output_dict, output_configs=None):
         """
         read the output config and create/update associated
-        output pin control objects
+        output pin control objects. only outputs whose config changed
+        are touched, outputs that keep the same pin, mode and controller
+        type are updated in place so their controller state survives.
+        returns the (output, config) updates, they are applied by the
+        caller so a running loop never sees a half updated output.
+        new outputs are created without a controller, set_output_type
+        gives them one on the control thread
         """
-        # get the active outputs
-        new_output_configs = [
-            o for o in self.controller_config["outputs"] if o["active"]]
-
-        current_output_objects = output_dict.values()
+        if output_configs is None:
+            output_configs = self.controller_config["outputs"]
 
-        new_output_names = [o["name"] for o in new_output_configs]
-        to_remove = [
-            o for o in current_output_objects if o.name not in new_output_names]
+        new_output_configs = dict(
+            (o["name"], o) for o in output_configs if o["active"])
 
-        # remove outputs that are no longer config'd
-        for output in to_remove:
-            log("removing: {}".format(output.name))
-            del output_dict[output.name]
+        updates = []
+        for name, output in output_dict.items():
+            new_config = new_output_configs.get(name)
 
-        # determine which config'd outputs already have an object
-        existing_names = [o.name for o in current_output_objects]
-        existing_configs = [
-            c for c in new_output_configs if c["name"] in existing_names]
+            if new_config == output.config:
+                continue
 
-        # update existing outputs
-        for existing_config in existing_configs:
-            log("updating output: {}".format(existing_config["name"]))
-            existing_output = output_dict[existing_config["name"]]
-            existing_output.update_with_config(existing_config)
+            if new_config is not None and output.can_update_with(new_config):
+                CONFIG_LOG.info("updating output: {}", name)
+                updates.append((output, new_config))
+                continue
 
-            # remove from the new_output_configs list
-            new_output_configs.remove(existing_config)
+            # remove outputs that are no longer config'd or need rebuilding
+            CONFIG_LOG.info("removing output: {}", name)
+            del output_dict[name]
 
         # create new outputs
-        for output_config in new_output_configs:
-            log("creating output: {}".format(output_config["name"]))
-            io_output = Output(output_config)
-            io_output.set_type(
-                output_config["type"], output_config, self.sample_ms)
+        for name, output_config in new_output_configs.items():
+            if name in output_dict:
+                continue
+
+            CONFIG_LOG.info("creating output: {}", name)
+            output_dict[name] = Output(output_config)
+
+        return updates
 
-            output_dict[output_config["name"]] = io_output
+    def set_output_type(self, output):
+        """
+        give a new output its controller and set up its pin, this
+        touches the pid batch, the pins and the schedulers so it runs
+        on the control thread
+        """
+        output.set_type(output.config["type"], output.config,
+                        self.sample_ms, self.pid_batch, self.pwm_scheduler,
+                        self.pin_driver, self.tpc_scheduler)
 
     def connect_programs(self):
         """
@@ -321,7 +619,10 @@ class Controller(object):
             if program_config["active"] is not True:
                 continue
 
-            prog = program.Program(program_config)
+            # unchanged programs carry on where they are
+            prog = self.programs.get(program_config["name"])
+            if prog is None or prog.config != program_config:
+                prog = program.Program(program_config)
 
             program_dict[program_config["name"]] = prog
 
@@ -335,50 +636,73 @@ class Controller(object):
         self.controller_config.update(fileio.load_config_from_json_file(
             "config/controller.json"))
 
-    def read_app_config(self):
+    def read_changed_config(self, key, file_path, configs=None, hashes=None):
         """
-        load and read all the app configuration
+        re-parse a config file only if its content hash changed,
+        returns True if it did. the parsed config is put in configs and
+        its hash in hashes when given, for the swap to apply once the
+        build succeeded. otherwise both are applied right away
         """
-        if self.controller_config["config_current"] is True:
-            log("config_current == true")
+        known_hash = self.config_hashes.get(key)
+        new_hash, config = fileio.load_config_if_changed(file_path,
+                                                         known_hash)
+        if new_hash == known_hash:
             return False
 
-        log("config_current == false")
+        if configs is not None:
+            configs[key] = config
+            hashes[key] = new_hash
+        else:
+            self.config_hashes[key] = new_hash
+            self.apply_config(key, config)
+
+        return True
 
-        config_file_observer = self.controller_config["config_file_observer"]
-        if config_file_observer:
-            config_file_observer.stop()
+    def apply_config(self, key, config):
+        """apply a parsed config file to the controller config"""
+        if key == "controller":
+            self.controller_config.update(config)
+        else:
+            self.controller_config[key] = config
 
-        config_file_observer = Observer()
-        file_change_handler = ConfigFileWatcher(self)
+    def read_app_config(self, configs=None, hashes=None):
+        """
+        load and read the app configuration files that have changed.
+        returns the set of config keys that changed, see
+        read_changed_config for configs and hashes
+        """
+        if self.controller_config["config_current"] is True:
+            CONFIG_LOG.debug("config_current == true")
+            return set()
 
-        self.read_controller_config()
+        CONFIG_LOG.debug("config_current == false")
 
-        # load the inputs config
-        self.controller_config["inputs"] = fileio.load_config_from_json_file(
-            "config/inputs.json")
+        # mark current before reading so changes made while
+        # reading trigger another check
+        self.controller_config["config_current"] = True
 
-        # load the outputs
-        self.controller_config["outputs"] = fileio.load_config_from_json_file(
-            "config/outputs.json")
+        changed = set(key for key, file_path in CONFIG_FILES
+                      if self.read_changed_config(key, file_path, configs,
+                                                  hashes))
 
-        # load log configs
-        self.controller_config["logs"] = fileio.load_config_from_json_file(
-            "config/logs.json")
+        if not self.controller_config["config_file_observer"]:
+            config_file_observer = Observer()
+            file_change_handler = ConfigFileWatcher(self)
 
-        config_file_observer.schedule(
-            file_change_handler, os.path.join(self.cnfg_base_dir, "config"),
-            recursive=False)
+            config_file_observer.schedule(
+                file_change_handler, os.path.join(self.cnfg_base_dir,
+                                                  "config"),
+                recursive=False)
 
-        config_file_observer.start()
+            config_file_observer.start()
 
-        self.controller_config["config_file_observer"] = config_file_observer
-        self.controller_config["file_change_handler"] = file_change_handler
-        self.controller_config["config_current"] = True
+            self.controller_config[
+                "config_file_observer"] = config_file_observer
+            self.controller_config["file_change_handler"] = file_change_handler
 
-        log("end read_app_config")
+        CONFIG_LOG.debug("end read_app_config, changed: {}", sorted(changed))
 
-        return True
+        return changed
 
     def load_program_config(self):
         """loads the configuration for programs to run"""
@@ -390,63 +714,448 @@ class Controller(object):
 
         self.programs = self.connect_programs()
 
-    def evaluate_programs(self):
+    def evaluate_programs(self, now_ms):
         """
-        run any program logic that is needed
+        run any program logic that is needed. programs change the
+        outputs in memory, the changes are saved periodically
         """
         self.load_program_config()
 
         for prog in self.programs.values():
-            changed = prog.run()
+            prog.run(now_ms, self.inputs, self.outputs)
+            self.unsaved_outputs.update(prog.take_changed_outputs())
+
+        self.sound_alarm(any(prog.alarm() for prog in self.programs.values()))
+
+        interval_ms = self.controller_config.get(
+            "program_save_interval_ms", PROGRAM_SAVE_INTERVAL_MS)
+        if now_ms - self.outputs_saved_ms >= interval_ms:
+            self.save_program_outputs(now_ms)
+
+    def sound_alarm(self, sounding):
+        """
+        drive the pin of the "alarm_output_name" output in outputs.json
+        high while a program's alarm is sounding
+        """
+        name = self.controller_config.get("alarm_output_name")
+        alarm_config = configstore.outputs_repository().snapshot().get(name) \
+            if name else None
+        pin = alarm_config["pin"] if alarm_config else None
+
+        if pin != self.alarm_pin:
+            if self.alarm_pin is not None:
+                self.pin_driver.write(self.alarm_pin, False)
+            if pin is not None:
+                self.pin_driver.setup_output(pin, False)
+            self.alarm_pin = pin
+            self.alarm_sounding = False
+
+        if pin is None or sounding == self.alarm_sounding:
+            return
+
+        LOG.info("alarm {}", "sounding" if sounding else "off")
+        self.pin_driver.write(pin, sounding)
+        self.alarm_sounding = sounding
+
+    def configure_logging(self):
+        """
+        set the log levels from the controller config, "log_levels"
+        sets levels per subsystem like {"config": "debug"}
+        """
+        tracelog.configure(
+            default_level=tracelog.DEBUG if DEV_LOGGING else tracelog.INFO,
+            levels=self.controller_config.get("log_levels"),
+            ring_size=self.controller_config.get("trace_events",
+                                                 tracelog.RING_SIZE))
+
+    def configure_tpc_load(self):
+        """
+        set the panel current budget the TPC windows are placed
+        against from the controller config
+        """
+        self.tpc_scheduler.set_budget(
+            self.controller_config.get("panel_budget_amps"),
+            self.controller_config.get("panel_volts", tpcload.DEFAULT_VOLTS))
+
+    def start_live_api(self):
+        """
+        start the live api if restart_required_config has an enabled
+        "live_api" section
+        """
+        api_config = self.controller_config["restart_required_config"].get(
+            "live_api")
+        if not api_config or not api_config.get("enabled", False):
+            return
+
+        self.live_api = liveapi.LiveApiServer(
+            self,
+            api_config.get("host", liveapi.DEFAULT_HOST),
+            api_config.get("port", liveapi.DEFAULT_PORT),
+            api_config.get("max_clients", liveapi.MAX_CLIENTS),
+            api_config.get("send_queue_messages",
+                           liveapi.SEND_QUEUE_MESSAGES))
+        self.live_api.start()
+
+    def apply_live_changes(self):
+        """
+        apply the control changes received by the live api to the
+        outputs in memory, they are saved like program changes
+        """
+        for name, control in self.live_api.take_changes():
+            output = self.outputs.get(name)
+            if output is None:
+                continue
+
+            mode = control["mode"]
+            if mode is None:
+                mode = output.controller.mode
+
+            if output.set_control(mode, control["set_point"],
+                                  control["output"]):
+                LOG.info("live api changed output {}: {}", name, control)
+                self.unsaved_outputs.add(name)
+
+    def publish_live_state(self, tick):
+        """send the state of this iteration to the live api"""
+        fresh = {
+            "inputs": dict((state.name, state.as_dict())
+                           for state in self.snapshot.inputs),
+            "outputs": dict((state.name, state.as_dict())
+                            for state in self.snapshot.outputs),
+            "programs": dict((name, prog.program_state(tick.tick_ms))
+                             for name, prog in self.programs.items())
+        }
+        present = {
+            "inputs": self.inputs.keys(),
+            "outputs": self.outputs.keys(),
+            "programs": self.programs.keys()
+        }
+        self.live_api.publish(tick.sequence, fresh, present)
+
+    def dump_trace(self, file_path=TRACE_DUMP_FILE):
+        """write the recent trace events to a binary file"""
+        try:
+            count = tracelog.dump(fileio.full_fileio_path(file_path))
+            LOG.info("dumped {} trace events to {}", count, file_path)
+        except Exception as ex:  # pylint: disable=W0703
+            LOG.error("dumping trace events failed: {}", ex)
+
+    def metrics_snapshot(self):
+        """
+        loop timing histograms by phase, per input reads, loop period
+        and jitter, and TPC edge lateness, plus config swap stats and
+        the peak load of the TPC windows
+        """
+        return {
+            "sample_ms": self.sample_ms,
+            "histograms": self.loop_metrics.snapshot(),
+            "config": dict(self.config_stats),
+            "tpc_load": self.tpc_scheduler.stats()
+                        if self.tpc_scheduler else None,
+            "date_servertime": clock.now().strftime(constants.DATE_FORMAT),
+            "date_utc": clock.utcnow().strftime(constants.DATE_FORMAT)
+        }
+
+    def write_metrics_if_due(self, now_ms):
+        """periodically write the metrics snapshot to the state directory"""
+        interval_ms = self.controller_config.get(
+            "metrics_interval_ms", METRICS_INTERVAL_MS)
+        if now_ms - self.metrics_written_ms < interval_ms:
+            return
+
+        self.metrics_written_ms = now_ms
+        fileio.log_loop_metrics(self.metrics_snapshot())
+
+    def save_program_outputs(self, now_ms):
+        """
+        save the output settings changed by programs to outputs.json
+        """
+        outputs = dict((name, self.outputs[name])
+                       for name in self.unsaved_outputs
+                       if name in self.outputs)
+        self.unsaved_outputs = set()
+        self.outputs_saved_ms = now_ms
+
+        if not outputs:
+            return
+
+        def update(output_configs):
+            """copy the in memory settings into the output configs"""
+            for output_config in output_configs:
+                output = outputs.get(output_config["name"])
+                if output:
+                    output_config["type"]["config"].update(
+                        output.control_settings())
+
+        snapshot = configstore.outputs_repository().commit_latest(update)
+
+        for name, output in outputs.items():
+            # the reload triggered by the save then has nothing to update
+            if snapshot.get(name) is not None:
+                output.config = configstore.thaw(snapshot.get(name))
+
+        LOG.info("saved program changes to outputs: {}", sorted(outputs))
+
+    def build_config(self):
+        """
+        read any changed config and build the new inputs, outputs and
+        loggers without touching the ones the control loop is using.
+        runs on the builder thread, the parsed config is only applied
+        to the controller when the build is swapped in
+        """
+        build = ConfigBuild(millis())
+        build.changed = self.read_app_config(build.config, build.hashes)
+        config = build.config
+
+        if "inputs" in build.changed:
+            build.inputs = dict(self.inputs)
+            build.retired.extend(self.connect_inputs(build.inputs,
+                                                     config["inputs"]))
+
+        if "outputs" in build.changed:
+            build.outputs = dict(self.outputs)
+            build.updates = self.connect_outputs(build.outputs,
+                                                 config["outputs"])
+            build.retired_outputs = [
+                o for name, o in self.outputs.items()
+                if build.outputs.get(name) is not o]
+
+        if "logs" in build.changed or "controller" in build.changed:
+            build.logs = self.connect_logs(
+                config.get("controller", self.controller_config).get(
+                    "logging_enabled"),
+                config.get("logs", self.controller_config.get("logs")))
+            build.retired.extend(self.logs)
+
+        build.build_ms = millis() - build.started_ms
+        return build
+
+    def swap_config(self, build):
+        """
+        swap a built config into the controller, called between
+        iterations of the control loop
+        """
+        started = time.time()
+
+        for key, config in build.config.items():
+            self.apply_config(key, config)
+
+        if build.inputs is not None:
+            self.inputs = build.inputs
+
+        if build.outputs is not None:
+            # retired outputs go first, a rebuilt output may reuse
+            # their pin
+            for output in build.retired_outputs:
+                output.close(self.loop_manager)
+
+            for name, output in build.outputs.items():
+                if output.controller is not None:
+                    continue
+
+                try:
+                    self.set_output_type(output)
+                except Exception as ex:  # pylint: disable=W0703
+                    CONFIG_LOG.error("creating output {} failed: {}",
+                                     name, ex)
+                    del build.outputs[name]
+
+            for output, output_config in build.updates:
+                output.update_with_config(output_config)
+
+            self.outputs = build.outputs
 
-            if changed:
-                self.controller_config["config_current"] = False
+        if "controller" in build.changed and self.tpc_scheduler:
+            self.configure_tpc_load()
+
+        if build.logs is not None:
+            # replaced in place, the input calculator shares the list
+            self.logs[:] = build.logs
+
+        if fileio.live_state:
+            fileio.live_state.prune(self.inputs.keys(), self.outputs.keys())
+
+        self.config_hashes.update(build.hashes)
+
+        build.swap_ms = (time.time() - started) * 1000.0
+        build.swapped.set()
+
+        self.config_stats["swaps"] += 1
+        self.config_stats["last_build_ms"] = build.build_ms
+        self.config_stats["last_swap_ms"] = build.swap_ms
+        self.config_stats["max_swap_ms"] = max(
+            self.config_stats["max_swap_ms"], build.swap_ms)
+
+        CONFIG_LOG.info("config swapped in {:.3f}ms, built in {}ms: {}",
+                        build.swap_ms, build.build_ms, sorted(build.changed))
 
     def load_config_if_needed(self):
         """
-        reload config and build objects if needed
+        reload config and build objects if needed, synchronously
+        """
+        build = self.build_config()
+        if build.changed:
+            self.swap_config(build)
+            build.retire()
+
+    def swap_config_if_ready(self):
+        """
+        swap in config rebuilt by the background builder, and ask
+        it to rebuild if the config changed
+        """
+        if not self.controller_config["config_current"]:
+            self.config_builder.request()
+
+        build = self.config_builder.take_ready()
+        if build:
+            self.swap_config(build)
+
+    def complete_autotune(self, output):
+        """
+        save the gains found by autotuning to outputs.json and the
+        session report to state/autotune_<name>.json
+        """
+        session = output.autotune
+        output.autotune = None
+        report = session.report()
+
+        fileio.write_json(fileio.full_fileio_path(
+            "state/autotune_{}.json".format(output.name)), report)
+
+        def update(output_configs):
+            """replace the autotune section with the new gains"""
+            for output_config in output_configs:
+                if output_config["name"] != output.name:
+                    continue
+
+                type_config = output_config["type"]["config"]
+                type_config.pop("autotune", None)
+                if session.succeeded():
+                    type_config.update(session.gains)
+
+        snapshot = configstore.outputs_repository().commit_latest(update)
+        if snapshot.get(output.name) is not None:
+            # the reload triggered by the save has nothing to update
+            output.config = configstore.thaw(snapshot.get(output.name))
+
+        OUTPUT_LOG.info("autotuning {} {}: {}", output.name, session.state,
+                        report)
+
+    def compute_pid_batch(self, output_objects, now_ms=None):
+        """
+        compute every batched pid controller in one step at the tick
+        time now_ms, each output's calculate then uses its result
         """
-        if self.read_app_config():
-            self.connect_inputs(self.inputs)
-            self.connect_outputs(self.outputs)
-            self.connect_logs(self.logs)
+        slots = []
+        values = []
+        for output in output_objects:
+            input_for_output = self.inputs.get(output.input, None)
+            slots.append(output.controller)
+            values.append(input_for_output.last_value
+                          if input_for_output != None else None)
+
+        self.pid_batch.set_inputs(slots, values)
+        self.pid_batch.compute(now_ms)
 
     def control(self, loop_callback=None):
         """
-        main control loop method for the controller class
+        main control loop method for the controller class.
+        loop_callback is called after every iteration, the loop stops
+        cleanly when it returns True
         """
         try:
             # do onetime setup, start by loading config
             self.read_controller_config()
+            self.configure_logging()
 
             # set the sample_ms
             self.sample_ms = self.controller_config[
                 "restart_required_config"]["control_sample_time_ms"]
 
-            self.loop_manager = LoopManager(self.sample_ms)
-            self.loop_manager.start()
-
+            # all pid outputs computed in one vectorized step
+            if self.controller_config["restart_required_config"].get(
+                    "pid_engine") == PID_ENGINE_BATCH:
+                self.pid_batch = batchpid.BatchPidController()
+
+            self.loop_manager = LoopManager(self.sample_ms, self.loop_metrics,
+                                            self.pin_driver)
+            self.pwm_scheduler = pwm.PwmScheduler(
+                self.loop_manager,
+                self.controller_config["restart_required_config"].get(
+                    "pwm_period_ms", pwm.DEFAULT_PERIOD_MS),
+                self.pin_driver.write_many)
+            self.tpc_scheduler = tpcload.TpcLoadScheduler(self.loop_manager)
+            self.configure_tpc_load()
+            self.start_live_api()
+            if not clock.is_virtual():
+                # with a virtual clock the loop manager is run by
+                # wait_for_next_loop on this thread
+                self.loop_manager.start()
+
+            fileio.start_state_writer(self.controller_config.get(
+                "state_flush_interval_ms", self.sample_ms))
+            fileio.open_live_state(self.controller_config.get(
+                "live_state_slots", fileio.LIVE_STATE_SLOTS))
+
+            self.history = history.History(
+                self.controller_config.get("history_minutes", 30) *
+                60 * 1000 // self.sample_ms)
+
+            # the first load happens before the loop starts, later
+            # reloads are built in the background and swapped in
+            self.load_config_if_needed()
+            self.config_builder = ConfigBuilder(self)
+            self.config_builder.start()
+
+            self.input_workers = workers.WorkerPool()
+            input_calculator = ParallelInputCalculator(
+                self.input_workers, self.logs, self.loop_metrics)
+
+            self.metrics_written_ms = millis()
+            timer = metrics.PhaseTimer(self.loop_metrics)
+            loop_count = 0
             while True:
-                self.loop_manager.begin_loop()
+                loop_ms = self.loop_manager.begin_loop()
+                timer.lap("wait")
+                timer.start_iteration()
 
-                # evaluate any active programs
-                self.evaluate_programs()
-
-                # reload app config if neede
-                self.load_config_if_needed()
+                # swap in reloaded app config if needed
+                self.swap_config_if_ready()
+                timer.lap("config")
 
                 # process the inputs
                 input_objects = self.inputs.values()
 
-                input_calculator = ParallelInputCalculator(
-                    input_objects, self.logs)
+                # one set of timestamps shared by the iteration's records
+                tick = records.LoopTick(loop_count, loop_ms,
+                                        clock.current.time())
+                tick_ms = tick.tick_ms
+                loop_count += 1
+
+                input_calculator.calculate_async(input_objects, tick)
+                input_states = input_calculator.wait()
+
+                for input_state in input_states:
+                    self.history.record_input(input_state.name, tick_ms,
+                                              input_state.value)
+                timer.lap("inputs")
+
+                # evaluate any active programs, their output changes
+                # apply to this iteration's outputs
+                self.evaluate_programs(tick_ms)
 
-                input_calculator.calculate_async()
-                input_calculator.wait()
+                # changes from the live api apply on this tick
+                if self.live_api:
+                    self.apply_live_changes()
+                timer.lap("programs")
 
                 # process outputs
                 output_objects = self.outputs.values()
 
+                if self.pid_batch is not None:
+                    self.compute_pid_batch(output_objects, tick_ms)
+
+                output_states = []
                 for output in output_objects:
                     input_for_output = self.inputs.get(output.input, None)
 
@@ -456,26 +1165,174 @@ class Controller(object):
                         output_state = output.calculate(input_for_output,
                                                         input_value,
                                                         self.sample_ms,
-                                                        self.loop_manager)
+                                                        self.loop_manager,
+                                                        tick)
                     else:
                         output_state = output.calculate(None,
                                                         None,
                                                         self.sample_ms,
-                                                        self.loop_manager)
+                                                        self.loop_manager,
+                                                        tick)
 
-                    for logger in self.logs:
-                        logger.log_output(output.name, output_state)
+                    if output_state is None:
+                        continue
+
+                    if output.autotune and output.autotune.finished():
+                        self.complete_autotune(output)
+
+                    output_states.append(output_state)
+
+                self.tpc_scheduler.schedule_window(self.sample_ms)
+                timer.lap("outputs")
 
-                if loop_callback != None:
-                    loop_callback()
+                self.snapshot = records.LoopSnapshot(tick, input_states,
+                                                     output_states)
 
-                self.loop_manager.next_iteration().wait()
+                for output_state in output_states:
+                    self.history.record_output(output_state.name, tick_ms,
+                                               output_state.output_value)
+
+                    for logger in self.logs:
+                        logger.log_output(output_state.name, output_state)
+                timer.lap("logging.outputs")
+
+                if self.live_api:
+                    self.publish_live_state(tick)
+                timer.lap("live_api")
+                timer.end_iteration()
+
+                self.write_metrics_if_due(tick_ms)
+
+                if loop_callback != None and loop_callback():
+                    LOG.info("control loop stopped by its callback")
+                    break
+
+                timer.lap("callback")
+                self.loop_manager.wait_for_next_loop()
+        except Exception as ex:
+            LOG.error("control loop failed: {}", ex)
+            self.dump_trace(TRACE_CRASH_FILE)
+            raise
         finally:
-            RPIO.cleanup()
+            tracelog.flush()
+
+            try:
+                self.save_program_outputs(millis())
+            except Exception as ex:  # pylint: disable=W0703
+                LOG.error("saving program outputs failed: {}", ex)
+
+            if self.live_api:
+                self.live_api.stop()
+                self.live_api = None
+
+            if self.pwm_scheduler:
+                self.pwm_scheduler.stop()
+
+            if self.loop_manager:
+                self.loop_manager.stop()
+
+            if self.alarm_pin is not None:
+                self.pin_driver.write(self.alarm_pin, False)
+
+            self.pin_driver.cleanup()
+
+            fileio.stop_state_writer()
+            fileio.close_live_state()
+
+            for logger in self.logs:
+                logger.close()
+
+            if self.input_workers:
+                self.input_workers.shutdown()
+
+            for io_input in self.inputs.values():
+                io_input.close()
 
             self.controller_config["config_current"] = False
             if self.controller_config["config_file_observer"]:
                 self.controller_config["config_file_observer"].stop()
+                self.controller_config["config_file_observer"] = None
+
+            self.config_hashes = {}
+
+
+class ConfigBuild(object):
+
+    """
+    inputs, outputs and loggers built from changed config,
+    waiting to be swapped into the controller
+    """
+
+    def __init__(self, started_ms):
+        self.started_ms = started_ms
+        self.changed = set()
+        self.config = {}  # parsed config files applied during the swap
+        # content hashes of the files, only recorded once swapped so a
+        # failed build reads them again
+        self.hashes = {}
+        self.inputs = None  # None when unchanged
+        self.outputs = None
+        self.logs = None
+        self.updates = []  # (output, config) applied during the swap
+        self.retired_outputs = []  # closed during the swap
+        self.retired = []  # objects to close once swapped out
+        self.build_ms = 0
+        self.swap_ms = 0
+        self.swapped = threading.Event()
+
+    def retire(self):
+        """close the objects that were swapped out"""
+        for retired in self.retired:
+            retired.close()
+
+        self.retired = []
+
+
+class ConfigBuilder(threading.Thread):
+
+    """
+    rebuilds the controller config on a background thread so the
+    control loop never blocks on file, database or gpio setup.
+    the loop picks up the finished build between iterations
+    """
+
+    def __init__(self, controller):
+        super(ConfigBuilder, self).__init__(name="config-builder")
+        self.daemon = True
+        self.controller = controller
+        self.requested = threading.Event()
+        self.ready = None
+
+    def request(self):
+        """ask for the config to be rebuilt"""
+        self.requested.set()
+
+    def take_ready(self):
+        """returns a finished build, or None"""
+        build = self.ready
+        self.ready = None
+        return build
+
+    def run(self):
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+
+            try:
+                build = self.controller.build_config()
+            except Exception as error:  # pylint: disable=W0703
+                CONFIG_LOG.error("config build failed: {}", error)
+                continue
+
+            if not build.changed:
+                continue
+
+            self.ready = build
+
+            # old objects are closed here once the loop has swapped
+            # them out, closing can block on flushing loggers
+            build.swapped.wait()
+            build.retire()
 
 
 class ParallelInputCalculator(object):
@@ -483,129 +1340,398 @@ class ParallelInputCalculator(object):
     """
     helper class to run async calculations of the inputs.
     some inputs take up to 1sec to return so running all
-    of them in parallel to calculate them as quickly as possible
+    of them in parallel on the worker pool to calculate them
+    as quickly as possible
     """
 
-    def __init__(self, inputs, logs):
-        self.inputs = inputs
-        self.event = threading.Event()
-        self.count_lock = threading.Lock()
+    def __init__(self, worker_pool, logs, loop_metrics=None):
+        self.worker_pool = worker_pool
         self.logs = logs
-        self.input_count = len(inputs)
-        self.inputs_calculated = 0
+        self.loop_metrics = loop_metrics
+        self.futures = []
+        self.inputs = []
 
-    def calculate_async(self):
+    def calculate_async(self, inputs, tick=None):
         """fire off async calc of all the inputs"""
-        self.event.clear()
+        self.inputs = list(inputs)
+        tick = tick or records.LoopTick.now()
 
-        log("input_count: {}".format(self.input_count))
+        INPUT_LOG.debug("input_count: {}", len(self.inputs))
 
-        if self.input_count > 0:
-            for input_object in self.inputs:
-                input_object.calculate_async(self.on_input_calculated)
-        else:
-            self.event.set()
+        self.futures = [input_object.calculate_async(self.worker_pool,
+                                                     self.on_input_calculated,
+                                                     tick)
+                        for input_object in self.inputs]
 
     def on_input_calculated(self, input_object, input_state):
         """callback when an input is done calculating"""
+        started_ms = metrics.now_ms()
         for logger in self.logs:
             logger.log_input(input_object.name, input_state)
 
-        self.count_lock.acquire()
-        self.inputs_calculated += 1
+        if self.loop_metrics is not None:
+            self.loop_metrics.record("input.{}".format(input_object.name),
+                                     input_object.read_ms)
+            self.loop_metrics.record("logging.inputs",
+                                     metrics.now_ms() - started_ms)
 
-        if self.inputs_calculated == self.input_count:
-            self.event.set()
+    def wait(self):
+        """
+        wait for all inputs to calculate, returns the input states.
+        inputs that failed to read are logged and left out
+        """
+        results = self.worker_pool.gather(self.futures,
+                                          return_exceptions=True)
+        self.futures = []
+
+        input_states = []
+        for input_object, result in zip(self.inputs, results):
+            if isinstance(result, Exception):
+                INPUT_LOG.error("input '{}' failed: {}", input_object.name,
+                                result)
+            else:
+                input_states.append(result)
 
-        self.count_lock.release()
+        return input_states
 
-    def wait(self):
-        """wait for all inputs to calculate"""
-        self.event.wait()
+
+class ScheduledCallback(object):
+
+    """
+    handle for a callback scheduled on the LoopManager.
+    can be used to cancel the callback before it runs
+    """
+
+    def __init__(self, callback, deadline_ms, group=None):
+        self.callback = callback
+        self.deadline_ms = deadline_ms
+        self.group = group
+        self.cancelled = False
+        self.fired = False
+        self.fired_ms = None
+
+    def cancel(self):
+        """cancel the callback, returns False if it already ran"""
+        if self.fired:
+            return False
+
+        self.cancelled = True
+        return True
+
+    def pending(self):
+        """True if the callback has neither run nor been cancelled"""
+        return not self.fired and not self.cancelled
+
+    def lateness_ms(self):
+        """how late the callback ran compared to its deadline"""
+        if self.fired_ms is None:
+            return None
+
+        return self.fired_ms - self.deadline_ms
 
 
 class LoopManager(threading.Thread):
 
-    """LoopManager manages when and how the controller loops"""
+    """
+    LoopManager manages when and how the controller loops.
+    scheduled callbacks are kept in a min-heap ordered by deadline and
+    the thread sleeps in select until the earliest one is due, a byte
+    written to its wake pipe wakes it when an earlier callback is added.
+    python 2's Condition.wait with a timeout polls with up to 50ms
+    sleeps, too coarse for TPC edges
+    """
+
+    LATENESS_HISTORY = 1000
 
-    def __init__(self, milliseconds):
+    def __init__(self, milliseconds, loop_metrics=None, pin_driver=None):
         super(LoopManager, self).__init__()
         self.event = threading.Event()
         self.milliseconds = milliseconds
         self.daemon = True
         self.begin_ms = millis()
-        self.callbacks = []
-        self.callback_lock = threading.Lock()
+        self.callbacks = []  # heap of (deadline_ms, sequence, handle)
+        self.groups = {}
+        self.sequence = 0
+        self.condition = threading.Condition(threading.Lock())
+        self.lateness = collections.deque(maxlen=LoopManager.LATENESS_HISTORY)
+        self.lateness_max_ms = 0
+        self.lateness_total_ms = 0
+        self.fired_count = 0
+        self.next_loop_ms = self.begin_ms + milliseconds
+        # deadline of the loop last signalled, the loop clock time
+        self.loop_ms = self.begin_ms
+        self.loop_metrics = loop_metrics or metrics.LoopMetrics()
+        self.pin_driver = pin_driver
+        self.loops = 0
+        self.running = False
+        self.wake_read = None
+        self.wake_write = None
+
+    def start(self):
+        """start the thread with its wake pipe"""
+        self.wake_read, self.wake_write = os.pipe()
+        for descriptor in (self.wake_read, self.wake_write):
+            flags = fcntl.fcntl(descriptor, fcntl.F_GETFL)
+            fcntl.fcntl(descriptor, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self.running = True
+        super(LoopManager, self).start()
+
+    def stop(self):
+        """stop the thread and close the wake pipe"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wake()
+        self.join()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+        self.wake_read = self.wake_write = None
 
     def run(self):
         self.event.clear()
 
-        last_ms = millis()
-        while True:
-            now_ms = millis()
-            if now_ms - last_ms > self.milliseconds:
+        self.next_loop_ms = millis() + self.milliseconds
+        while self.running:
+            with self.condition:
+                now_ms = millis()
+                due = self.pop_due_callbacks(now_ms)
+                wait_ms = self.next_loop_ms - now_ms
+                if self.callbacks:
+                    wait_ms = min(wait_ms, self.callbacks[0][0] - now_ms)
+
+            if not due and wait_ms > 0:
+                self.sleep(wait_ms)
+                continue
+
+            self.fire_all(due)
+
+            if millis() >= self.next_loop_ms:
+                self.loop_ms = self.next_loop_ms
                 self.signal_loop()
-                last_ms = now_ms
+                self.schedule_next_loop()
+
+    def sleep(self, wait_ms):
+        """sleep until wait_ms has passed or the thread is woken"""
+        readable = select.select([self.wake_read], [], [],
+                                 wait_ms / 1000.0)[0]
+        if readable:
+            try:
+                os.read(self.wake_read, 4096)
+            except OSError as ex:
+                if ex.errno != errno.EAGAIN:
+                    raise
+
+    def wake(self):
+        """wake the thread from its sleep"""
+        if self.wake_write is None:
+            return
+
+        try:
+            os.write(self.wake_write, "x")
+        except OSError as ex:
+            # a full pipe is already waking the thread
+            if ex.errno != errno.EAGAIN:
+                raise
+
+    def schedule_next_loop(self):
+        """keep the loop on a fixed cadence instead of drifting"""
+        self.next_loop_ms += self.milliseconds
+        if self.next_loop_ms < millis():
+            self.next_loop_ms = millis() + self.milliseconds
+
+    def advance_to_next_loop(self):
+        """
+        with a virtual clock, run the callbacks due before the next
+        loop on the calling thread, moving the clock to each deadline
+        instead of sleeping
+        """
+        while True:
+            with self.condition:
+                next_ms = self.next_loop_ms
+                if self.callbacks:
+                    next_ms = min(next_ms, self.callbacks[0][0])
 
-            self.execute_callbacks(now_ms)
+            clock.current.advance_to(next_ms)
+            self.execute_callbacks(millis())
 
-            time.sleep(0.01)
+            if millis() >= self.next_loop_ms:
+                self.loop_ms = self.next_loop_ms
+                self.schedule_next_loop()
+                return
 
-    def execute_callbacks(self, now_ms):
+    def pop_due_callbacks(self, now_ms):
         """
-        executes any scheduled callbacks
+        pops every callback whose deadline has passed.
+        must be called with the condition held
         """
-        self.callback_lock.acquire()
-        callbacks_clone = self.callbacks[:]
-        self.callback_lock.release()
+        due = []
+        while self.callbacks and self.callbacks[0][0] <= now_ms:
+            handle = heapq.heappop(self.callbacks)[2]
+            self.forget_group(handle)
+            if not handle.cancelled:
+                due.append(handle)
+
+        return due
+
+    def forget_group(self, handle):
+        """drop a handle from its group's pending list"""
+        if handle.group is None:
+            return
 
-        executed_callbacks = []
-        for callback in callbacks_clone:
-            if callback['ms'] == 0:
-                # execute immediately
-                callback['callback']()
-                executed_callbacks.append(callback)
-            else:
-                start_ms = callback['start']
-                if now_ms - start_ms > callback['ms']:
-                    callback['callback']()
-                    executed_callbacks.append(callback)
+        group_handles = self.groups.get(handle.group)
+        if group_handles and handle in group_handles:
+            group_handles.remove(handle)
+            if not group_handles:
+                del self.groups[handle.group]
 
-        self.callback_lock.acquire()
-        for callback in executed_callbacks:
-            self.callbacks.remove(callback)
+    def fire_all(self, due):
+        """
+        run callbacks due at the same time, their pin writes are
+        applied together in one bulk write
+        """
+        if self.pin_driver is None:
+            for handle in due:
+                self.fire(handle)
+            return
+
+        self.pin_driver.begin_batch()
+        try:
+            for handle in due:
+                self.fire(handle)
+        finally:
+            self.pin_driver.end_batch()
+
+    def fire(self, handle):
+        """run a callback and record how late it fired"""
+        if handle.cancelled:
+            return
+
+        handle.fired = True
+        handle.fired_ms = millis()
+        lateness_ms = handle.lateness_ms()
+
+        self.fired_count += 1
+        self.lateness_total_ms += lateness_ms
+        self.lateness_max_ms = max(self.lateness_max_ms, lateness_ms)
+        self.lateness.append(lateness_ms)
+        self.loop_metrics.record("tpc_lateness", lateness_ms)
+
+        handle.callback()
 
-        self.callback_lock.release()
+    def execute_callbacks(self, now_ms):
+        """
+        executes any scheduled callbacks that are due
+        """
+        with self.condition:
+            due = self.pop_due_callbacks(now_ms)
 
-    def schedule_callback(self, callback, milliseconds):
+        self.fire_all(due)
+
+    def schedule_callback(self, callback, milliseconds, group=None):
         """
         schedule a callback to be called after a given amount of time.
-        callback will run on loop manager's thread
+        callback will run on loop manager's thread.
+        returns a ScheduledCallback handle that can be cancelled
         """
-        self.callback_lock.acquire()
-        self.callbacks.append({
-            'start': millis(),
-            'ms': milliseconds,
-            'callback': callback
-        })
-        self.callback_lock.release()
+        handle = ScheduledCallback(callback, millis() + milliseconds, group)
+
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.callbacks,
+                           (handle.deadline_ms, self.sequence, handle))
+            if group is not None:
+                self.groups.setdefault(group, []).append(handle)
+
+            earliest = self.callbacks[0][2] is handle
+
+        # wake the thread if this is the new earliest deadline
+        if earliest:
+            self.wake()
+
+        return handle
+
+    def cancel_group(self, group):
+        """
+        cancel all pending callbacks in a group, used so that a new
+        window for an output supersedes the edges of an older one.
+        returns the number of callbacks cancelled
+        """
+        with self.condition:
+            handles = self.groups.pop(group, [])
+            for handle in handles:
+                handle.cancel()
+
+        return len(handles)
+
+    def pending_callbacks(self):
+        """number of callbacks waiting to run"""
+        with self.condition:
+            return len([c for c in self.callbacks if c[2].pending()])
+
+    def timing_stats(self):
+        """
+        returns stats about how late scheduled callbacks fired
+        """
+        recent = list(self.lateness)
+
+        stats = {
+            "fired": self.fired_count,
+            "max_ms": self.lateness_max_ms,
+            "mean_ms": None,
+            "recent_mean_ms": None,
+            "recent_max_ms": None
+        }
+
+        if self.fired_count:
+            stats["mean_ms"] = self.lateness_total_ms / \
+                float(self.fired_count)
+
+        if recent:
+            stats["recent_mean_ms"] = sum(recent) / float(len(recent))
+            stats["recent_max_ms"] = max(recent)
+
+        return stats
 
     def signal_loop(self):
         """signal the event"""
         self.event.set()
 
     def begin_loop(self):
-        """a loop is beginning from the controller"""
+        """
+        a loop is beginning from the controller, returns the loop clock
+        time of the iteration. the deadline it was signalled for, so
+        periods are exact however late the thread wakes
+        """
         now_ms = millis()
-        if now_ms - self.begin_ms > self.milliseconds * 1.01:
-            print "Control loop logic took longer than config interval."
-
+        period_ms = now_ms - self.begin_ms
+        if period_ms > self.milliseconds * 1.01:
+            LOOP_LOG.warning("control loop took {}ms, longer than the {}ms "
+                             "interval", period_ms, self.milliseconds)
+
+        # the first period includes startup
+        if self.loops:
+            self.loop_metrics.record("loop_period", period_ms)
+            self.loop_metrics.record("loop_jitter",
+                                     abs(period_ms - self.milliseconds))
+
+        self.loops += 1
         self.begin_ms = now_ms
         self.event.clear()
 
+        return self.loop_ms
+
     def next_iteration(self):
         """
         returns event for the control loop to wait on
         will probably do more stuff/logging here eventually
         """
         return self.event
+
+    def wait_for_next_loop(self):
+        """block the control loop until the next iteration is due"""
+        if clock.is_virtual():
+            self.advance_to_next_loop()
+        else:
+            self.next_iteration().wait()
@@ -2,10 +2,30 @@
 module for reading and writing app config
 """
 import json
+import hashlib
 import sys
 import os
+import time
+import threading
+import mmap
+import struct
+import beerery.records as records
 
 sys.modules[__name__].base_dir = ""
+sys.modules[__name__].state_writer = None
+sys.modules[__name__].live_state = None
+
+LIVE_STATE_FILE = "state/live.bin"
+LIVE_STATE_SLOTS = 64
+LIVE_STATE_MAGIC = "BEER"
+LIVE_STATE_VERSION = 1
+# magic, version, slot count, slot size, generation
+LIVE_STATE_HEADER = struct.Struct("<4sHHHxxQ")
+# kind, name, units/mode, value, input value, set point, age ms, timestamp
+LIVE_STATE_SLOT = struct.Struct("<B3x32s4s5d")
+LIVE_STATE_EMPTY = 0
+LIVE_STATE_INPUT = 1
+LIVE_STATE_OUTPUT = 2
 
 
 def set_base_directory(path):
@@ -37,39 +57,442 @@ def load_config_from_json_file(file_path):
     return dict_from_json
 
 
+def load_config_if_changed(file_path, known_hash=None):
+    """
+    loads config from a json config file if its content no longer
+    matches known_hash. returns (content hash, config), config is None
+    when the file is unchanged
+    """
+    with open(full_fileio_path(file_path)) as input_json:
+        content = input_json.read()
+
+    content_hash = hashlib.sha1(content).hexdigest()
+    if content_hash == known_hash:
+        return content_hash, None
+
+    return content_hash, json.loads(content)
+
+
+def save_config(file_path, config):
+    """
+    saves a config file, returns the hash of the content written
+    """
+    content = json.dumps(config, indent=2)
+    write_text(full_fileio_path(file_path), content)
+
+    return hashlib.sha1(content).hexdigest()
+
+
 def save_output_config(output_config):
     """saves an output config file"""
-    write_json(full_fileio_path("config/outputs.json"), output_config)
+    save_config("config/outputs.json", output_config)
+
+
+def temp_file_path(file_path):
+    """
+    path of the temp file used while writing file_path,
+    kept in the same directory so the rename is atomic
+    """
+    directory, file_name = os.path.split(file_path)
+    return os.path.join(directory, ".{}.tmp".format(file_name))
+
+
+def write_text(file_path, content):
+    """
+    write text to a file. the text is written to a temp file and then
+    renamed over the file so readers never see a partial write. the
+    temp file is synced first, a power cut after the rename would
+    otherwise leave an empty file on the SD card
+    """
+    temp_path = temp_file_path(file_path)
+    with open(temp_path, 'w+') as outfile:
+        outfile.write(content)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+
+    os.rename(temp_path, file_path)
 
 
 def write_json(file_path, object_to_write):
-    """ write json to a file """
-    # write input values to state files
-    #
-    # TODO: maybe make this async via pushing onto
-    # separate thread, eventually.
-    # should probably also write to a temp file
-    # and then atomically move to "current" file
-    with open(file_path, 'w+') as outfile:
-        json.dump(object_to_write, outfile)
+    """ write json to a file, state records are written as dicts """
+    write_text(file_path,
+               json.dumps(records.serializable(object_to_write)))
+
+
+class StateWriter(threading.Thread):
+
+    """
+    writes state files on a background thread. writes to the same file
+    between flushes are coalesced so only the latest state is written
+    """
+
+    def __init__(self, flush_interval_ms):
+        super(StateWriter, self).__init__(name="state-writer")
+        self.daemon = True
+        self.flush_interval_s = flush_interval_ms / 1000.0
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.writes_requested = 0
+        self.writes_avoided = 0
+        self.files_written = 0
+        self.write_errors = 0
+        self.flushes = 0
+        self.last_flush_ms = 0
+        self.max_flush_ms = 0
+
+    def write(self, file_path, object_to_write):
+        """queue a json write, replacing any pending write to the file"""
+        with self.pending_lock:
+            if file_path in self.pending:
+                self.writes_avoided += 1
+
+            self.pending[file_path] = object_to_write
+            self.writes_requested += 1
+
+    def flush(self):
+        """write all pending files"""
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = {}
+
+        if not pending:
+            return
+
+        started = time.time()
+        for file_path, object_to_write in pending.items():
+            try:
+                write_json(file_path, object_to_write)
+                self.files_written += 1
+            except (IOError, OSError):
+                self.write_errors += 1
+
+        self.last_flush_ms = (time.time() - started) * 1000.0
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        self.flushes += 1
+
+    def stats(self):
+        """returns counters for the writer"""
+        return {
+            "writes_requested": self.writes_requested,
+            "writes_avoided": self.writes_avoided,
+            "files_written": self.files_written,
+            "write_errors": self.write_errors,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms
+        }
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval_s):
+            self.flush()
+
+        self.flush()
+
+    def stop(self):
+        """stop the writer, pending writes are flushed first"""
+        self.stopped.set()
+        self.join()
+
+
+def start_state_writer(flush_interval_ms):
+    """
+    start writing state files on a background thread
+    """
+    stop_state_writer()
+
+    writer = StateWriter(flush_interval_ms)
+    writer.start()
+    sys.modules[__name__].state_writer = writer
+
+    return writer
+
+
+def stop_state_writer():
+    """
+    stop the background state writer, flushing any pending writes
+    """
+    writer = sys.modules[__name__].state_writer
+    sys.modules[__name__].state_writer = None
+
+    if writer:
+        writer.stop()
+
+
+def write_state(file_path, state):
+    """
+    write a state file, in the background if the state writer is running
+    """
+    writer = sys.modules[__name__].state_writer
+    if writer:
+        writer.write(file_path, state)
+    else:
+        write_json(file_path, state)
+
+
+def log_loop_metrics(state):
+    """
+    log the control loop timing metrics to file
+    """
+    write_state(full_fileio_path("state/loop_metrics.json"), state)
 
 
 def log_input_state(name, state):
     """
     log input state to file
     """
-    write_json(full_fileio_path("state/input_{}.json".format(name)), state)
+    write_state(full_fileio_path("state/input_{}.json".format(name)), state)
+
+    table = sys.modules[__name__].live_state
+    if table:
+        table.publish_input(name, state)
 
 
 def log_output_state(name, state):
     """
     log input state to file
     """
-    write_json(full_fileio_path("state/output_{}.json".format(name)), state)
+    write_state(full_fileio_path("state/output_{}.json".format(name)), state)
+
+    table = sys.modules[__name__].live_state
+    if table:
+        table.publish_output(name, state)
 
 
 def log_program_state(name, state):
     """
     log input state to file
     """
-    write_json(full_fileio_path("state/program_{}.json".format(name)), state)
+    write_state(full_fileio_path("state/program_{}.json".format(name)), state)
+
+
+def live_state_size(slot_count):
+    """size in bytes of a live state table with slot_count slots"""
+    return LIVE_STATE_HEADER.size + slot_count * LIVE_STATE_SLOT.size
+
+
+def live_state_float(value):
+    """convert a state value to a float, NaN when there is no value"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class LiveStateTable(object):
+
+    """
+    memory mapped table of the live input and output values.
+    the file is a fixed header followed by one fixed size slot per
+    entity. the header holds a generation counter used as a seqlock:
+    it is odd while a slot is being written, so readers can detect
+    and retry a torn read
+    """
+
+    def __init__(self, file_path, slot_count=LIVE_STATE_SLOTS):
+        self.file_path = file_path
+        self.slot_count = slot_count
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.dropped = 0
+
+        # the file is never truncated, a reader still mapping the table
+        # of a previous run would take a SIGBUS past the new end of file
+        size = live_state_size(slot_count)
+        self.fd = os.open(file_path, os.O_RDWR | os.O_CREAT)
+        file_size = os.fstat(self.fd).st_size
+        if file_size < size:
+            os.ftruncate(self.fd, size)
+        size = max(size, file_size)
+        self.map = mmap.mmap(self.fd, size)
+        self.map[:] = "\0" * size
+
+        LIVE_STATE_HEADER.pack_into(
+            self.map, 0, LIVE_STATE_MAGIC, LIVE_STATE_VERSION, slot_count,
+            LIVE_STATE_SLOT.size, self.generation)
+
+    def set_generation(self, generation):
+        """write the generation counter into the header"""
+        self.generation = generation
+        struct.pack_into("<Q", self.map, LIVE_STATE_HEADER.size - 8,
+                         generation)
+
+    def slot_offset(self, index):
+        """byte offset of a slot"""
+        return LIVE_STATE_HEADER.size + index * LIVE_STATE_SLOT.size
+
+    def write_slot(self, kind, name, fields):
+        """write the fields for an entity into its slot"""
+        key = (kind, name)
+        with self.lock:
+            index = self.slots.get(key)
+            if index is None:
+                if len(self.slots) >= self.slot_count:
+                    self.dropped += 1
+                    return
+
+                used = set(self.slots.values())
+                index = [i for i in xrange(self.slot_count)
+                         if i not in used][0]
+                self.slots[key] = index
+
+            self.set_generation(self.generation + 1)
+            LIVE_STATE_SLOT.pack_into(self.map, self.slot_offset(index),
+                                      kind, *fields)
+            self.set_generation(self.generation + 1)
+
+    def publish_input(self, name, state):
+        """publish an input state record or dict"""
+        self.write_slot(LIVE_STATE_INPUT, name, (
+            name.encode("utf-8"),
+            str(state.get("units") or ""),
+            live_state_float(state.get("value")),
+            float("nan"),
+            float("nan"),
+            live_state_float(state.get("age_ms")),
+            records.wall_time(state, time.time())))
+
+    def publish_output(self, name, state):
+        """publish an output state record or dict"""
+        self.write_slot(LIVE_STATE_OUTPUT, name, (
+            name.encode("utf-8"),
+            str(state.get("mode") or ""),
+            live_state_float(state.get("output_value")),
+            live_state_float(state.get("input_value")),
+            live_state_float(state.get("set_point")),
+            float("nan"),
+            records.wall_time(state, time.time())))
+
+    def prune(self, input_names, output_names):
+        """clear the slots of entities that no longer exist"""
+        keep = set([(LIVE_STATE_INPUT, n) for n in input_names] +
+                   [(LIVE_STATE_OUTPUT, n) for n in output_names])
+
+        with self.lock:
+            for key in [k for k in self.slots if k not in keep]:
+                index = self.slots.pop(key)
+                self.set_generation(self.generation + 1)
+                self.map[self.slot_offset(index):
+                         self.slot_offset(index + 1)] = \
+                    "\0" * LIVE_STATE_SLOT.size
+                self.set_generation(self.generation + 1)
+
+    def close(self):
+        """unmap and close the table file"""
+        self.map.close()
+        os.close(self.fd)
+
+
+class LiveStateReader(object):
+
+    """
+    reads consistent snapshots of the live state table written by
+    the controller without parsing any json
+    """
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path or full_fileio_path(LIVE_STATE_FILE)
+        self.file_obj = open(self.file_path, "rb")
+        self.map = mmap.mmap(self.file_obj.fileno(), 0,
+                             access=mmap.ACCESS_READ)
+
+        magic, version, self.slot_count, slot_size, _ = \
+            LIVE_STATE_HEADER.unpack_from(self.map, 0)
+        if magic != LIVE_STATE_MAGIC or version != LIVE_STATE_VERSION or \
+                slot_size != LIVE_STATE_SLOT.size:
+            raise Exception(
+                "'{}' is not a live state table".format(self.file_path))
+
+    def generation(self):
+        """current generation counter of the table"""
+        return struct.unpack_from("<Q", self.map,
+                                  LIVE_STATE_HEADER.size - 8)[0]
+
+    def read_slots(self):
+        """unpack every used slot"""
+        slots = []
+        for index in xrange(self.slot_count):
+            offset = LIVE_STATE_HEADER.size + index * LIVE_STATE_SLOT.size
+            fields = LIVE_STATE_SLOT.unpack_from(self.map, offset)
+            if fields[0] != LIVE_STATE_EMPTY:
+                slots.append(fields)
+
+        return slots
+
+    def snapshot(self, retries=100):
+        """
+        returns a consistent snapshot of all inputs and outputs:
+        {"generation": n, "inputs": {name: {...}}, "outputs": {...}}
+        """
+        for _ in xrange(retries):
+            before = self.generation()
+            if before % 2:
+                time.sleep(0)
+                continue
+
+            slots = self.read_slots()
+            if self.generation() == before:
+                return self.to_snapshot(before, slots)
+
+        raise Exception("Could not read a consistent live state snapshot.")
+
+    @staticmethod
+    def to_snapshot(generation, slots):
+        """convert unpacked slots to the snapshot dict"""
+        snapshot = {"generation": generation, "inputs": {}, "outputs": {}}
+
+        for kind, name, tag, value, input_value, set_point, age_ms, \
+                timestamp in slots:
+            name = name.rstrip("\0").decode("utf-8")
+            tag = tag.rstrip("\0")
+            if kind == LIVE_STATE_INPUT:
+                snapshot["inputs"][name] = {
+                    "name": name, "units": tag, "value": value,
+                    "age_ms": age_ms, "timestamp": timestamp}
+            elif kind == LIVE_STATE_OUTPUT:
+                snapshot["outputs"][name] = {
+                    "name": name, "mode": tag, "output_value": value,
+                    "input_value": input_value, "set_point": set_point,
+                    "timestamp": timestamp}
+
+        return snapshot
+
+    def close(self):
+        """unmap and close the table file"""
+        self.map.close()
+        self.file_obj.close()
+
+
+def open_live_state(slot_count=LIVE_STATE_SLOTS):
+    """
+    start publishing input and output states to the live state table
+    """
+    close_live_state()
+
+    table = LiveStateTable(full_fileio_path(LIVE_STATE_FILE), slot_count)
+    sys.modules[__name__].live_state = table
+
+    return table
+
+
+def close_live_state():
+    """
+    stop publishing to the live state table
+    """
+    table = sys.modules[__name__].live_state
+    sys.modules[__name__].live_state = None
+
+    if table:
+        table.close()
+
+
+def read_live_state(file_path=None):
+    """
+    returns a consistent snapshot of the live state table
+    """
+    reader = LiveStateReader(file_path)
+    try:
+        return reader.snapshot()
+    finally:
+        reader.close()
@@ -1,5 +1,9 @@
+import time
+import threading
 import spidev  # only available on the raspberry pi, pylint: disable=F0401
 
+ADC_MAX_CODE = 1023  # MCP3008 is a 10 bit ADC
+
 
 class spireader:
 
@@ -25,7 +29,7 @@ class spireader:
     @staticmethod
     def adc_to_volts(data):
         """convert ADC reading to voltage"""
-        volts = (data / 1023.0) * spireader._refVoltage
+        volts = (data / float(ADC_MAX_CODE)) * spireader._refVoltage
         volts = round(volts, 10)
         return volts
 
@@ -39,3 +43,213 @@ class spireader:
     def reference_voltage():
         """return the reference voltage to use in ADC calculations"""
         return spireader._refVoltage
+
+
+class AdcChannel(object):
+
+    """
+    ring buffer of decimated readings for a single ADC channel
+    """
+
+    def __init__(self, channel, buffer_size):
+        self.channel = channel
+        self.values = [0.0] * buffer_size
+        self.times = [0.0] * buffer_size
+        self.index = 0
+        self.count = 0
+        self.raw_reads = 0
+        self.read_errors = 0
+        self.users = 0
+        self.ready = threading.Event()
+
+    def push(self, value, timestamp, raw_reads):
+        """add a decimated reading to the ring buffer"""
+        self.values[self.index] = value
+        self.times[self.index] = timestamp
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+        self.raw_reads += raw_reads
+        self.ready.set()
+
+    def last_scan_time(self):
+        """time of the newest reading, None if there are none"""
+        if not self.count:
+            return None
+
+        return self.times[(self.index - 1) % len(self.times)]
+
+    def average(self):
+        """average of the readings in the buffer, None if there are none"""
+        count = self.count
+        if not count:
+            return None
+
+        if count < len(self.values):
+            return sum(self.values[:count]) / count
+
+        return sum(self.values) / count
+
+    def samples_per_second(self, oversample):
+        """raw ADC reads per second achieved over the buffered window"""
+        count = self.count
+        if count < 2:
+            return 0.0
+
+        newest = self.times[(self.index - 1) % len(self.times)]
+        oldest = self.times[(self.index - count) % len(self.times)]
+        if newest <= oldest:
+            return 0.0
+
+        return (count - 1) * oversample / (newest - oldest)
+
+
+class AdcScanner(threading.Thread):
+
+    """
+    background scan engine for the MCP3008. every registered channel is
+    read `oversample` times on a fixed cadence, the reads are averaged
+    into one value per scan and kept in a per channel ring buffer so
+    sensors can get a filtered reading without touching the SPI bus
+    """
+
+    SCAN_INTERVAL_S = 0.02
+    OVERSAMPLE = 4
+    BUFFER_SIZE = 25
+    FIRST_READING_TIMEOUT_S = 1.0
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, scan_interval_s=SCAN_INTERVAL_S,
+                 oversample=OVERSAMPLE, buffer_size=BUFFER_SIZE,
+                 read_function=None):
+        super(AdcScanner, self).__init__(name="adc-scanner")
+        self.daemon = True
+        self.scan_interval_s = scan_interval_s
+        self.oversample = oversample
+        self.buffer_size = buffer_size
+        self.read_function = read_function or spireader.adc_read
+        self.channels = {}
+        self.channels_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.scans = 0
+        self.overruns = 0
+        self.read_errors = 0
+
+    @staticmethod
+    def shared():
+        """returns the process wide scanner, starting it if needed"""
+        with AdcScanner._shared_lock:
+            if AdcScanner._shared is None:
+                AdcScanner._shared = AdcScanner()
+                AdcScanner._shared.start()
+
+            return AdcScanner._shared
+
+    def register_channel(self, channel):
+        """start scanning a channel"""
+        with self.channels_lock:
+            adc_channel = self.channels.get(channel)
+            if adc_channel is None:
+                adc_channel = AdcChannel(channel, self.buffer_size)
+                self.channels[channel] = adc_channel
+
+            adc_channel.users += 1
+
+    def unregister_channel(self, channel):
+        """stop scanning a channel once nothing uses it"""
+        with self.channels_lock:
+            adc_channel = self.channels.get(channel)
+            if adc_channel is None:
+                return
+
+            adc_channel.users -= 1
+            if adc_channel.users <= 0:
+                del self.channels[channel]
+
+    def average(self, channel, timeout=FIRST_READING_TIMEOUT_S):
+        """
+        filtered ADC value for a channel, waits up to timeout
+        for the first scan of a newly registered channel
+        """
+        adc_channel = self.channels.get(channel)
+        if adc_channel is None:
+            return None
+
+        adc_channel.ready.wait(timeout)
+        return adc_channel.average()
+
+    def samples_per_second(self, channel=None):
+        """
+        achieved raw reads per second for a channel,
+        or a dict of all channels when no channel is passed
+        """
+        if channel is not None:
+            adc_channel = self.channels.get(channel)
+            if adc_channel is None:
+                return 0.0
+
+            return adc_channel.samples_per_second(self.oversample)
+
+        return dict((c, a.samples_per_second(self.oversample))
+                    for c, a in self.channels.items())
+
+    def sample_age_ms(self, channel):
+        """
+        milliseconds since a channel was last scanned successfully,
+        None if it never has been
+        """
+        adc_channel = self.channels.get(channel)
+        if adc_channel is None:
+            return None
+
+        last_scan = adc_channel.last_scan_time()
+        if last_scan is None:
+            return None
+
+        return (time.time() - last_scan) * 1000.0
+
+    def scan(self):
+        """
+        read every registered channel once. a channel whose read fails
+        is counted and skipped, its readings age until it reads again
+        """
+        with self.channels_lock:
+            adc_channels = self.channels.values()
+
+        for adc_channel in adc_channels:
+            try:
+                total = 0
+                for _ in xrange(self.oversample):
+                    total += self.read_function(adc_channel.channel)
+            except Exception:  # pylint: disable=W0703
+                adc_channel.read_errors += 1
+                self.read_errors += 1
+                continue
+
+            adc_channel.push(total / float(self.oversample), time.time(),
+                             self.oversample)
+
+        self.scans += 1
+
+    def run(self):
+        next_scan = time.time()
+        while not self.stopped.is_set():
+            try:
+                self.scan()
+            except Exception:  # pylint: disable=W0703
+                # keep scanning, the sensors see their readings age
+                self.read_errors += 1
+
+            next_scan += self.scan_interval_s
+            remaining = next_scan - time.time()
+            if remaining > 0:
+                self.stopped.wait(remaining)
+            else:
+                # fell behind, resync instead of bursting to catch up
+                self.overruns += 1
+                next_scan = time.time()
+
+    def stop(self):
+        """stop scanning"""
+        self.stopped.set()
@@ -0,0 +1,274 @@
+"""
+in memory history of input and output values. each series keeps the raw
+samples for the last few minutes in a fixed size ring buffer plus min,
+max and average rollups at coarser resolutions for longer spans
+"""
+import array
+import threading
+
+RAW_RESOLUTION = 0
+# resolution ms: number of buckets kept
+DEFAULT_ROLLUPS = {
+    10 * 1000: 6 * 360,  # 10 seconds for 6 hours
+    60 * 1000: 24 * 60,  # 1 minute for a day
+    10 * 60 * 1000: 7 * 144  # 10 minutes for a week
+}
+
+
+class RingBuffer(object):
+
+    """
+    fixed capacity, array backed buffer of timestamped rows. rows are
+    appended in time order and the oldest row is overwritten when full
+    """
+
+    def __init__(self, capacity, columns=1):
+        self.capacity = capacity
+        self.times = array.array('d', [0.0] * capacity)
+        self.columns = [array.array('d', [0.0] * capacity)
+                        for _ in xrange(columns)]
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp, *values):
+        """add a row, overwriting the oldest when full"""
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        self.times[index] = timestamp
+        for column, value in zip(self.columns, values):
+            column[index] = value
+
+    def time_at(self, position):
+        """timestamp of the row at a position, oldest row is position 0"""
+        return self.times[(self.start + position) % self.capacity]
+
+    def row_at(self, position):
+        """(timestamp, values...) of the row at a position"""
+        index = (self.start + position) % self.capacity
+        return (self.times[index],) + tuple(c[index] for c in self.columns)
+
+    def bisect_left(self, timestamp):
+        """position of the first row at or after timestamp"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def bisect_right(self, timestamp):
+        """position after the last row at or before timestamp"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if timestamp < self.time_at(middle):
+                high = middle
+            else:
+                low = middle + 1
+
+        return low
+
+    def range(self, start, end):
+        """rows with start <= timestamp <= end, oldest first"""
+        return [self.row_at(p) for p in xrange(self.bisect_left(start),
+                                               self.bisect_right(end))]
+
+
+class Rollup(object):
+
+    """
+    min/max/avg of a series over fixed width time buckets
+    """
+
+    def __init__(self, resolution_ms, capacity):
+        self.resolution_ms = resolution_ms
+        # min, max, avg, count
+        self.buckets = RingBuffer(capacity, 4)
+        self.bucket_start = None
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, timestamp, value):
+        """add a sample to its bucket, closing the previous bucket"""
+        bucket_start = timestamp - timestamp % self.resolution_ms
+        if bucket_start != self.bucket_start:
+            self.close_bucket()
+            self.bucket_start = bucket_start
+
+        if self.count == 0:
+            self.minimum = self.maximum = value
+        else:
+            self.minimum = min(self.minimum, value)
+            self.maximum = max(self.maximum, value)
+
+        self.total += value
+        self.count += 1
+
+    def close_bucket(self):
+        """move the open bucket into the ring buffer"""
+        if self.count:
+            self.buckets.append(self.bucket_start, self.minimum,
+                                self.maximum, self.total / self.count,
+                                self.count)
+
+        self.minimum = self.maximum = None
+        self.total = 0.0
+        self.count = 0
+
+    def range(self, start, end):
+        """
+        (bucket start, min, max, avg, count) rows for buckets
+        overlapping the time range, including the open bucket
+        """
+        rows = self.buckets.range(start - start % self.resolution_ms, end)
+        if self.count and \
+                start - self.resolution_ms < self.bucket_start <= end:
+            rows.append((self.bucket_start, self.minimum, self.maximum,
+                         self.total / self.count, self.count))
+
+        return rows
+
+
+class SeriesHistory(object):
+
+    """
+    raw samples and rollups for a single input or output
+    """
+
+    def __init__(self, raw_capacity, rollups):
+        self.raw = RingBuffer(raw_capacity)
+        self.rollups = dict((resolution, Rollup(resolution, capacity))
+                            for resolution, capacity in rollups.items())
+        self.last_time = None
+
+    def add(self, timestamp, value):
+        """record a sample"""
+        if self.last_time is not None and timestamp < self.last_time:
+            # keep the buffers ordered for the binary searches
+            timestamp = self.last_time
+
+        self.last_time = timestamp
+        self.raw.append(timestamp, value)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, value)
+
+    def query(self, start, end, resolution=RAW_RESOLUTION):
+        """samples in a time range at a resolution"""
+        if resolution == RAW_RESOLUTION:
+            return self.raw.range(start, end)
+
+        rollup = self.rollups.get(resolution)
+        if rollup is None:
+            raise Exception("Unknown history resolution '{}'".format(
+                resolution))
+
+        return rollup.range(start, end)
+
+
+class History(object):
+
+    """
+    history of all inputs and outputs kept by the controller.
+    series are named input_<name> and output_<name>
+    """
+
+    def __init__(self, raw_capacity, rollups=None):
+        self.raw_capacity = raw_capacity
+        self.rollups = rollups or DEFAULT_ROLLUPS
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def record(self, series_name, timestamp, value):
+        """record a sample of a series, None values are skipped"""
+        if value is None:
+            return
+
+        with self.lock:
+            series = self.series.get(series_name)
+            if series is None:
+                series = SeriesHistory(self.raw_capacity, self.rollups)
+                self.series[series_name] = series
+
+            series.add(timestamp, float(value))
+
+    def record_input(self, name, timestamp, value):
+        """record an input value"""
+        self.record("input_{}".format(name), timestamp, value)
+
+    def record_output(self, name, timestamp, value):
+        """record an output value"""
+        self.record("output_{}".format(name), timestamp, value)
+
+    def resolutions(self):
+        """available resolutions in ms, 0 is raw samples"""
+        return [RAW_RESOLUTION] + sorted(self.rollups)
+
+    def best_resolution(self, start, end, max_points, series_name=None):
+        """
+        finest resolution that returns at most max_points rows. raw
+        samples are only considered for a series, and only while its
+        raw buffer still holds the whole range
+        """
+        if series_name is not None:
+            points = self.raw_points(series_name, start, end)
+            if points is not None and points <= max_points:
+                return RAW_RESOLUTION
+
+        for resolution in sorted(self.rollups):
+            if (end - start) / resolution <= max_points:
+                return resolution
+
+        return max(self.rollups)
+
+    def raw_points(self, series_name, start, end):
+        """
+        number of raw samples of a series in a time range, None if
+        samples in the range have been overwritten
+        """
+        with self.lock:
+            series = self.series.get(series_name)
+            if series is None:
+                return 0
+
+            raw = series.raw
+            if raw.count == raw.capacity and raw.time_at(0) > start:
+                return None
+
+            return raw.bisect_right(end) - raw.bisect_left(start)
+
+    def query(self, series_name, start, end, resolution=RAW_RESOLUTION):
+        """
+        samples of a series in a time range. raw resolution returns
+        (timestamp, value) rows, rollups return
+        (bucket start, min, max, avg, count) rows
+        """
+        with self.lock:
+            series = self.series.get(series_name)
+            if series is None:
+                return []
+
+            return series.query(start, end, resolution)
+
+    def latest(self, series_name):
+        """most recent (timestamp, value) of a series or None"""
+        with self.lock:
+            series = self.series.get(series_name)
+            if series is None or not series.raw.count:
+                return None
+
+            return series.raw.row_at(series.raw.count - 1)
+
+    def series_names(self):
+        """names of the recorded series"""
+        with self.lock:
+            return sorted(self.series)
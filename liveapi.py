@@ -0,0 +1,658 @@
+"""
+live api for dashboards, served from the controller's memory by an
+asyncore server on its own thread.
+
+    GET  /api/state             inputs, outputs and programs of the last loop
+    GET  /api/<category>        one of inputs, outputs or programs
+    GET  /api/outputs/<name>    one output
+    POST /api/outputs/<name>    {"mode", "set_point", "output"} changes,
+                                applied on the next loop tick
+    POST /api/programs/<name>/acknowledge
+                                acknowledge the program's alarm, a waiting
+                                program continues on the next loop tick
+    GET  /ws                    websocket, sent the full state and then a
+                                delta after every loop. control changes can
+                                be sent as {"type": "control", "output": name}
+
+every websocket client has a bounded send queue. a client that falls
+behind has its queue dropped and is sent the full state again instead of
+the deltas it missed, publishing never waits on a client
+"""
+import asynchat
+import asyncore
+import base64
+import collections
+import hashlib
+import json
+import math
+import socket
+import struct
+import threading
+import beerery.pid as PID
+import beerery.tracelog as tracelog
+
+LOG = tracelog.get_logger("liveapi")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+MAX_CLIENTS = 8
+SEND_QUEUE_MESSAGES = 32
+MAX_REQUEST_BYTES = 64 * 1024
+
+# how long the server thread waits in select before checking the
+# send queues and whether it was stopped
+POLL_S = 0.05
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+MODES = {
+    "auto": PID.PidController.AUTO_MODE,
+    "manual": PID.PidController.MANUAL_MODE
+}
+CATEGORIES = ("inputs", "outputs", "programs")
+
+# dates change every loop, they don't make an entry part of a delta
+DATE_KEYS = ("date_servertime", "date_utc")
+
+STATUS = {
+    101: "Switching Protocols",
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Request Entity Too Large",
+    503: "Service Unavailable"
+}
+
+
+def accept_key(key):
+    """the Sec-WebSocket-Accept value for a Sec-WebSocket-Key"""
+    return base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+
+
+def encode_frame(payload, opcode=OPCODE_TEXT):
+    """a single unmasked websocket frame, as sent by a server"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+    return header + payload
+
+
+def decode_frame(data):
+    """
+    decode the websocket frame at the start of data, a bytearray.
+    returns (fin, opcode, masked, payload, frame length) or None if the
+    frame isn't complete
+    """
+    if len(data) < 2:
+        return None
+
+    fin = bool(data[0] & 0x80)
+    opcode = data[0] & 0x0F
+    masked = bool(data[1] & 0x80)
+    length = data[1] & 0x7F
+    offset = 2
+    if length == 126:
+        if len(data) < 4:
+            return None
+        length = struct.unpack("!H", bytes(data[2:4]))[0]
+        offset = 4
+    elif length == 127:
+        if len(data) < 10:
+            return None
+        length = struct.unpack("!Q", bytes(data[2:10]))[0]
+        offset = 10
+
+    mask = None
+    if masked:
+        mask = data[offset:offset + 4]
+        offset += 4
+
+    if len(data) < offset + length:
+        return None
+
+    payload = data[offset:offset + length]
+    if masked:
+        for index in xrange(length):
+            payload[index] ^= mask[index % 4]
+
+    return fin, opcode, masked, bytes(payload), offset + length
+
+
+def number(change, key):
+    """a finite number from a control change, None if it isn't there"""
+    value = change.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        raise ValueError("'{}' must be a number".format(key))
+    # json.loads accepts NaN and Infinity, they would poison the pid
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError("'{}' must be finite".format(key))
+
+    return value
+
+
+def parse_control(change):
+    """
+    validate a control change, {"mode": "auto" or "manual",
+    "set_point": number, "output": 0-100 for manual mode}.
+    returns {"mode", "set_point", "output"} with None for what isn't
+    changed, raises ValueError if it isn't valid
+    """
+    if not isinstance(change, dict):
+        raise ValueError("control change must be an object")
+
+    mode = change.get("mode")
+    if isinstance(mode, basestring) and mode in MODES:
+        mode = MODES[mode]
+    elif mode is not None and (isinstance(mode, bool) or
+                               mode not in MODES.values()):
+        raise ValueError("Invalid mode '{}'".format(mode))
+
+    set_point = number(change, "set_point")
+    output = number(change, "output")
+    if output is not None and not 0 <= output <= 100:
+        raise ValueError("Invalid output '{}'".format(output))
+
+    if mode is None and set_point is None and output is None:
+        raise ValueError("control change has nothing to change")
+
+    return {"mode": mode, "set_point": set_point, "output": output}
+
+
+def without_dates(entry):
+    """an entry without the dates, for comparing states"""
+    if entry is None:
+        return None
+
+    return dict((key, value) for key, value in entry.items()
+                if key not in DATE_KEYS)
+
+
+def state_delta(old, new):
+    """
+    the entries of new that changed since old by category, removed
+    entries are listed by name under "removed"
+    """
+    delta = {}
+    for category in CATEGORIES:
+        old_entries = old.get(category, {})
+        new_entries = new.get(category, {})
+
+        changed = dict(
+            (name, entry) for name, entry in new_entries.items()
+            if without_dates(old_entries.get(name)) != without_dates(entry))
+        removed = sorted(set(old_entries) - set(new_entries))
+
+        if changed:
+            delta[category] = changed
+        if removed:
+            delta.setdefault("removed", {})[category] = removed
+
+    return delta
+
+
+class SendQueue(object):
+
+    """
+    bounded queue of frames for a websocket client. put is called by
+    the controller thread and take by the server thread
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.frames = collections.deque()
+        self.stale = False
+        self.dropped = 0
+
+    def put(self, frame):
+        """
+        queue a frame, if the queue is full it is dropped and the
+        client is marked stale. returns False if the queue was dropped
+        """
+        with self.lock:
+            if len(self.frames) >= self.limit:
+                self.dropped += len(self.frames)
+                self.frames.clear()
+                self.stale = True
+                return False
+
+            self.frames.append(frame)
+            return True
+
+    def resync(self, frame):
+        """replace anything queued with a full state frame"""
+        with self.lock:
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            self.frames.append(frame)
+            self.stale = False
+
+    def take(self):
+        """the next frame to send, None if there isn't one"""
+        with self.lock:
+            if self.frames:
+                return self.frames.popleft()
+
+        return None
+
+
+class Client(asynchat.async_chat):
+
+    """
+    a connection to the server, a http request that can be upgraded to
+    a websocket
+    """
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.map)
+        self.server = server
+        self.incoming = []
+        self.incoming_bytes = 0
+        self.request_line = None
+        self.headers = None
+        self.queue = None
+        self.responding = False
+        self.frames = bytearray()
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        if self.responding:
+            return
+
+        if self.queue is not None:
+            self.frames.extend(data)
+            self.read_frames()
+            return
+
+        self.incoming_bytes += len(data)
+        if self.incoming_bytes > MAX_REQUEST_BYTES:
+            self.respond(413, {"error": "request too large"})
+            return
+
+        self.incoming.append(data)
+
+    def found_terminator(self):
+        data = "".join(self.incoming)
+        self.incoming = []
+
+        if self.headers is None:
+            lines = data.split("\r\n")
+            self.request_line = lines[0].split()
+            self.headers = {}
+            for line in lines[1:]:
+                key, _, value = line.partition(":")
+                self.headers[key.strip().lower()] = value.strip()
+
+            length = int(self.headers.get("content-length", 0) or 0)
+            if length > MAX_REQUEST_BYTES:
+                self.respond(413, {"error": "request too large"})
+            elif length > 0:
+                self.set_terminator(length)
+            else:
+                self.handle_request("")
+        else:
+            self.handle_request(data)
+
+    def handle_request(self, body):
+        """route a complete http request"""
+        self.set_terminator(None)
+        if len(self.request_line) < 2:
+            self.respond(400, {"error": "bad request"})
+            return
+
+        method, path = self.request_line[0], self.request_line[1]
+        parts = [part for part in path.split("?")[0].split("/") if part]
+
+        if parts == ["ws"] and method == "GET":
+            self.upgrade()
+        elif parts[:1] != ["api"] or len(parts) < 2:
+            self.respond(404, {"error": "not found"})
+        elif method == "GET":
+            self.get(parts[1:])
+        elif method == "POST" and len(parts) == 3 and parts[1] == "outputs":
+            self.post_control(parts[2], body)
+        elif method == "POST" and len(parts) == 4 and \
+                parts[1] == "programs" and parts[3] == "acknowledge":
+            self.post_acknowledge(parts[2])
+        else:
+            self.respond(405, {"error": "method not allowed"})
+
+    def get(self, parts):
+        """respond with state from memory"""
+        state = self.server.state
+        if parts == ["state"]:
+            self.respond(200, dict(state, sequence=self.server.sequence))
+        elif len(parts) == 1 and parts[0] in CATEGORIES:
+            self.respond(200, state.get(parts[0], {}))
+        elif len(parts) == 2 and parts[0] in CATEGORIES and \
+                parts[1] in state.get(parts[0], {}):
+            self.respond(200, state[parts[0]][parts[1]])
+        else:
+            self.respond(404, {"error": "not found"})
+
+    def post_control(self, name, body):
+        """hold a control change for the next loop tick"""
+        try:
+            self.server.queue_change(name, json.loads(body or "null"))
+        except LookupError as ex:
+            self.respond(404, {"error": str(ex)})
+            return
+        except ValueError as ex:
+            self.respond(400, {"error": str(ex)})
+            return
+
+        self.respond(202, {"accepted": name})
+
+    def post_acknowledge(self, name):
+        """acknowledge a program's alarm"""
+        try:
+            self.server.acknowledge(name)
+        except LookupError as ex:
+            self.respond(404, {"error": str(ex)})
+            return
+
+        self.respond(202, {"acknowledged": name})
+
+    def respond(self, status, body):
+        """send a json response and close the connection"""
+        self.responding = True
+        self.set_terminator(None)
+        content = json.dumps(body)
+        self.push("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                  "Content-Length: {}\r\nConnection: close\r\n\r\n{}"
+                  .format(status, STATUS[status], len(content), content))
+        self.close_when_done()
+
+    def upgrade(self):
+        """switch the connection to a websocket"""
+        key = self.headers.get("sec-websocket-key")
+        if self.headers.get("upgrade", "").lower() != "websocket" or not key:
+            self.respond(400, {"error": "websocket upgrade required"})
+            return
+
+        self.push("HTTP/1.1 101 {}\r\nUpgrade: websocket\r\n"
+                  "Connection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n"
+                  .format(STATUS[101], accept_key(key)))
+        self.queue = SendQueue(self.server.send_queue_messages)
+        self.server.subscribe(self)
+
+    def read_frames(self):
+        """handle the complete frames sent by the websocket client"""
+        while self.connected:
+            frame = decode_frame(self.frames)
+            if frame is None:
+                return
+
+            fin, opcode, masked, payload, length = frame
+            del self.frames[:length]
+
+            if not masked or not fin:
+                # clients must mask, fragmented messages aren't used
+                self.close_websocket()
+                return
+            elif opcode == OPCODE_TEXT:
+                self.queue.put(encode_frame(json.dumps(
+                    self.server.websocket_message(payload))))
+            elif opcode == OPCODE_PING:
+                self.push(encode_frame(payload, OPCODE_PONG))
+            elif opcode == OPCODE_CLOSE:
+                self.close_websocket()
+                return
+
+    def close_websocket(self):
+        """send a close frame and close once it's sent"""
+        self.server.unsubscribe(self)
+        self.queue = None
+        self.responding = True
+        self.push(encode_frame("", OPCODE_CLOSE))
+        self.close_when_done()
+
+    def writable(self):
+        # frames are moved from the send queue one at a time so a slow
+        # client's backlog stays in the bounded queue
+        if not self.producer_fifo and self.queue is not None:
+            frame = self.queue.take()
+            if frame is not None:
+                self.producer_fifo.append(frame)
+
+        return asynchat.async_chat.writable(self)
+
+    def handle_close(self):
+        self.close()
+
+    def handle_error(self):
+        LOG.error("live api client failed: {}", self.server.last_error())
+        self.close()
+
+    def close(self):
+        self.server.unsubscribe(self)
+        self.server.clients.discard(self)
+        asynchat.async_chat.close(self)
+
+
+class Listener(asyncore.dispatcher):
+
+    """accepts connections up to the server's client limit"""
+
+    def __init__(self, server, host, port):
+        asyncore.dispatcher.__init__(self, map=server.map)
+        self.server = server
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(5)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+
+        sock = pair[0]
+        if len(self.server.clients) >= self.server.max_clients:
+            self.server.refused += 1
+            try:
+                sock.sendall("HTTP/1.1 503 {}\r\nContent-Length: 0\r\n"
+                             "Connection: close\r\n\r\n".format(STATUS[503]))
+            except socket.error:
+                pass
+            sock.close()
+            return
+
+        self.server.clients.add(Client(sock, self.server))
+
+    def handle_error(self):
+        LOG.error("live api listener failed: {}", self.server.last_error())
+
+
+class LiveApiServer(object):
+
+    """
+    the live api. publish is called by the controller after every loop,
+    take_changes gives the control changes received since the last call
+    """
+
+    def __init__(self, controller, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_clients=MAX_CLIENTS,
+                 send_queue_messages=SEND_QUEUE_MESSAGES):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.send_queue_messages = send_queue_messages
+        self.map = {}
+        self.clients = set()
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.changes = []
+        self.state = dict((category, {}) for category in CATEGORIES)
+        self.sequence = None
+        self.listener = None
+        self.thread = None
+        self.running = False
+        self.refused = 0
+        self.resyncs = 0
+        self.published = 0
+
+    def start(self):
+        """listen and serve on a daemon thread"""
+        self.listener = Listener(self, self.host, self.port)
+        self.port = self.listener.socket.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        LOG.info("live api listening on {}:{}", self.host, self.port)
+
+    def run(self):
+        """the server thread"""
+        while self.running:
+            asyncore.loop(POLL_S, False, self.map, 1)
+
+    def stop(self):
+        """stop serving and close every connection"""
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        asyncore.close_all(self.map)
+
+    def last_error(self):
+        """the exception being handled, for the error logs"""
+        return asyncore.compact_traceback()[2]
+
+    def subscribe(self, client):
+        """start sending a websocket client the state and its deltas"""
+        # under the publish lock so the client gets either the state
+        # before a publish and its delta, or the state after it
+        with self.lock:
+            client.queue.put(encode_frame(json.dumps(self.full_message())))
+            self.subscribers.add(client)
+
+    def unsubscribe(self, client):
+        """stop sending to a client"""
+        with self.lock:
+            self.subscribers.discard(client)
+
+    def full_message(self):
+        """the full state message sent when a client subscribes"""
+        return dict(self.state, type="state", sequence=self.sequence)
+
+    def publish(self, sequence, fresh, present):
+        """
+        the state after a loop. fresh is {category: {name: state}} of the
+        entries the loop updated, present is {category: names} of the
+        entries that still exist, the others keep their last state.
+        websocket clients are sent what changed
+        """
+        last = self.state
+        state = {}
+        for category in CATEGORIES:
+            entries = last.get(category, {})
+            current = dict((name, entries[name])
+                           for name in present.get(category, ())
+                           if name in entries)
+            current.update(fresh.get(category, {}))
+            state[category] = current
+
+        delta = state_delta(last, state)
+        with self.lock:
+            self.state = state
+            self.sequence = sequence
+            subscribers = list(self.subscribers)
+        self.published += 1
+
+        full_frame = None
+        delta_frame = None
+        for client in subscribers:
+            queue = client.queue
+            if queue is None:
+                continue
+
+            if queue.stale:
+                if full_frame is None:
+                    full_frame = encode_frame(json.dumps(self.full_message()))
+                queue.resync(full_frame)
+                self.resyncs += 1
+            elif delta:
+                if delta_frame is None:
+                    delta_frame = encode_frame(json.dumps(
+                        dict(delta, type="delta", sequence=sequence)))
+                queue.put(delta_frame)
+
+    def queue_change(self, name, change):
+        """
+        validate a control change for an output and hold it for the next
+        loop tick. raises LookupError for an unknown output and
+        ValueError for an invalid change
+        """
+        if name not in self.controller.outputs:
+            raise LookupError("Unknown output '{}'".format(name))
+
+        control = parse_control(change)
+        with self.lock:
+            self.changes.append((name, control))
+
+    def acknowledge(self, name):
+        """
+        acknowledge the alarm of a running program, raises LookupError
+        for an unknown program
+        """
+        prog = self.controller.programs.get(name)
+        if prog is None:
+            raise LookupError("Unknown program '{}'".format(name))
+
+        # safe from any thread, takes effect on the next loop tick
+        prog.acknowledge()
+
+    def take_changes(self):
+        """the (output name, control) changes since the last call"""
+        with self.lock:
+            changes = self.changes
+            self.changes = []
+
+        return changes
+
+    def websocket_message(self, payload):
+        """handle a message from a websocket client, returns the reply"""
+        try:
+            message = json.loads(payload)
+            if not isinstance(message, dict) or \
+                    message.get("type") != "control":
+                raise ValueError("unknown message")
+
+            name = message.get("output")
+            self.queue_change(name, dict(
+                (key, value) for key, value in message.items()
+                if key not in ("type", "output")))
+        except (LookupError, ValueError) as ex:
+            return {"type": "error", "error": str(ex)}
+
+        return {"type": "accepted", "output": name}
+
+    def stats(self):
+        """connection and publish counters"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        return {
+            "clients": len(self.clients),
+            "websockets": len(subscribers),
+            "refused": self.refused,
+            "resyncs": self.resyncs,
+            "published": self.published,
+            "dropped": sum(client.queue.dropped for client in subscribers
+                           if client.queue is not None)
+        }
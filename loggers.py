@@ -1,7 +1,27 @@
 """
 module containing classes related to logging beerery data
 """
+import collections
+import json
+import os
+import threading
+import time
 from pymongo import MongoClient
+import beerery.constants as constants
+import beerery.records as state_records
+import beerery.timeseries as timeseries
+
+# optional logs.json settings for loggers that write in batches
+BATCH_CONFIG_KEYS = ["max_queue", "batch_size", "batch_age_ms", "overflow",
+                     "spill_path"]
+# optional logs.json settings for the file logger
+FILE_CONFIG_KEYS = ["chunk_size", "chunk_age_s", "max_segment_bytes",
+                    "max_segment_age_s"]
+
+
+def record_millis(info_dict):
+    """wall clock milliseconds of a state record's tick, or now"""
+    return int(round(state_records.wall_time(info_dict, time.time()) * 1000))
 
 
 class Logger(object):
@@ -22,37 +42,326 @@ class Logger(object):
         """
         pass
 
+    def close(self):
+        """
+        flush anything pending and release resources
+        """
+        pass
+
 
-class JsonFileLogger(Logger):
+class FileLogger(Logger):
 
     """
-    logger that will eventually write to a local file
+    logger that writes input and output history to local compressed
+    time series files, one series per input and output
     """
 
-    def __init__(self, file_path):
-        pass
+    def __init__(self, directory, **store_config):
+        self.store = timeseries.TimeSeriesStore(directory, **store_config)
 
     def log_input(self, name, info_dict):
-        pass
+        self.store.append("input_{}".format(name), record_millis(info_dict),
+                          info_dict.get("value"))
 
     def log_output(self, name, info_dict):
+        self.store.append("output_{}".format(name), record_millis(info_dict),
+                          info_dict.get("output_value"))
+
+    def query(self, series, start_ms, end_ms):
+        """read back (timestamp ms, value) samples of a series"""
+        return self.store.query(series, start_ms, end_ms)
+
+    def close(self):
+        self.store.flush()
+
+
+class BatchingLogger(Logger):
+
+    """
+    base class for loggers that write records in batches on a background
+    thread. records are pushed onto a bounded queue so logging never
+    blocks the control loop, when the queue is full the overflow policy
+    decides which record is lost or spilled to disk
+    """
+
+    RETRY_S = 5.0
+    # overflowed records held for the flusher to spill, more are dropped
+    MAX_OVERFLOW = 1000
+
+    def __init__(self, max_queue=1000, batch_size=100, batch_age_ms=1000,
+                 overflow=constants.LOG_OVERFLOW_DROP_OLDEST, spill_path=None):
+        if overflow not in (constants.LOG_OVERFLOW_DROP_OLDEST,
+                            constants.LOG_OVERFLOW_DROP_NEWEST,
+                            constants.LOG_OVERFLOW_SPILL):
+            raise Exception("Unknown log overflow policy '{}'".format(overflow))
+
+        if overflow == constants.LOG_OVERFLOW_SPILL and not spill_path:
+            raise Exception("The spill overflow policy requires a spill_path")
+
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_age_s = batch_age_ms / 1000.0
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.queue = collections.deque()
+        # records the queue had no room for, spilled by the flusher
+        self.overflowed = []
+        self.spill_pending = bool(spill_path) and os.path.exists(spill_path)
+        self.condition = threading.Condition(threading.Lock())
+        self.stopped = False
+
+        self.metrics = {
+            "enqueued": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "max_queue_depth": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0,
+            "max_flush_ms": 0
+        }
+
+        self.flusher = threading.Thread(target=self.run,
+                                        name="log-flusher")
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def log_input(self, name, info_dict):
+        self.enqueue("input_{}".format(name), info_dict)
+
+    def log_output(self, name, info_dict):
+        self.enqueue("output_{}".format(name), info_dict)
+
+    def enqueue(self, collection, info_dict):
+        """
+        queue a record for the next batch. state records are shared as
+        they never change, dicts are copied since the same dict may be
+        shared with other consumers
+        """
+        if not isinstance(info_dict, state_records.StateRecord):
+            info_dict = dict(info_dict)
+
+        record = (collection, info_dict, time.time())
+
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                if self.overflow == constants.LOG_OVERFLOW_DROP_NEWEST:
+                    self.metrics["dropped"] += 1
+                    return
+                elif self.overflow == constants.LOG_OVERFLOW_SPILL:
+                    self.overflow_record(record)
+                    return
+
+                self.queue.popleft()
+                self.metrics["dropped"] += 1
+
+            self.queue.append(record)
+            self.metrics["enqueued"] += 1
+            self.metrics["max_queue_depth"] = max(
+                self.metrics["max_queue_depth"], len(self.queue))
+
+            # wake the flusher to start the age timer or write a full batch
+            if len(self.queue) == 1 or len(self.queue) >= self.batch_size:
+                self.condition.notify()
+
+    def overflow_record(self, record):
+        """
+        hand a record that didn't fit on the queue to the flusher to
+        spill, called with the lock held. dropped if the flusher has
+        fallen too far behind on spilling as well
+        """
+        if len(self.overflowed) >= BatchingLogger.MAX_OVERFLOW:
+            self.metrics["dropped"] += 1
+            return
+
+        self.overflowed.append(record)
+        self.condition.notify()
+
+    def spill(self, records):
+        """
+        append records to the spill file, only called on the flusher
+        thread without the lock held
+        """
+        with open(self.spill_path, "a") as spill_file:
+            for collection, info_dict, queued in records:
+                document = state_records.serializable(info_dict)
+                spill_file.write(json.dumps([collection, document, queued]))
+                spill_file.write("\n")
+
+        self.spill_pending = True
+        self.metrics["spilled"] += len(records)
+
+    def unspill(self):
+        """
+        move spilled records back onto the queue once it has emptied,
+        only called on the flusher thread without the lock held
+        """
+        self.spill_pending = False
+        if not os.path.exists(self.spill_path):
+            return
+
+        with open(self.spill_path) as spill_file:
+            records = [tuple(json.loads(line)) for line in spill_file]
+        os.remove(self.spill_path)
+
+        with self.condition:
+            room = self.max_queue - len(self.queue)
+            self.queue.extend(records[:room])
+
+        if records[room:]:
+            self.spill(records[room:])
+            self.metrics["spilled"] -= len(records[room:])
+
+    def next_batch(self):
+        """
+        wait until a full batch is queued, the oldest record is old
+        enough or records overflowed. returns the overflowed records to
+        spill and the batch popped to write
+        """
+        with self.condition:
+            while not self.stopped and not self.overflowed:
+                if len(self.queue) >= self.batch_size:
+                    break
+
+                wait_s = None
+                if self.queue:
+                    wait_s = self.queue[0][2] + self.batch_age_s - time.time()
+                    if wait_s <= 0:
+                        break
+                elif self.spill_pending:
+                    # replayed by the flusher now the queue has emptied
+                    break
+
+                self.condition.wait(wait_s)
+
+            if self.overflowed:
+                overflowed = self.overflowed
+                self.overflowed = []
+                return overflowed, []
+
+            count = min(self.batch_size, len(self.queue))
+            return [], [self.queue.popleft() for _ in xrange(count)]
+
+    def requeue(self, batch):
+        """put a failed batch back at the front of the queue"""
+        with self.condition:
+            room = self.max_queue - len(self.queue)
+            self.queue.extendleft(reversed(batch[:room]))
+            for record in batch[room:]:
+                if self.overflow == constants.LOG_OVERFLOW_SPILL:
+                    self.overflow_record(record)
+                else:
+                    self.metrics["dropped"] += 1
+
+    def flush_batch(self, batch):
+        """
+        write a batch grouped by collection. stops at the first
+        collection that fails to write, returns the records that
+        weren't written so only those are retried
+        """
+        collections_to_write = collections.OrderedDict()
+        for collection, info_dict, _ in batch:
+            collections_to_write.setdefault(collection, []).append(
+                state_records.serializable(info_dict))
+
+        started = time.time()
+        written = set()
+        try:
+            for collection, documents in collections_to_write.items():
+                self.write_batch(collection, documents)
+                written.add(collection)
+        except Exception:  # pylint: disable=W0703
+            unwritten = [r for r in batch if r[0] not in written]
+            self.metrics["written"] += len(batch) - len(unwritten)
+            return unwritten
+
+        flush_ms = (time.time() - started) * 1000.0
+        self.metrics["written"] += len(batch)
+        self.metrics["batches"] += 1
+        self.metrics["last_batch_size"] = len(batch)
+        self.metrics["last_flush_ms"] = flush_ms
+        self.metrics["max_flush_ms"] = max(self.metrics["max_flush_ms"],
+                                           flush_ms)
+        return []
+
+    def write_batch(self, collection, documents):
+        """write documents to a collection, implemented by loggers"""
         pass
 
+    def run(self):
+        """flusher thread loop"""
+        while True:
+            overflowed, batch = self.next_batch()
+            if overflowed:
+                self.spill(overflowed)
+                continue
+
+            if not batch and self.spill_pending and not self.stopped:
+                self.unspill()
+                continue
+
+            if batch:
+                unwritten = self.flush_batch(batch)
+                if unwritten:
+                    self.metrics["failed_batches"] += 1
+                    self.requeue(unwritten)
+                    if self.stopped:
+                        self.abandon()
+                        return
+
+                    time.sleep(BatchingLogger.RETRY_S)
+                    continue
+
+            if self.stopped and not self.queue and not self.overflowed:
+                return
+
+    def abandon(self):
+        """
+        give up on the queued records when closing while the
+        destination is failing, spilling them if possible
+        """
+        with self.condition:
+            records = self.overflowed + list(self.queue)
+            self.overflowed = []
+            self.queue.clear()
 
-class MongoDBLogger(Logger):
+        if self.overflow == constants.LOG_OVERFLOW_SPILL:
+            if records:
+                self.spill(records)
+        else:
+            self.metrics["dropped"] += len(records)
+
+    def queue_depth(self):
+        """number of records waiting to be written"""
+        return len(self.queue)
+
+    def get_metrics(self):
+        """returns the logger metrics including the current queue depth"""
+        metrics = dict(self.metrics)
+        metrics["queue_depth"] = self.queue_depth()
+        return metrics
+
+    def close(self, timeout=None):
+        """write everything that is queued and stop the flusher"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+        self.flusher.join(timeout)
+
+
+class MongoDBLogger(BatchingLogger):
 
     """
     Logger that writes to a mongo db database
     """
 
-    def __init__(self, db_uri, database):
+    def __init__(self, db_uri, database, **batch_config):
         self.client = MongoClient(db_uri)
         self.database = self.client[database]
+        super(MongoDBLogger, self).__init__(**batch_config)
 
-    def log_input(self, name, info_dict):
-        input_collection = self.database["input_{}".format(name)]
-        input_collection.insert(info_dict)
-
-    def log_output(self, name, info_dict):
-        output_collection = self.database["output_{}".format(name)]
-        output_collection.insert(info_dict)
+    def write_batch(self, collection, documents):
+        self.database[collection].insert(documents)
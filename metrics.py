@@ -0,0 +1,192 @@
+"""
+control loop timing metrics. values are recorded into HDR style
+histograms, log-linear buckets with a fixed relative error, so recording
+is cheap and percentiles can be read at any time without keeping samples
+"""
+import threading
+import time
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS  # ~1.6% relative error
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+UNITS_PER_MS = 1000  # values are kept as integer microseconds
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def now_ms():
+    """wall clock time in fractional milliseconds, for timing work"""
+    return time.time() * 1000.0
+
+
+def bucket_index(value):
+    """bucket of an integer value"""
+    if value < SUB_BUCKET_COUNT:
+        return value
+
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + \
+        (value >> shift) - SUB_BUCKET_HALF
+
+
+def bucket_range(index):
+    """(lowest value, width) of a bucket"""
+    if index < SUB_BUCKET_COUNT:
+        return index, 1
+
+    shift = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+    sub_bucket = (index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + \
+        SUB_BUCKET_HALF
+    return sub_bucket << shift, 1 << shift
+
+
+class Histogram(object):
+
+    """
+    distribution of millisecond values, safe to record from any thread
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, value_ms):
+        """record a value in milliseconds"""
+        value = max(0, int(value_ms * UNITS_PER_MS))
+        index = bucket_index(value)
+
+        with self.lock:
+            if index >= len(self.counts):
+                self.counts.extend([0] * (index + 1 - len(self.counts)))
+
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+
+    def percentile(self, percent):
+        """value in milliseconds below which percent of values fall"""
+        with self.lock:
+            return self.percentile_locked(percent)
+
+    def percentile_locked(self, percent):
+        """percentile, called with the lock held"""
+        if not self.count:
+            return None
+
+        wanted = max(1, int(round(percent / 100.0 * self.count)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= wanted:
+                lowest, width = bucket_range(index)
+                value = lowest + (width - 1) / 2.0
+                value = min(max(value, self.minimum), self.maximum)
+                return value / float(UNITS_PER_MS)
+
+        return self.maximum / float(UNITS_PER_MS)
+
+    def reset(self):
+        """forget every value"""
+        with self.lock:
+            self.counts = []
+            self.count = 0
+            self.total = 0
+            self.minimum = None
+            self.maximum = None
+
+    def snapshot(self):
+        """count, min, max, mean and percentiles in milliseconds"""
+        with self.lock:
+            snapshot = {
+                "count": self.count,
+                "min_ms": None,
+                "max_ms": None,
+                "mean_ms": None
+            }
+
+            if self.count:
+                snapshot["min_ms"] = self.minimum / float(UNITS_PER_MS)
+                snapshot["max_ms"] = self.maximum / float(UNITS_PER_MS)
+                snapshot["mean_ms"] = self.total / float(
+                    self.count * UNITS_PER_MS)
+
+            for percent in PERCENTILES:
+                snapshot["p{}_ms".format(percent)] = \
+                    self.percentile_locked(percent)
+
+            return snapshot
+
+
+class LoopMetrics(object):
+
+    """
+    named histograms for the control loop. phases are named after
+    the part of the loop, per input reads are input.<name>
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def histogram(self, name):
+        """the histogram for a name, created when first used"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+
+        return histogram
+
+    def record(self, name, value_ms):
+        """record a value in milliseconds"""
+        self.histogram(name).record(value_ms)
+
+    def snapshot(self):
+        """snapshot of every histogram by name"""
+        with self.lock:
+            histograms = dict(self.histograms)
+
+        return dict((name, histogram.snapshot())
+                    for name, histogram in histograms.items())
+
+    def reset(self):
+        """reset every histogram"""
+        with self.lock:
+            histograms = self.histograms.values()
+
+        for histogram in histograms:
+            histogram.reset()
+
+
+class PhaseTimer(object):
+
+    """
+    times consecutive phases of a loop iteration, lap records the time
+    since the previous lap under the phase's name
+    """
+
+    def __init__(self, loop_metrics):
+        self.loop_metrics = loop_metrics
+        self.last_ms = now_ms()
+        self.iteration_ms = self.last_ms
+
+    def start_iteration(self):
+        """an iteration is starting"""
+        self.iteration_ms = self.last_ms
+
+    def lap(self, phase):
+        """record the time since the last lap for a phase"""
+        lap_ms = now_ms()
+        self.loop_metrics.record(phase, lap_ms - self.last_ms)
+        self.last_ms = lap_ms
+
+    def end_iteration(self, name="iteration"):
+        """record the time since start_iteration"""
+        self.loop_metrics.record(name, now_ms() - self.iteration_ms)
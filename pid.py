@@ -3,12 +3,16 @@ PID implementation based on posts in this series:
 http://brettbeauregard.com/blog/2011/04/improving-the-beginners-pid-introduction/
 """
 
-import time
+import beerery.clock as clock
+
+# the control loop wakes sample_time_ms apart give or take its jitter,
+# a sample is due when at most this fraction of the period early
+SAMPLE_TIME_TOLERANCE = 0.1
 
 
 def millis():
     """returns current time as milliseconds"""
-    return int(round(time.time() * 1000))
+    return clock.millis()
 
 
 def clamp(value, min_val, max_val):
@@ -103,7 +107,11 @@ class PidController(object):
 
             self.sample_time_ms = sample_time_ms
 
-    def compute(self):
+    def compute(self, now_ms=None):
+        """
+        compute the output if a sample is due. now_ms is the loop's
+        tick time, the current time if not given
+        """
         if self.mode == PidController.MANUAL_MODE:
             # just return, output should already be set in manual
             return True
@@ -122,10 +130,10 @@ class PidController(object):
             return True
 
         # calculate time since last compute
-        now = millis()
+        now = millis() if now_ms is None else now_ms
         time_change = now - self.last_time
 
-        if time_change >= self.sample_time_ms:
+        if time_change >= self.sample_time_ms * (1 - SAMPLE_TIME_TOLERANCE):
             # add to running error total
             self.i_term += (self.ki * error)
             # clamp to min/max
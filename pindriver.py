@@ -0,0 +1,193 @@
+"""
+gpio output driver. the driver keeps a shadow register of the mode and
+level of every pin it set up, so writes that wouldn't change a pin are
+dropped without touching the hardware and the mode never has to be read
+back before a write. changes are applied with bulk set and clear calls
+on a backend, writes made inside a batch are applied together when the
+batch ends
+"""
+import threading
+
+OUT = "out"
+
+
+class RpioBackend(object):
+
+    """
+    drives pins with RPIO. RPIO writes one pin per call so bulk sets
+    and clears are a loop, the driver still saves the mode reads and
+    the redundant writes
+    """
+
+    def __init__(self, rpio):
+        self.rpio = rpio
+
+    def setup(self, pin, level):
+        """make a pin an output at a level"""
+        self.rpio.setup(pin, self.rpio.OUT,
+                        initial=self.rpio.HIGH if level else self.rpio.LOW)
+
+    def set_pins(self, pins):
+        """drive pins high"""
+        for pin in pins:
+            self.rpio.output(pin, True)
+
+    def clear_pins(self, pins):
+        """drive pins low"""
+        for pin in pins:
+            self.rpio.output(pin, False)
+
+    def cleanup(self):
+        """release every pin"""
+        self.rpio.cleanup()
+
+
+class MemoryBackend(object):
+
+    """
+    pins held in memory for tests. every bulk write is recorded as
+    (time ms, level, pins) using the time function given
+    """
+
+    def __init__(self, time_ms=None):
+        self.time_ms = time_ms or (lambda: None)
+        self.levels = {}
+        self.writes = []
+
+    def setup(self, pin, level):
+        """make a pin an output at a level"""
+        self.levels[pin] = level
+
+    def set_pins(self, pins):
+        """drive pins high"""
+        self.write(pins, True)
+
+    def clear_pins(self, pins):
+        """drive pins low"""
+        self.write(pins, False)
+
+    def write(self, pins, level):
+        """record a bulk write"""
+        for pin in pins:
+            self.levels[pin] = level
+        self.writes.append((self.time_ms(), level, tuple(pins)))
+
+    def edges(self, pin):
+        """(time ms, level) of the writes that included a pin"""
+        return [(at, level) for at, level, pins in self.writes if pin in pins]
+
+    def cleanup(self):
+        """release every pin"""
+        self.levels = {}
+
+
+class PinDriver(object):
+
+    """
+    shadow register of output pins in front of a backend
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.modes = {}
+        self.levels = {}
+        self.counters = {
+            "requested": 0,
+            "redundant": 0,
+            "refused": 0,
+            "pin_writes": 0,
+            "bulk_writes": 0
+        }
+
+    def setup_output(self, pin, level=False):
+        """make a pin an output, the pin is driven to level"""
+        with self.lock:
+            self.backend.setup(pin, level)
+            self.modes[pin] = OUT
+            self.levels[pin] = level
+
+    def release(self, pin):
+        """forget a pin, writes to it are refused until it is set up"""
+        with self.lock:
+            self.modes.pop(pin, None)
+            self.levels.pop(pin, None)
+
+    def mode(self, pin):
+        """the shadow mode of a pin, None if it isn't set up"""
+        return self.modes.get(pin)
+
+    def level(self, pin):
+        """the shadow level of a pin"""
+        return self.levels.get(pin)
+
+    def write(self, pin, level):
+        """drive a pin"""
+        self.write_many([(pin, level)])
+
+    def write_many(self, changes):
+        """
+        drive pins, changes is a list of (pin, level). inside a batch the
+        changes are held until the batch ends
+        """
+        pending = getattr(self.local, "pending", None)
+        if pending is not None:
+            pending.extend(changes)
+            return
+
+        self.apply(changes)
+
+    def begin_batch(self):
+        """hold this thread's writes until end_batch"""
+        self.local.pending = []
+
+    def end_batch(self):
+        """apply the writes held since begin_batch"""
+        pending = self.local.pending
+        self.local.pending = None
+        if pending:
+            self.apply(pending)
+
+    def apply(self, changes):
+        """apply changes with one bulk set and one bulk clear"""
+        with self.lock:
+            # the last change of a pin wins
+            wanted = {}
+            for pin, level in changes:
+                wanted[pin] = bool(level)
+            self.counters["requested"] += len(changes)
+
+            set_pins = []
+            clear_pins = []
+            for pin in sorted(wanted):
+                level = wanted[pin]
+                if self.modes.get(pin) != OUT:
+                    self.counters["refused"] += 1
+                elif self.levels.get(pin) == level:
+                    self.counters["redundant"] += 1
+                else:
+                    self.levels[pin] = level
+                    (set_pins if level else clear_pins).append(pin)
+
+            if set_pins:
+                self.backend.set_pins(set_pins)
+                self.counters["bulk_writes"] += 1
+            if clear_pins:
+                self.backend.clear_pins(clear_pins)
+                self.counters["bulk_writes"] += 1
+            self.counters["pin_writes"] += len(set_pins) + len(clear_pins)
+
+    def cleanup(self):
+        """release every pin on the backend"""
+        with self.lock:
+            self.backend.cleanup()
+            self.modes = {}
+            self.levels = {}
+
+    def stats(self):
+        """write counters, requested writes against hardware writes"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pins"] = len(self.modes)
+            return stats
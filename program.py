@@ -1,8 +1,28 @@
 """
-programs for running the controllers
+programs for running the controllers. a program is a state machine that
+runs the actions of its steps in order, changing the output controllers
+in memory. an action that completes starts the next action in the same
+loop tick
 """
+import threading
+import beerery.configstore as configstore
+import beerery.constants as constants
 import beerery.fileio as fileio
-from pprint import pprint
+import beerery.pid as PID
+
+MINUTE_MS = 60 * 1000
+DEFAULT_ALARM_MS = 10 * 1000
+# guard against a program that never stops transitioning in a tick
+MAX_TRANSITIONS_PER_TICK = 100
+END_OFF = "off"
+
+
+def minutes_to_ms(minutes):
+    """timer length in ms for a config value in minutes, None if not set"""
+    if minutes is None:
+        return None
+
+    return int(minutes * MINUTE_MS)
 
 
 class Program(object):
@@ -12,11 +32,20 @@ class Program(object):
     programs are configured in config/programs.json.
     """
 
-    def __init__(self, program_config):
+    def __init__(self, program_config, output_repository=None):
         super(Program, self).__init__()
         self.name = program_config["name"]
         self.config = program_config
+        self.output_repository = output_repository or \
+            configstore.outputs_repository()
         self.steps = []
+        self.sequence = []
+        self.position = 0
+        self.state = constants.PROGRAM_IDLE
+        self.error = None
+        self.alarm_until_ms = None
+        self.acknowledged = threading.Event()
+        self.changed_outputs = set()
 
         self.initialize_steps()
 
@@ -28,19 +57,122 @@ class Program(object):
             step = ProgramStep(self, step_config)
             self.steps.append(step)
 
-    def run(self):
+        self.sequence = [(step, action) for step in self.steps
+                         for action in step.actions]
+
+    def current(self):
+        """(step, action) being run or None"""
+        if self.position < len(self.sequence):
+            return self.sequence[self.position]
+
+        return None
+
+    def run(self, now_ms, inputs, outputs):
         """
-        calculate any changes needed based on the time.
-        returns True if an input or output change resulted
+        advance the program for a loop tick, changing the outputs it
+        controls in memory. returns True if the program moved on
         """
-        # action = self.steps[0].actions[0]
-        # action.apply()
-        # for step in self.steps:
-        #     for action in step.actions:
-        #         action.apply()
+        if self.state in (constants.PROGRAM_COMPLETE,
+                          constants.PROGRAM_FAILED):
+            return False
+
+        changed = False
+
+        try:
+            if self.state == constants.PROGRAM_IDLE:
+                self.start(now_ms)
+                changed = True
 
-    def start(self):
+            for _ in xrange(MAX_TRANSITIONS_PER_TICK):
+                current = self.current()
+                if current is None:
+                    break
+
+                action = current[1]
+                if not action.update(now_ms, inputs, outputs):
+                    break
+
+                action.finish(now_ms, outputs)
+                self.advance(now_ms)
+                changed = True
+        except Exception as ex:  # pylint: disable=W0703
+            self.state = constants.PROGRAM_FAILED
+            self.error = str(ex)
+            changed = True
+
+        if self.alarm_until_ms is not None and now_ms >= self.alarm_until_ms:
+            self.alarm_until_ms = None
+            changed = True
+
+        if changed:
+            fileio.log_program_state(self.name, self.program_state(now_ms))
+
+        return changed
+
+    def start(self, now_ms):
         """activate the program and start running it"""
+        self.position = 0
+        self.state = constants.PROGRAM_RUNNING
+        self.start_current(now_ms)
+
+    def advance(self, now_ms):
+        """move on to the next action"""
+        self.position += 1
+        self.state = constants.PROGRAM_RUNNING
+        self.start_current(now_ms)
+
+    def start_current(self, now_ms):
+        """start the current action or complete the program"""
+        current = self.current()
+        if current is None:
+            self.state = constants.PROGRAM_COMPLETE
+        else:
+            current[1].start(now_ms)
+
+    def raise_alarm(self, now_ms, alarm_ms):
+        """sound the alarm for alarm_ms"""
+        self.alarm_until_ms = now_ms + alarm_ms
+
+    def alarm(self):
+        """True while the alarm is sounding"""
+        return self.alarm_until_ms is not None
+
+    def wait_for_acknowledge(self):
+        """pause the program until acknowledge is called"""
+        self.acknowledged.clear()
+        self.state = constants.PROGRAM_WAITING
+
+    def acknowledge(self):
+        """
+        acknowledge the alarm and continue a waiting program, safe to
+        call from any thread. takes effect on the next loop tick
+        """
+        self.acknowledged.set()
+
+    def output_changed(self, output_name):
+        """record an output changed in memory so it will be saved"""
+        self.changed_outputs.add(output_name)
+
+    def take_changed_outputs(self):
+        """names of outputs changed since the last call"""
+        changed = self.changed_outputs
+        self.changed_outputs = set()
+        return changed
+
+    def program_state(self, now_ms):
+        """state of the program for the state files"""
+        current = self.current()
+        step, action = current if current else (None, None)
+
+        return {
+            "name": self.name,
+            "state": self.state,
+            "step": step.name if step else None,
+            "action": action.description if action else None,
+            "remaining_ms": action.remaining_ms(now_ms) if action else None,
+            "alarm": self.alarm(),
+            "error": self.error
+        }
 
 
 class ProgramStep(object):
@@ -60,133 +192,250 @@ class ProgramStep(object):
         """
         for action_config in self.config["actions"]:
             if "action" in action_config:
-                pass  # don't do anything yet
+                self.actions.append(BasicAction(self.program, action_config))
             elif "type" in action_config:
                 action_type = action_config["type"]
 
                 if action_type == "PID":
-                    step = PIDAction(self.program, action_config)
-                    self.actions.append(step)
+                    self.actions.append(PIDAction(self.program,
+                                                  action_config))
+                else:
+                    raise Exception(
+                        "Unknown action type '{}'. program: {}".format(
+                            action_type, self.program.name))
 
 
 class ProgramAction(object):
 
-    """docstring for ProgramAction"""
+    """
+    base class for the actions run by a program. start is called when
+    the action becomes current, update every loop tick until it returns
+    True and then finish
+    """
 
     def __init__(self, program, action_config):
         super(ProgramAction, self).__init__()
-        self.type = action_config["type"]
         self.program = program
-        self.output_config = None
-        self.output_dict = None
-        self.output_name = action_config["output_name"]
+        self.config = action_config
+        self.description = action_config.get("description", "")
+        self.deadline_ms = None
 
-    def apply(self):
+    def start(self, now_ms):
+        """the action became the current action"""
+        self.deadline_ms = None
+
+    def read_output_config(self, output_name, snapshot=None):
         """
-        apply the step to the output config files as needed
+        returns the (immutable) config for an output from the shared
+        outputs config snapshot
         """
-        pass
+        snapshot = snapshot or self.program.output_repository.snapshot()
+
+        output = snapshot.get(output_name)
+        if output is None:
+            raise Exception(
+                "Output '{}' not found. program: {}".format(output_name,
+                                                            self.program.name))
+
+        return output
 
-    def could_be_active(self):
+    def commit_output_changes(self, output_name, changes):
         """
-        determine if this action could be active given
-        current state of the system
+        commit {"active": ..., "config": {...}} changes to an output's
+        config through the shared repository, retried with a fresh
+        snapshot if another writer got there first
         """
-        pass
+        def update(outputs):
+            """apply the changes to the editable output config"""
+            output = [o for o in outputs if o["name"] == output_name][0]
+            if "active" in changes:
+                output["active"] = changes["active"]
+            output["type"]["config"].update(changes.get("config", {}))
+
+        return self.program.output_repository.commit_latest(update)
 
-    def read_output_config(self):
+    def update(self, now_ms, inputs, outputs):
         """
-        reads the outputs config json file and returns the dict
-        for the output associated with this action
+        apply the action for a loop tick, returns True when complete
         """
-        if self.output_dict:
-            return self.output_dict
+        return True
 
-        self.output_config = fileio.load_config_from_json_file(
-            "config/outputs.json")
-        output = [
-            o for o in self.output_config if o["name"] == self.output_name]
-        if not output or output.count == 0:
-            raise Exception(
-                "Output '{}' not found. program: {}".format(self.output_name,
-                                                            self.program.name))
+    def finish(self, now_ms, outputs):
+        """the action completed"""
+        pass
+
+    def start_timer(self, now_ms, timer_ms):
+        """start the action's timer"""
+        self.deadline_ms = now_ms + timer_ms
 
-        self.output_dict = output[0]
-        return self.output_dict
+    def timer_expired(self, now_ms):
+        """True if the action's timer ran out"""
+        return self.deadline_ms is not None and now_ms >= self.deadline_ms
+
+    def remaining_ms(self, now_ms):
+        """time left on the action's timer, None without a timer"""
+        if self.deadline_ms is None:
+            return None
+
+        return max(0, self.deadline_ms - now_ms)
 
 
 class BasicAction(ProgramAction):
 
     """
     Program action for basic actions like 'alarm', 'wait', etc.
+    wait pauses the program until acknowledged or, if the action has
+    a "wait" time in minutes, until the time runs out
     """
 
     def __init__(self, program, action_config):
         super(BasicAction, self).__init__(program, action_config)
-        self.config_changed = False
+        self.actions = [a.strip() for a in action_config["action"].split(",")]
+        self.alarm_ms = action_config.get("alarm_seconds",
+                                          DEFAULT_ALARM_MS / 1000) * 1000
+        self.wait_ms = minutes_to_ms(action_config.get("wait"))
+
+        if not self.description:
+            self.description = action_config["action"]
+
+    def start(self, now_ms):
+        super(BasicAction, self).start(now_ms)
+
+        if "alarm" in self.actions:
+            self.program.raise_alarm(now_ms, self.alarm_ms)
+
+        if "wait" in self.actions:
+            self.program.wait_for_acknowledge()
+            if self.wait_ms is not None:
+                self.start_timer(now_ms, self.wait_ms)
+
+    def update(self, now_ms, inputs, outputs):
+        if "wait" not in self.actions:
+            return True
+
+        return self.program.acknowledged.is_set() or \
+            self.timer_expired(now_ms)
 
 
 class PIDAction(ProgramAction):
 
     """
-    an action that controls a PID output
+    an action that controls a PID output. "output" is either "PID" to
+    control to the setpoint or a fixed output %. the action completes
+    after its "duration" in minutes, or once the input reaches the
+    setpoint, or "hold" minutes after reaching it. "end": "off" turns
+    the output off when the action completes. an inactive output is
+    activated in outputs.json with the action's settings and the action
+    waits for the reload to start it
     """
 
     def __init__(self, program, action_config):
         super(PIDAction, self).__init__(program, action_config)
+        self.output_name = action_config["output_name"]
         self.output = action_config.get("output")
         self.setpoint = action_config.get("setpoint")
-        self.config_changed = False
+        self.end = action_config.get("end")
+        self.duration_ms = minutes_to_ms(action_config.get("duration"))
+        self.hold_ms = minutes_to_ms(action_config.get("hold"))
+        self.reached_ms = None
+
+    def start(self, now_ms):
+        super(PIDAction, self).start(now_ms)
+        self.reached_ms = None
+
+        if self.duration_ms is not None:
+            self.start_timer(now_ms, self.duration_ms)
+
+    def control_settings(self):
+        """the controller mode and values this action sets"""
+        if self.output == "PID":
+            return {"mode": PID.PidController.AUTO_MODE,
+                    "set_point": self.setpoint}
+
+        return {"mode": PID.PidController.MANUAL_MODE,
+                "set_point": self.setpoint,
+                "output": self.output}
 
-    def validate_config(self, set_active):
+    def validate_config(self, output_config):
         """
-        validates that the output config to write to has the proper settings
+        validates that the output to control has the proper settings
         """
-        output = self.read_output_config()
-        if not output:
-            raise Exception(
-                "Output '{}' not found. program: {}".format(self.output_name,
-                                                            self.program.name))
-
-        correct_conf = "controller" in output["type"]
-        correct_conf = correct_conf and output["type"]["controller"] == "PID"
-        if not correct_conf:
+        output_type = output_config["type"]
+        if not isinstance(output_type, dict) or output_type["controller"] != \
+                constants.PID_OUTPUT_CONTROLLER_TYPE:
             raise Exception(
                 "'{}' must be type PID. program: {}".format(self.output_name,
                                                             self.program.name))
 
-        output_type = output["type"]
-        correct_conf = "config" in output_type
-        if correct_conf:
-            type_config = output_type["config"]
-            correct_conf = "set_point" in type_config and "mode" in type_config
-
-        if not correct_conf:
-            err_msg = "'{}' must have correct config key. program: {}"
-            raise Exception(err_msg.format(self.output_name,
-                                           self.program.name))
-
-        if output["active"] != set_active:
-            output["active"] = set_active
-            self.config_changed = True
-
-        return type_config
-
-    def apply(self):
-        self.config_changed = False
-
-        config = self.validate_config(True)
+    def output_for(self, outputs):
+        """
+        the running output for this action, None if it isn't active
+        """
+        output = outputs.get(self.output_name)
+        if output is None:
+            return None
 
-        if self.output == "PID":
-            if config["mode"] != 1 or config["set_point"] != self.setpoint:
-                self.config_changed = True
-                config["mode"] = 1
-                config["set_point"] = self.setpoint
-        else:
-            if config["mode"] != 0 or config["output"] != self.output:
-                self.config_changed = True
-                config["mode"] = 0
-                config["output"] = self.output
+        self.validate_config(output.config)
+        return output
 
-        if self.config_changed:
-            fileio.save_output_config(self.output_config)
+    def activate_output(self):
+        """
+        set the output active in outputs.json with this action's
+        settings, the config reload then starts it. returns True if
+        the config was changed
+        """
+        output_config = self.read_output_config(self.output_name)
+        self.validate_config(output_config)
+        if output_config["active"]:
+            # already activated, waiting for the reload
+            return False
+
+        settings = dict((key, value) for key, value
+                        in self.control_settings().items()
+                        if value is not None)
+        self.commit_output_changes(self.output_name,
+                                   {"active": True, "config": settings})
+        return True
+
+    def update(self, now_ms, inputs, outputs):
+        output = self.output_for(outputs)
+        if output is None:
+            self.activate_output()
+            return False
+
+        # applied every tick so a rebuilt output gets the settings too
+        if output.set_control(**self.control_settings()):
+            self.program.output_changed(self.output_name)
+
+        if self.duration_ms is not None:
+            return self.timer_expired(now_ms)
+
+        if self.setpoint is None:
+            return True
+
+        if self.reached_ms is None and \
+                self.setpoint_reached(inputs.get(output.input)):
+            self.reached_ms = now_ms
+            if self.hold_ms is not None:
+                self.start_timer(now_ms, self.hold_ms)
+
+        if self.hold_ms is not None:
+            return self.timer_expired(now_ms)
+
+        return self.reached_ms is not None
+
+    def setpoint_reached(self, input_object):
+        """True if the output's input is at or above the setpoint"""
+        if input_object is None or input_object.last_value is None:
+            return False
+
+        return input_object.last_value >= self.setpoint
+
+    def finish(self, now_ms, outputs):
+        if self.end != END_OFF:
+            return
+
+        output = self.output_for(outputs)
+        if output is not None and output.set_control(
+                PID.PidController.MANUAL_MODE, output=0):
+            self.program.output_changed(self.output_name)
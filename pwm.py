@@ -0,0 +1,172 @@
+"""
+pulse width modulation for PWM mode outputs. every PWM pin shares one
+carrier period and one edge schedule: all pins with a duty go high at the
+start of the period and each goes low after its share of it. the schedule
+is precomputed when a duty changes, each period costs one timer callback
+per distinct edge no matter how many pins share the edge
+"""
+import threading
+import beerery.clock as clock
+
+DEFAULT_PERIOD_MS = 200
+CALLBACK_GROUP = "pwm"
+
+
+def edge_schedule(duties, period_ms):
+    """
+    the edges of a period for {pin: duty percent}, a list of
+    (offset ms, [(pin, level)]) in time order. offset 0 sets every pin,
+    high if it has a duty and low otherwise, pins below 100% go low at
+    the end of their duty
+    """
+    start = []
+    lows = {}
+    for pin, duty in sorted(duties.items()):
+        # duties are quantised to whole milliseconds of the period
+        offset_ms = int(round(duty / 100.0 * period_ms))
+        start.append((pin, offset_ms > 0))
+        if 0 < offset_ms < period_ms:
+            lows.setdefault(offset_ms, []).append((pin, False))
+
+    schedule = [(0, start)] if start else []
+    schedule.extend(sorted(lows.items()))
+    return schedule
+
+
+class PwmScheduler(object):
+
+    """
+    drives the PWM pins from the LoopManager. write_pins is called with
+    the [(pin, level)] changes of an edge
+    """
+
+    def __init__(self, loop_manager, period_ms, write_pins):
+        if period_ms <= 0:
+            raise Exception("Invalid PWM period '{}'".format(period_ms))
+
+        self.loop_manager = loop_manager
+        self.period_ms = period_ms
+        self.write_pins = write_pins
+        self.lock = threading.Lock()
+        self.duties = {}
+        self.owners = {}
+        self.schedule = []
+        self.schedule_current = True
+        self.period_start_ms = None
+        self.periods = 0
+        self.edges = 0
+
+    def set_duty(self, pin, duty, owner=None):
+        """
+        set the duty percent of a pin, used from the next period.
+        the pin is driven by owner until it is removed
+        """
+        duty = min(max(duty, 0), 100)
+        with self.lock:
+            if self.duties.get(pin) != duty:
+                self.duties[pin] = duty
+                self.schedule_current = False
+            self.owners[pin] = owner
+
+            start = self.period_start_ms is None
+
+        if start:
+            self.start()
+
+    def remove(self, pin, owner=None):
+        """
+        stop driving a pin and set it low, ignored if another owner has
+        taken over the pin
+        """
+        with self.lock:
+            if pin not in self.duties or self.owners.get(pin) is not owner:
+                return
+
+            del self.duties[pin]
+            del self.owners[pin]
+            self.schedule_current = False
+
+        self.write_pins([(pin, False)])
+
+    def start(self):
+        """start the periods"""
+        with self.lock:
+            if self.period_start_ms is not None:
+                return
+            self.period_start_ms = clock.millis()
+
+        self.loop_manager.schedule_callback(self.begin_period, 0,
+                                            CALLBACK_GROUP)
+
+    def stop(self):
+        """stop the periods and set every pin low"""
+        self.loop_manager.cancel_group(CALLBACK_GROUP)
+        with self.lock:
+            pins = sorted(self.duties)
+            self.duties = {}
+            self.owners = {}
+            self.schedule = []
+            self.period_start_ms = None
+
+        if pins:
+            self.write_pins([(pin, False) for pin in pins])
+
+    def current_schedule(self):
+        """the edge schedule, rebuilt if a duty changed"""
+        with self.lock:
+            if not self.schedule_current:
+                self.schedule = edge_schedule(self.duties, self.period_ms)
+                self.schedule_current = True
+
+            return self.schedule
+
+    def begin_period(self):
+        """
+        runs at the start of each period on the loop manager thread,
+        drives the offset 0 edge and schedules the rest of the period
+        """
+        now_ms = clock.millis()
+        with self.lock:
+            if self.period_start_ms is None:
+                return
+
+            # a stall longer than a period skips the missed periods
+            if now_ms - self.period_start_ms >= self.period_ms:
+                self.period_start_ms = now_ms
+
+            period_start_ms = self.period_start_ms
+            self.period_start_ms += self.period_ms
+
+        schedule = self.current_schedule()
+        self.periods += 1
+
+        # deadlines are relative to the period start so a late
+        # callback doesn't shift the following edges
+        elapsed_ms = now_ms - period_start_ms
+        for offset_ms, changes in schedule:
+            if offset_ms == 0:
+                self.fire(changes)
+            else:
+                self.loop_manager.schedule_callback(
+                    lambda changes=changes: self.fire(changes),
+                    offset_ms - elapsed_ms, CALLBACK_GROUP)
+
+        self.loop_manager.schedule_callback(
+            self.begin_period, self.period_ms - elapsed_ms, CALLBACK_GROUP)
+
+    def fire(self, changes):
+        """drive the pins of an edge"""
+        self.edges += 1
+        self.write_pins(changes)
+
+    def stats(self):
+        """counters for the scheduler"""
+        with self.lock:
+            pins = len(self.duties)
+
+        return {
+            "period_ms": self.period_ms,
+            "pins": pins,
+            "periods": self.periods,
+            "edges": self.edges
+        }
@@ -0,0 +1,150 @@
+"""
+compact state records for a control loop iteration. a LoopTick is taken
+once per iteration and every input and output record of the iteration
+shares it. records hold the raw values and are shared by the state
+files, the live state table, history and the loggers, so they are never
+changed once built. dates are only formatted when a record is
+serialized, and only once per tick
+"""
+from datetime import datetime
+import beerery.clock as clock
+import beerery.constants as constants
+
+MISSING = object()
+
+
+class LoopTick(object):
+
+    """
+    the timestamps of a control loop iteration. tick_ms is the loop clock
+    used for all control timing, wall_time is the wall clock in seconds
+    """
+
+    __slots__ = ("sequence", "tick_ms", "wall_time", "dates")
+
+    def __init__(self, sequence, tick_ms, wall_time):
+        self.sequence = sequence
+        self.tick_ms = tick_ms
+        self.wall_time = wall_time
+        self.dates = None
+
+    @classmethod
+    def now(cls, sequence=0):
+        """a tick for the current time"""
+        return cls(sequence, clock.millis(), clock.current.time())
+
+    def formatted_dates(self):
+        """(date_servertime, date_utc), formatted the first time needed"""
+        dates = self.dates
+        if dates is None:
+            dates = (
+                datetime.fromtimestamp(self.wall_time).strftime(
+                    constants.DATE_FORMAT),
+                datetime.utcfromtimestamp(self.wall_time).strftime(
+                    constants.DATE_FORMAT))
+            self.dates = dates
+
+        return dates
+
+
+class StateRecord(object):
+
+    """
+    base class for state records. records can be read like the state
+    dicts they replace, as_dict gives the serialized form
+    """
+
+    __slots__ = ("tick",)
+    FIELDS = ()
+
+    def get(self, key, default=None):
+        """a field or date by its state dict key"""
+        if key in self.FIELDS:
+            return getattr(self, key)
+        elif key == "date_servertime":
+            return self.tick.formatted_dates()[0]
+        elif key == "date_utc":
+            return self.tick.formatted_dates()[1]
+
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def as_dict(self):
+        """the record as a state dict with formatted dates"""
+        state = dict((field, getattr(self, field)) for field in self.FIELDS)
+        state["date_servertime"], state["date_utc"] = \
+            self.tick.formatted_dates()
+        return state
+
+
+class InputRecord(StateRecord):
+
+    """state of an input for a tick"""
+
+    __slots__ = ("name", "value", "units", "age_ms")
+    FIELDS = __slots__
+
+    def __init__(self, tick, name, value, units, age_ms):
+        self.tick = tick
+        self.name = name
+        self.value = value
+        self.units = units
+        self.age_ms = age_ms
+
+
+class OutputRecord(StateRecord):
+
+    """state of an output for a tick"""
+
+    __slots__ = ("name", "mode", "output_value", "input_value",
+                 "set_point", "input_name")
+    FIELDS = __slots__
+
+    def __init__(self, tick, name, mode, output_value, input_value,
+                 set_point, input_name):
+        self.tick = tick
+        self.name = name
+        self.mode = mode
+        self.output_value = output_value
+        self.input_value = input_value
+        self.set_point = set_point
+        self.input_name = input_name
+
+
+class LoopSnapshot(object):
+
+    """
+    the tick and the input and output records of a loop iteration
+    """
+
+    __slots__ = ("tick", "inputs", "outputs")
+
+    def __init__(self, tick, inputs, outputs):
+        self.tick = tick
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+
+def serializable(state):
+    """a state record as a dict, anything else is returned as is"""
+    if isinstance(state, StateRecord):
+        return state.as_dict()
+
+    return state
+
+
+def wall_time(state, default=None):
+    """wall clock seconds of a state record's tick, default for dicts"""
+    if isinstance(state, StateRecord):
+        return state.tick.wall_time
+
+    return default
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+"""
+benchmarks for the control loop hot paths, run against mocked RPIO,
+spidev and one-wire sysfs files so no hardware is needed. each case
+runs at several input/output counts and the results are written as
+json so runs of different versions can be compared:
+
+    scripts/benchmark.py --output before.json
+    scripts/benchmark.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock
+
+# add directories above script directory to path
+base_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+sys.path.append(os.path.abspath(base_dir + "/.."))
+
+#  mock the hardware modules, pins always report as outputs
+RPIO_MOCK = mock.Mock()
+RPIO_MOCK.gpio_function.return_value = RPIO_MOCK.OUT
+SPIDEV_MOCK = mock.Mock()
+SPIDEV_MOCK.SpiDev.return_value.xfer2.return_value = [0, 2, 0]
+sys.modules['RPIO'] = RPIO_MOCK
+sys.modules['spidev'] = SPIDEV_MOCK
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as controller
+import beerery.fileio as fileio
+import beerery.loggers as loggers
+import beerery.pid as PID
+import beerery.sensors.tempsensors as tempsensors
+import beerery.workers as workers
+
+SCALES = [2, 10, 50, 100, 500]
+REGRESSION_THRESHOLD = 0.2  # 20% slower
+W1_SLAVE = "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n" \
+    "72 01 4b 46 7f ff 0e 10 57 t={}\n"
+
+
+class Workspace(object):
+
+    """
+    temp base directory with config, state and one-wire sysfs files
+    for count inputs and outputs
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.directory = tempfile.mkdtemp(prefix="beerery-bench-")
+        self.w1_dir = os.path.join(self.directory, "w1") + "/"
+        for name in ["config", "state", "w1"]:
+            os.mkdir(os.path.join(self.directory, name))
+
+        rand = random.Random(count)
+        self.addresses = ["28-{:012x}".format(i) for i in xrange(count)]
+        for address in self.addresses:
+            os.mkdir(os.path.join(self.w1_dir, address))
+            with open(os.path.join(self.w1_dir, address, "w1_slave"),
+                      "w") as w1_file:
+                w1_file.write(W1_SLAVE.format(rand.randint(20000, 90000)))
+
+        self.write_config("controller.json", {
+            "logging_enabled": False,
+            "restart_required_config": {"control_sample_time_ms": 1000}
+        })
+        self.write_config("inputs.json", [{
+            "type": "DS18B20", "active": True, "address": address,
+            "name": "input{}".format(i), "acquisition": "on_demand"
+        } for i, address in enumerate(self.addresses)])
+        self.write_config("outputs.json", [{
+            "name": "output{}".format(i), "pin": i, "mode": "TPC",
+            "active": True, "input": "input{}".format(i),
+            "type": {"controller": "PID", "config": {
+                "kp": 20, "ki": 1, "kd": 5, "mode": 1, "set_point": 150}}
+        } for i in xrange(count)])
+        self.write_config("logs.json", [])
+        self.write_config("programs.json", [])
+
+        self.w1_patch = mock.patch.object(tempsensors, "ONE_WIRE_BASE_DIR",
+                                          self.w1_dir)
+        self.w1_patch.start()
+        fileio.set_base_directory(self.directory)
+
+    def write_config(self, file_name, config):
+        """write a config file"""
+        with open(os.path.join(self.directory, "config", file_name),
+                  "w") as config_file:
+            json.dump(config, config_file)
+
+    def inputs(self):
+        """controller inputs reading the fake sysfs"""
+        inputs = []
+        for i, address in enumerate(self.addresses):
+            io_input = controller.Input("input{}".format(i), 0)
+            io_input.set_type("DS18B20", {"address": address,
+                                          "acquisition": "on_demand"})
+            inputs.append(io_input)
+        return inputs
+
+    def close(self):
+        """remove the workspace"""
+        self.w1_patch.stop()
+        fileio.set_base_directory("")
+        shutil.rmtree(self.directory)
+
+
+def best_of(repeat, function):
+    """fastest of repeat runs of function, in seconds"""
+    times = []
+    for _ in xrange(repeat):
+        started = time.time()
+        function()
+        times.append(time.time() - started)
+    return min(times)
+
+
+def percentile(values, fraction):
+    """value at a fraction of the sorted values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_control_iteration(workspace, iterations):
+    """
+    wall time of full Controller.control iterations. a virtual clock
+    stands in for the loop sleep so only the work is timed
+    """
+    stamps = []
+
+    def on_loop():
+        stamps.append(time.time())
+        return len(stamps) > iterations
+
+    clock.set_clock(clock.VirtualClock())
+    try:
+        controller.Controller(workspace.directory).control(on_loop)
+    finally:
+        clock.use_system_clock()
+
+    # the first iteration includes the startup config load
+    per_iteration = [b - a for a, b in zip(stamps[1:], stamps[2:])]
+    return {
+        "iteration_ms": sum(per_iteration) / len(per_iteration) * 1000,
+        "iteration_p99_ms": percentile(per_iteration, 0.99) * 1000
+    }
+
+
+def bench_parallel_inputs(workspace, iterations):
+    """ParallelInputCalculator fan-out over the fake one-wire sensors"""
+    inputs = workspace.inputs()
+    pool = workers.WorkerPool()
+    calculator = controller.ParallelInputCalculator(pool, [])
+
+    def fan_out():
+        for _ in xrange(iterations):
+            calculator.calculate_async(inputs)
+            calculator.wait()
+
+    seconds = best_of(3, fan_out)
+    pool.shutdown()
+    fileio.stop_state_writer()
+
+    return {"fan_out_ms": seconds / iterations * 1000}
+
+
+def bench_pid_compute(workspace, iterations):
+    """PidController.compute throughput"""
+    pids = [PID.PidController(set_point=150, kp=20, ki=1, kd=5, mode=1,
+                              sample_time_ms=0.001)
+            for _ in xrange(workspace.count)]
+    rand = random.Random(workspace.count)
+    values = [rand.uniform(60, 212) for _ in pids]
+
+    def compute():
+        for _ in xrange(iterations):
+            for pid, value in zip(pids, values):
+                pid.input = value
+                pid.compute()
+
+    seconds = best_of(3, compute)
+    computes = iterations * workspace.count
+
+    return {"compute_us": seconds / computes * 1e6,
+            "computes_per_s": computes / seconds}
+
+
+def bench_write_json(workspace, iterations):
+    """fileio.write_json of one state file per output"""
+    state = {"name": "output", "mode": "TPC", "output_value": 42.5,
+             "input_value": 148.25, "set_point": 150, "input_name": "input",
+             "date_servertime": "2016-01-01 00:00:00",
+             "date_utc": "2016-01-01 00:00:00"}
+    paths = [fileio.full_fileio_path("state/output{}.json".format(i))
+             for i in xrange(workspace.count)]
+
+    def write():
+        for _ in xrange(iterations):
+            for path in paths:
+                fileio.write_json(path, state)
+
+    seconds = best_of(3, write)
+    return {"write_us": seconds / (iterations * workspace.count) * 1e6}
+
+
+class NullBatchingLogger(loggers.BatchingLogger):
+
+    """batching logger that drops its batches, measures the queueing"""
+
+    def write_batch(self, collection, documents):
+        pass
+
+
+def bench_loggers(workspace, iterations):
+    """records per second through the file and batching loggers"""
+    record = {"name": "input", "value": 148.25, "units": "f", "age_ms": 0,
+              "date_servertime": "2016-01-01 00:00:00",
+              "date_utc": "2016-01-01 00:00:00"}
+    names = ["input{}".format(i) for i in xrange(workspace.count)]
+    records = iterations * workspace.count
+    results = {}
+
+    file_logger = loggers.FileLogger(
+        fileio.full_fileio_path("state/history"))
+    batching_logger = NullBatchingLogger(max_queue=records + 1)
+
+    for key, logger in [("file", file_logger), ("batching", batching_logger)]:
+        started = time.time()
+        for _ in xrange(iterations):
+            for name in names:
+                logger.log_input(name, record)
+        logger.close()
+        results["{}_records_per_s".format(key)] = \
+            records / (time.time() - started)
+
+    return results
+
+
+def bench_loop_manager(workspace, iterations):
+    """how late TPC edges fire on the real LoopManager thread"""
+    loop_manager = controller.LoopManager(200)
+    loop_manager.start()
+    rand = random.Random(workspace.count)
+
+    for _ in xrange(iterations):
+        for i in xrange(workspace.count):
+            loop_manager.schedule_callback(lambda: None,
+                                           rand.uniform(0, 200), i)
+        time.sleep(0.25)
+
+    loop_manager.stop()
+    recent = list(loop_manager.lateness)
+    stats = loop_manager.timing_stats()
+
+    return {"edge_late_mean_ms": stats["mean_ms"],
+            "edge_late_p99_ms": percentile(recent, 0.99),
+            "edge_late_max_ms": stats["max_ms"]}
+
+
+# case: (function, iterations)
+CASES = [
+    ("control_iteration", bench_control_iteration, 20),
+    ("parallel_inputs", bench_parallel_inputs, 20),
+    ("pid_compute", bench_pid_compute, 200),
+    ("write_json", bench_write_json, 10),
+    ("loggers", bench_loggers, 20),
+    ("loop_manager", bench_loop_manager, 4)
+]
+
+
+def run(case_names, scales):
+    """run the cases, returns the result rows"""
+    results = []
+    for name, function, iterations in CASES:
+        if case_names and name not in case_names:
+            continue
+
+        for scale in scales:
+            workspace = Workspace(scale)
+            try:
+                metrics = function(workspace, iterations)
+            finally:
+                workspace.close()
+
+            for metric, value in sorted(metrics.items()):
+                results.append({"case": name, "scale": scale,
+                                "metric": metric, "value": value})
+                print "{:<18} {:>4} {:<24} {:>14.3f}".format(
+                    name, scale, metric, value)
+
+    return results
+
+
+def git_version():
+    """the commit being benchmarked, None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=base_dir, stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lower_is_better(metric):
+    """throughput metrics are per second, everything else is a time"""
+    return not metric.endswith("_per_s")
+
+
+def compare(baseline, results, threshold):
+    """
+    print the change from a baseline run, returns the number of
+    metrics that regressed by more than threshold
+    """
+    old = dict(((r["case"], r["scale"], r["metric"]), r["value"])
+               for r in baseline["results"])
+    regressions = 0
+
+    for result in results:
+        key = (result["case"], result["scale"], result["metric"])
+        if not old.get(key):
+            continue
+
+        change = result["value"] / old[key] - 1
+        worse = change if lower_is_better(result["metric"]) else -change
+        flag = ""
+        if worse > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+
+        print "{:<18} {:>4} {:<24} {:>+8.1%} {}".format(
+            result["case"], result["scale"], result["metric"], change, flag)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--cases", nargs="*",
+                        help="cases to run: {}".format(
+                            ", ".join(c[0] for c in CASES)))
+    parser.add_argument("--scales", nargs="*", type=int, default=SCALES)
+    parser.add_argument("--output", help="write the results to a json file")
+    parser.add_argument("--compare", help="json results of an earlier run")
+    parser.add_argument("--threshold", type=float,
+                        default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    controller.DEV_LOGGING = False
+    results = run(args.cases, args.scales)
+    report = {
+        "version": git_version(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "threads": threading.active_count(),
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results,
+                                  args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
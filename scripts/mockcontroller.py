@@ -36,14 +36,17 @@ class Runner(object):
         self.thermistor = mock_thermistor.return_value
         self.thermistor.get_temp.return_value = 55.25
         self.thermistor.units.return_value = "f"
+        self.thermistor.sample_age_ms.return_value = 0
 
         self.onewire = mock_onewire.return_value
         self.onewire.get_temp.return_value = 152
         self.onewire.units.return_value = "f"
+        self.onewire.sample_age_ms.return_value = 0
 
         self.tmp = mock_tmp.return_value
         self.tmp.get_temp.return_value = 75.25
         self.tmp.units.return_value = "f"
+        self.tmp.sample_age_ms.return_value = 0
 
         ctrl = Controller()
         ctrl.control(self.on_each_control_loop)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+compares one PidController per output with the numpy batch engine
+as the number of outputs grows. prints microseconds per control tick
+"""
+import os
+import random
+import sys
+import timeit
+
+# add directories above script directory to path
+base_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+sys.path.append(os.path.abspath(base_dir + "/.."))
+
+import beerery.batchpid as batchpid
+import beerery.pid as PID
+
+OUTPUT_COUNTS = [2, 10, 50, 100, 500, 1000]
+TICKS = 200
+SAMPLE_MS = 1000
+
+
+class TickClock(object):
+
+    """stands in for pid.millis so every tick is a full sample apart"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def tick(self):
+        """move to the next sample"""
+        self.now += SAMPLE_MS
+
+
+def output_config(rand):
+    """a pid config for one output"""
+    return {"set_point": rand.uniform(60, 212), "kp": 10, "ki": 1, "kd": 5,
+            "mode": PID.PidController.AUTO_MODE, "sample_time_ms": SAMPLE_MS,
+            "full_cycle_threshold": 20}
+
+
+def scalar_tick(clock, controllers, values):
+    """one control tick with a PidController per output"""
+    clock.tick()
+    for controller, value in zip(controllers, values):
+        controller.input = value
+        controller.compute()
+
+
+def batch_tick(clock, slots, batch, values):
+    """one control tick with the batch engine"""
+    clock.tick()
+    batch.set_inputs(slots, values)
+    batch.compute()
+    for slot in slots:
+        slot.compute()
+
+
+def benchmark(count):
+    """(scalar us, batch us) per tick for count outputs"""
+    rand = random.Random(count)
+    configs = [output_config(rand) for _ in xrange(count)]
+    values = [rand.uniform(60, 212) for _ in xrange(count)]
+
+    controllers = [PID.PidController(**c) for c in configs]
+    batch = batchpid.BatchPidController()
+    slots = [batch.add(**c) for c in configs]
+
+    clock = TickClock()
+    PID.millis = clock
+    scalar = timeit.timeit(lambda: scalar_tick(clock, controllers, values),
+                           number=TICKS)
+    batched = timeit.timeit(lambda: batch_tick(clock, slots, batch, values),
+                            number=TICKS)
+
+    return scalar / TICKS * 1e6, batched / TICKS * 1e6
+
+
+def main():
+    print "{:>8} {:>12} {:>12} {:>8}".format("outputs", "scalar us",
+                                            "batch us", "speedup")
+    for count in OUTPUT_COUNTS:
+        scalar, batched = benchmark(count)
+        print "{:>8} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+            count, scalar, batched, scalar / batched)
+
+
+if __name__ == "__main__":
+    main()
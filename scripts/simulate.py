@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+runs the controller against the simulated brewery in config/simulation.json
+on a virtual clock, a brew day takes seconds. the config directory is
+copied so the real config and state files aren't touched
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# add directories above script directory to path
+base_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+sys.path.append(os.path.abspath(base_dir + "/.."))
+
+import beerery.simulator as simulator
+
+
+def load_json(directory, file_name):
+    """load a config file"""
+    with open(os.path.join(directory, "config", file_name)) as config_file:
+        return json.load(config_file)
+
+
+def save_json(directory, file_name, config):
+    """save a config file"""
+    with open(os.path.join(directory, "config", file_name), "w") as config_file:
+        json.dump(config, config_file, indent=2)
+
+
+def prepare_config(source_dir, sim_config):
+    """
+    copy the config to a temp directory, activate the simulated outputs
+    and turn off logging to external stores
+    """
+    run_dir = tempfile.mkdtemp(prefix="beerery-sim-")
+    shutil.copytree(os.path.join(source_dir, "config"),
+                    os.path.join(run_dir, "config"))
+    os.mkdir(os.path.join(run_dir, "state"))
+
+    vessel_outputs = set(v.get("output", v["name"])
+                         for v in sim_config["vessels"])
+    outputs = load_json(run_dir, "outputs.json")
+    for output in outputs:
+        if output["name"] in vessel_outputs:
+            output["active"] = True
+    save_json(run_dir, "outputs.json", outputs)
+    save_json(run_dir, "logs.json", [])
+
+    return run_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hours", type=float, default=4.0)
+    parser.add_argument("--report-minutes", type=float, default=15.0)
+    parser.add_argument("--config-dir", default=base_dir)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.config_dir, "config",
+                           "simulation.json")) as config_file:
+        sim_config = json.load(config_file)
+
+    run_dir = prepare_config(args.config_dir, sim_config)
+    simulation = simulator.Simulation.from_config(
+        sim_config, load_json(run_dir, "inputs.json"),
+        load_json(run_dir, "outputs.json"))
+
+    sys.modules["RPIO"] = simulator.FakeRPIO(simulation)
+    sys.modules["spidev"] = simulator.FakeSpidev()
+    simulation.install()
+
+    import beerery.controller as controller
+    controller.DEV_LOGGING = False
+
+    end_ms = simulation.clock.millis() + int(args.hours * 3600 * 1000)
+    report_ms = int(args.report_minutes * 60 * 1000)
+    next_report = [simulation.clock.millis()]
+
+    def on_loop():
+        """report the vessels and stop at the end of the run"""
+        now_ms = simulation.clock.millis()
+        if now_ms >= next_report[0]:
+            next_report[0] += report_ms
+            minutes = (now_ms - simulation.started_ms) / 60000.0
+            vessels = simulation.vessel_states()
+            print "{:7.1f} min  {}".format(minutes, "  ".join(
+                "{} {:6.1f}F duty {:4.0%}".format(
+                    name, state["temperature_f"], state["duty"])
+                for name, state in sorted(vessels.items())))
+
+        return now_ms >= end_ms
+
+    started = time.time()
+    try:
+        controller.Controller(run_dir).control(on_loop)
+    finally:
+        shutil.rmtree(run_dir)
+
+    print "simulated {} hours in {:.1f}s".format(args.hours,
+                                                time.time() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,12 @@ base_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
 sys.path.append(base_dir)
 sys.path.append(os.path.abspath(base_dir + "/.."))
 
+import signal
 from beerery.controller import Controller
 
 ctrl = Controller(base_dir)
+
+# kill -USR1 <pid> dumps the recent trace events to state/trace.bin
+signal.signal(signal.SIGUSR1, lambda signum, frame: ctrl.dump_trace())
+
 ctrl.control()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+prints a binary trace dump written by the controller, by default the
+on demand dump state/trace.bin:
+
+    kill -USR1 <controller pid>
+    scripts/tracedump.py
+    scripts/tracedump.py state/trace_crash.bin --subsystem config
+"""
+import argparse
+import os
+import sys
+import time
+
+# add directories above script directory to path
+base_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+sys.path.append(os.path.abspath(base_dir + "/.."))
+
+import beerery.tracelog as tracelog
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("file", nargs="?",
+                        default=os.path.join(base_dir, "state", "trace.bin"))
+    parser.add_argument("--subsystem", nargs="*",
+                        help="only show events from these subsystems")
+    parser.add_argument("--level", default="debug",
+                        help="only show events at or above this level")
+    args = parser.parse_args()
+
+    level = tracelog.level_from_name(args.level)
+    for event in tracelog.read_dump(args.file):
+        if args.subsystem and event["subsystem"] not in args.subsystem:
+            continue
+        if tracelog.level_from_name(event["level"]) < level:
+            continue
+
+        print u"{}.{:03d} {:<7} {:<10} {:>16x} {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S",
+                          time.localtime(event["time"])),
+            int(event["time"] * 1000) % 1000, event["level"],
+            event["subsystem"], event["thread"], event["message"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import time
 import math
-from beerery.gpio import spireader
+import threading
+import collections
+import array
+from beerery.gpio import spireader, AdcScanner, ADC_MAX_CODE
 import os
 
 os.system('modprobe w1-gpio')
@@ -9,17 +12,107 @@ os.system('modprobe w1-therm')
 ONE_WIRE_BASE_DIR = '/sys/bus/w1/devices/'
 
 
-def thermistor_ohm_to_f(x):
-    A = 0.0011371549  # 0.00116597
-    B = 0.0002325949  # 0.000220635
-    C = 0  # 1.81284e-06
-    D = 9.54e-8  # 2.73396e-09
+# default steinhart-hart coefficients
+THERMISTOR_COEFFICIENTS = {
+    "a": 0.0011371549,  # 0.00116597
+    "b": 0.0002325949,  # 0.000220635
+    "c": 0,  # 1.81284e-06
+    "d": 9.54e-8  # 2.73396e-09
+}
+
+
+def thermistor_ohm_to_f(x, coefficients=None):
+    coefficients = coefficients or THERMISTOR_COEFFICIENTS
+    A = coefficients["a"]
+    B = coefficients["b"]
+    C = coefficients["c"]
+    D = coefficients["d"]
     r = math.log(x)
     k = 1.0 / (A + B * r + C * r ** 2 + D * r ** 3)  # to c: - 273.15
 
     return (k - 273.15) * 1.8000 + 32.00  # to f
 
 
+class Sample(collections.namedtuple("Sample",
+                                    ["value", "timestamp", "sequence"])):
+
+    """a single sensor reading"""
+
+    def age_ms(self, now=None):
+        """milliseconds since the sample was taken"""
+        return ((now or time.time()) - self.timestamp) * 1000.0
+
+
+class LatestSample(object):
+
+    """
+    double buffered slot holding the most recent sample of a sensor.
+    the writer fills the inactive slot and then flips the active index
+    so readers never see a partially written sample
+    """
+
+    def __init__(self):
+        self.slots = [None, None]
+        self.active = 0
+        self.sequence = 0
+        self.first_sample = threading.Event()
+
+    def publish(self, value, timestamp=None):
+        """store a new sample"""
+        self.sequence += 1
+        inactive = 1 - self.active
+        self.slots[inactive] = Sample(value, timestamp or time.time(),
+                                      self.sequence)
+        self.active = inactive
+        self.first_sample.set()
+
+    def latest(self, timeout=None):
+        """
+        returns the most recent sample, waiting up to timeout
+        for the first one if nothing has been read yet
+        """
+        if timeout is not None:
+            self.first_sample.wait(timeout)
+
+        return self.slots[self.active]
+
+
+class BackgroundAcquisition(threading.Thread):
+
+    """
+    thread that continuously reads a sensor into a LatestSample buffer
+    """
+
+    def __init__(self, name, read_function, samples, min_interval_s=0.5):
+        super(BackgroundAcquisition, self).__init__(
+            name="acquire-{}".format(name))
+        self.daemon = True
+        self.read_function = read_function
+        self.samples = samples
+        self.min_interval_s = min_interval_s
+        self.stopped = threading.Event()
+        self.errors = 0
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                value = self.read_function()
+                if value is not None:
+                    self.samples.publish(value, time.time())
+            except Exception:  # pylint: disable=W0703
+                # the sample age keeps growing while reads fail
+                self.errors += 1
+
+            remaining = self.min_interval_s - (time.time() - started)
+            if remaining > 0:
+                self.stopped.wait(remaining)
+
+    def stop(self):
+        """stop acquiring samples"""
+        self.stopped.set()
+
+
 class TempSensor(object):
 
     def __init__(self):
@@ -31,75 +124,195 @@ class TempSensor(object):
     def units(self):
         return "f"
 
+    def sample_age_ms(self):
+        """
+        age of the value last returned by get_temp,
+        synchronous sensors are always current
+        """
+        return 0
+
+    def close(self):
+        """release any resources held by the sensor"""
+        pass
+
+
+class AdcTempSensor(TempSensor):
 
-class ThermistorSensor(TempSensor):
+    """
+    base for sensors read through the MCP3008, readings come from
+    the shared background ADC scanner. every possible ADC code is
+    converted to a temperature once, up front, into a lookup table.
+    reads None once the channel hasn't scanned for max_sample_age_ms
+    """
 
-    def __init__(self, adc_channel):
-        self.adc_sample_total = 0
-        self.adc_sample_count = 0
+    # the scanner reads every 20ms, older readings mean it is failing
+    MAX_SAMPLE_AGE_MS = 2000
+
+    def __init__(self, adc_channel, reference_voltage=None,
+                 max_sample_age_ms=None):
         self.adc_channel = adc_channel
-        self.series_resistor = 10000
+        self.max_sample_age_ms = max_sample_age_ms or \
+            AdcTempSensor.MAX_SAMPLE_AGE_MS
+        self.reference_voltage = reference_voltage or \
+            spireader.reference_voltage()
+        self.table = None
+        self.scanner = AdcScanner.shared()
+        self.scanner.register_channel(adc_channel)
+
+    def build_table(self):
+        """build the ADC code to temperature lookup table"""
+        self.table = array.array(
+            'd', [self.temp_from_volts(self.code_to_volts(code))
+                  for code in xrange(ADC_MAX_CODE + 1)])
+
+    def code_to_volts(self, code):
+        """convert an ADC code to volts using this sensor's reference"""
+        return code * self.reference_voltage / ADC_MAX_CODE
+
+    def temp_from_volts(self, volts):
+        """convert a voltage to a temperature, implemented by sensors"""
+        pass
 
-    def sample(self):
-        self.adc_sample_total += spireader.adc_read(self.adc_channel)
-        self.adc_sample_count += 1
+    def value_from_adc(self, adc_average):
+        """
+        look up the temperature for an ADC reading,
+        interpolating between codes for averaged readings
+        """
+        if self.table is None:
+            self.build_table()
 
-    def reset(self):
-        self.adc_sample_total = 0
-        self.adc_sample_count = 0
+        code = int(adc_average)
+        if code >= ADC_MAX_CODE:
+            return self.table[ADC_MAX_CODE]
+        if code < 0:
+            return self.table[0]
 
-    def value_from_samples(self):
-        adc_average = self.adc_sample_total / self.adc_sample_count
-        volts = spireader.adc_to_volts(adc_average)
+        low = self.table[code]
+        fraction = adc_average - code
+        if not fraction:
+            return low
 
-        temp = 0
+        return low + (self.table[code + 1] - low) * fraction
 
-        if volts:
-            thermistor_ohms = round(
-                (spireader.reference_voltage() * self.series_resistor / volts) - self.series_resistor)
-            temp = thermistor_ohm_to_f(thermistor_ohms)
+    def adc_average(self):
+        """filtered ADC reading for this sensor's channel"""
+        return self.scanner.average(self.adc_channel)
 
-        return temp
+    def samples_per_second(self):
+        """raw ADC reads per second achieved for this channel"""
+        return self.scanner.samples_per_second(self.adc_channel)
+
+    def sample_age_ms(self):
+        return self.scanner.sample_age_ms(self.adc_channel)
 
     def get_temp(self):
-        self.reset()
+        adc_average = self.adc_average()
+        if adc_average is None:
+            return None
 
-        sample_count = 10
-        sample_sleep_s = 0.01
+        age_ms = self.sample_age_ms()
+        if age_ms is None or age_ms > self.max_sample_age_ms:
+            return None
 
-        for x in xrange(0, sample_count):
-            self.sample()
-            time.sleep(sample_sleep_s)
+        return self.value_from_adc(adc_average)
 
-        return self.value_from_samples()
+    def close(self):
+        if self.scanner:
+            self.scanner.unregister_channel(self.adc_channel)
+            self.scanner = None
 
 
-class TMP36TempSensor(TempSensor):
+class ThermistorSensor(AdcTempSensor):
 
-    def __init__(self, adc_channel):
-        self.adc_channel = adc_channel
+    def __init__(self, adc_channel, coefficients=None, series_resistor=10000,
+                 reference_voltage=None, max_sample_age_ms=None):
+        super(ThermistorSensor, self).__init__(adc_channel, reference_voltage,
+                                               max_sample_age_ms)
+        self.coefficients = coefficients or THERMISTOR_COEFFICIENTS
+        self.series_resistor = series_resistor
+        self.build_table()
 
-    def get_temp(self):
-        adc_read = spireader.adc_read(self.adc_channel)
-        volts = spireader.adc_to_volts(adc_read)
+    def temp_from_volts(self, volts):
+        temp = 0
+
+        if volts:
+            thermistor_ohms = (self.reference_voltage *
+                               self.series_resistor / volts) - self.series_resistor
+            # a shorted thermistor has no meaningful temperature
+            if thermistor_ohms > 0:
+                temp = thermistor_ohm_to_f(thermistor_ohms, self.coefficients)
+
+        return temp
 
+
+class TMP36TempSensor(AdcTempSensor):
+
+    def __init__(self, adc_channel, reference_voltage=None,
+                 max_sample_age_ms=None):
+        super(TMP36TempSensor, self).__init__(adc_channel, reference_voltage,
+                                              max_sample_age_ms)
+        self.build_table()
+
+    def temp_from_volts(self, volts):
         temp = 0
 
         if volts:
             temp_c = (volts - 0.5) * 100.0
             temp = temp_c * 1.8 + 32.0
 
-        print volts
-
         return temp
 
 
 class OneWireTempSensor(TempSensor):
 
-    def __init__(self, address):
+    # max time to wait for the first background sample, a DS18B20
+    # conversion takes ~750ms
+    FIRST_SAMPLE_TIMEOUT_S = 2.0
+    # a background sample older than this is not used, a PID must
+    # not keep driving a heater from a probe that stopped reading
+    MAX_SAMPLE_AGE_MS = 10000
+
+    def __init__(self, address, continuous=False, max_sample_age_ms=None):
         self.address = address
+        self.max_sample_age_ms = max_sample_age_ms or \
+            OneWireTempSensor.MAX_SAMPLE_AGE_MS
         self.device_folder = ONE_WIRE_BASE_DIR + self.address
         self.device_file = self.device_folder + '/w1_slave'
+        self.samples = None
+        self.acquisition = None
+        self.last_sample = None
+
+        if continuous:
+            self.start_acquisition()
+
+    def start_acquisition(self):
+        """start reading the probe continuously in the background"""
+        if self.acquisition:
+            return
+
+        self.samples = LatestSample()
+        self.acquisition = BackgroundAcquisition(
+            self.address, self.read_temp, self.samples)
+        self.acquisition.start()
+
+    def stop_acquisition(self):
+        """stop the background reads, get_temp reads synchronously again"""
+        if self.acquisition:
+            self.acquisition.stop()
+            self.acquisition = None
+
+    def close(self):
+        self.stop_acquisition()
+
+    def sample_age_ms(self):
+        if self.acquisition is None:
+            return 0
+
+        # None until the first background sample arrives
+        if self.last_sample is None:
+            return None
+
+        return self.last_sample.age_ms()
 
     def read_temp_file(self):
         """read the virtual file that exposes the sensor value"""
@@ -109,9 +322,33 @@ class OneWireTempSensor(TempSensor):
         return lines
 
     def get_temp(self):
+        """
+        the probe temperature, None without a reading. in continuous
+        mode the latest background sample, None once it is older than
+        max_sample_age_ms
+        """
+        if self.acquisition is None:
+            return self.read_temp()
+
+        self.last_sample = self.samples.latest(
+            OneWireTempSensor.FIRST_SAMPLE_TIMEOUT_S)
+
+        if self.last_sample is None:
+            return None
+
+        if self.last_sample.age_ms() > self.max_sample_age_ms:
+            return None
+
+        return self.last_sample.value
+
+    def read_temp(self):
+        """
+        read the probe, blocks for the sensor's conversion time.
+        returns None if the reading failed its crc check
+        """
         lines = self.read_temp_file()
         if lines[0].strip()[-3:] != 'YES':
-            return 0
+            return None
         equals_pos = lines[1].find('t=')
         if equals_pos != -1:
             temp_string = lines[1][equals_pos + 2:]
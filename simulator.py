@@ -0,0 +1,304 @@
+"""
+thermal plant simulation for running the controller without hardware.
+vessels are heated by elements switched through a fake RPIO and read by
+fake one-wire and ADC sensors. time comes from a VirtualClock so a brew
+day runs in seconds and the same config always gives the same result
+"""
+import math
+import threading
+import beerery.clock as clock
+
+WATER_SPECIFIC_HEAT = 4186.0  # J/(kg C)
+KG_PER_LITRE = 1.0
+BOILING_C = 100.0
+# physics are integrated in steps no longer than this
+MAX_STEP_MS = 1000
+DS18B20_RESOLUTION_C = 1 / 16.0
+
+
+def f_to_c(value):
+    """fahrenheit to celsius"""
+    return (value - 32.0) * 5.0 / 9.0
+
+
+def c_to_f(value):
+    """celsius to fahrenheit"""
+    return value * 9.0 / 5.0 + 32.0
+
+
+class Vessel(object):
+
+    """
+    a vessel of water with a heating element, losing heat to the room.
+    the sensor follows the water temperature with a first order lag
+    """
+
+    def __init__(self, name, volume_l, element_watts, heat_loss_w_per_c,
+                 sensor_lag_s, temperature_c):
+        self.name = name
+        self.heat_capacity = volume_l * KG_PER_LITRE * WATER_SPECIFIC_HEAT
+        self.element_watts = element_watts
+        self.heat_loss_w_per_c = heat_loss_w_per_c
+        self.sensor_lag_s = sensor_lag_s
+        self.temperature_c = temperature_c
+        self.sensor_c = temperature_c
+        self.heater_on = False
+        self.heater_on_ms = 0
+
+    def step(self, milliseconds, ambient_c):
+        """advance the vessel by milliseconds with the heater as it is"""
+        seconds = milliseconds / 1000.0
+        power = self.element_watts if self.heater_on else 0.0
+        if self.heater_on:
+            self.heater_on_ms += milliseconds
+
+        # exact for a constant heater over the step
+        if self.heat_loss_w_per_c > 0:
+            settle_c = ambient_c + power / self.heat_loss_w_per_c
+            decay = math.exp(-seconds * self.heat_loss_w_per_c /
+                             self.heat_capacity)
+            self.temperature_c = settle_c + \
+                (self.temperature_c - settle_c) * decay
+        else:
+            self.temperature_c += power * seconds / self.heat_capacity
+
+        # extra heat boils water off instead of raising the temperature
+        self.temperature_c = min(self.temperature_c, BOILING_C)
+
+        if self.sensor_lag_s > 0:
+            lag = math.exp(-seconds / self.sensor_lag_s)
+            self.sensor_c = self.temperature_c + \
+                (self.sensor_c - self.temperature_c) * lag
+        else:
+            self.sensor_c = self.temperature_c
+
+    def duty(self, elapsed_ms):
+        """fraction of elapsed_ms the heater has been on"""
+        if not elapsed_ms:
+            return 0.0
+
+        return self.heater_on_ms / float(elapsed_ms)
+
+
+class Simulation(object):
+
+    """
+    the simulated brewery. vessels are wired to output pins and input
+    sensors, sensors that aren't attached to a vessel read the room
+    """
+
+    def __init__(self, sim_clock, ambient_f=68.0):
+        self.clock = sim_clock
+        self.ambient_c = f_to_c(ambient_f)
+        self.vessels = {}
+        self.pins = {}  # pin: vessel
+        self.sensors = {}  # address or ("adc", channel): vessel
+        self.pin_levels = {}
+        self.started_ms = sim_clock.millis()
+        self.updated_ms = self.started_ms
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config(sim_config, inputs_config, outputs_config,
+                    sim_clock=None):
+        """
+        build a simulation from config/simulation.json. each vessel is
+        heated by the output with the vessel's "output" name (default
+        its name) and read by that output's input, or "input"
+        """
+        sim_clock = sim_clock or clock.VirtualClock(
+            sim_config.get("start_ms", clock.VIRTUAL_EPOCH_MS))
+        ambient_f = sim_config.get("ambient_f", 68.0)
+        simulation = Simulation(sim_clock, ambient_f)
+
+        outputs = dict((o["name"], o) for o in outputs_config)
+        inputs = dict((i["name"], i) for i in inputs_config)
+
+        for vessel_config in sim_config["vessels"]:
+            name = vessel_config["name"]
+            output = outputs.get(vessel_config.get("output", name))
+            if output is None:
+                raise Exception(
+                    "Output for simulated vessel '{}' not found".format(name))
+
+            input_config = inputs.get(vessel_config.get("input",
+                                                        output.get("input")))
+
+            vessel = Vessel(name, vessel_config["volume_l"],
+                            vessel_config["element_watts"],
+                            vessel_config.get("heat_loss_w_per_c", 10.0),
+                            vessel_config.get("sensor_lag_s", 10.0),
+                            f_to_c(vessel_config.get("initial_f", ambient_f)))
+            simulation.add_vessel(vessel, output["pin"], input_config)
+
+        return simulation
+
+    def add_vessel(self, vessel, pin, input_config=None):
+        """wire a vessel to its heater pin and sensor"""
+        self.vessels[vessel.name] = vessel
+        self.pins[pin] = vessel
+
+        if input_config is None:
+            return
+
+        if "address" in input_config:
+            self.sensors[input_config["address"]] = vessel
+        elif "adc_channel" in input_config:
+            self.sensors[("adc", input_config["adc_channel"])] = vessel
+
+    def update(self):
+        """advance the physics to the clock's time"""
+        with self.lock:
+            now_ms = self.clock.millis()
+            while self.updated_ms < now_ms:
+                step_ms = min(MAX_STEP_MS, now_ms - self.updated_ms)
+                for vessel in self.vessels.values():
+                    vessel.step(step_ms, self.ambient_c)
+                self.updated_ms += step_ms
+
+    def set_pin(self, pin, level):
+        """a pin changed, heat up to now with the old level first"""
+        self.update()
+
+        with self.lock:
+            self.pin_levels[pin] = bool(level)
+            vessel = self.pins.get(pin)
+            if vessel:
+                vessel.heater_on = bool(level)
+
+    def read_c(self, sensor_key):
+        """temperature seen by a sensor in celsius"""
+        self.update()
+
+        vessel = self.sensors.get(sensor_key)
+        if vessel is None:
+            return self.ambient_c
+
+        return vessel.sensor_c
+
+    def install(self):
+        """
+        use this simulation's clock and sensors. RPIO and spidev have to
+        be replaced with FakeRPIO and FakeSpidev in sys.modules first
+        """
+        # imported here, the sensor modules need spidev
+        import beerery.sensors.tempsensors as tempsensors
+
+        clock.set_clock(self.clock)
+        tempsensors.OneWireTempSensor = self.onewire_sensor
+        tempsensors.ThermistorSensor = self.adc_sensor
+        tempsensors.TMP36TempSensor = self.adc_sensor
+
+    def onewire_sensor(self, address, continuous=False,
+                       max_sample_age_ms=None):
+        """creates a simulated DS18B20, same args as OneWireTempSensor"""
+        return SimulatedTempSensor(self, address, DS18B20_RESOLUTION_C)
+
+    def adc_sensor(self, adc_channel, **kwargs):
+        """creates a simulated ADC temp sensor"""
+        return SimulatedTempSensor(self, ("adc", adc_channel))
+
+    def vessel_states(self):
+        """temperatures and heater duty of the vessels"""
+        elapsed_ms = self.updated_ms - self.started_ms
+
+        return dict((name, {
+            "temperature_f": c_to_f(vessel.temperature_c),
+            "sensor_f": c_to_f(vessel.sensor_c),
+            "heater_on": vessel.heater_on,
+            "duty": vessel.duty(elapsed_ms)
+        }) for name, vessel in self.vessels.items())
+
+
+class SimulatedTempSensor(object):
+
+    """temp sensor reading a simulated vessel, acts like a TempSensor"""
+
+    def __init__(self, simulation, sensor_key, resolution_c=None):
+        super(SimulatedTempSensor, self).__init__()
+        self.simulation = simulation
+        self.sensor_key = sensor_key
+        self.resolution_c = resolution_c
+
+    def get_temp(self):
+        """the sensor temperature in fahrenheit"""
+        value = self.simulation.read_c(self.sensor_key)
+
+        if self.resolution_c:
+            value = round(value / self.resolution_c) * self.resolution_c
+
+        return c_to_f(value)
+
+    def units(self):
+        """units of the temperature"""
+        return "f"
+
+    def sample_age_ms(self):
+        """simulated readings are always current"""
+        return 0
+
+    def close(self):
+        """nothing to stop"""
+        pass
+
+
+class FakeRPIO(object):
+
+    """stands in for the RPIO module, pin changes switch the heaters"""
+
+    OUT = 0
+    IN = 1
+    LOW = False
+    HIGH = True
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.functions = {}
+        self.writes = 0
+
+    def setup(self, pin, function, initial=False):
+        """configure a pin"""
+        self.functions[pin] = function
+        if function == FakeRPIO.OUT:
+            self.simulation.set_pin(pin, initial)
+
+    def gpio_function(self, pin):
+        """the function a pin is set up for"""
+        return self.functions.get(pin, FakeRPIO.IN)
+
+    def output(self, pin, value):
+        """set an output pin"""
+        self.writes += 1
+        self.simulation.set_pin(pin, value)
+
+    def cleanup(self):
+        """turn everything off"""
+        for pin, function in self.functions.items():
+            if function == FakeRPIO.OUT:
+                self.simulation.set_pin(pin, False)
+
+        self.functions = {}
+
+
+class FakeSpiDevice(object):
+
+    """stands in for spidev.SpiDev, the simulated ADC sensors don't use it"""
+
+    def open(self, bus, device):
+        """open the device"""
+        pass
+
+    def xfer2(self, data):
+        """every channel reads 0"""
+        return [0] * len(data)
+
+    def close(self):
+        """close the device"""
+        pass
+
+
+class FakeSpidev(object):
+
+    """stands in for the spidev module"""
+
+    SpiDev = FakeSpiDevice
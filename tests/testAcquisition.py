@@ -0,0 +1,89 @@
+import unittest
+import mock
+import sys
+import os
+import time
+
+#  mock the spidev module and the w1 modprobe calls
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+from beerery.sensors.tempsensors import LatestSample, OneWireTempSensor
+
+W1_LINES = ["72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n",
+            "72 01 4b 46 7f ff 0e 10 57 t=23125\n"]
+
+class LatestSampleTests(unittest.TestCase):
+  def testPublishFlipsSlots(self):
+    samples = LatestSample()
+    self.failUnless(samples.latest() is None)
+
+    samples.publish(150.0, 100.0)
+    samples.publish(151.0, 101.0)
+
+    latest = samples.latest()
+    self.assertEqual(latest.value, 151.0)
+    self.assertEqual(latest.sequence, 2)
+    self.assertEqual(samples.slots[1 - samples.active].value, 150.0)
+    self.assertEqual(latest.age_ms(102.0), 1000.0)
+
+class OneWireAcquisitionTests(unittest.TestCase):
+  def setUp(self):
+    self.read_patch = mock.patch.object(OneWireTempSensor, 'read_temp_file',
+                                        return_value=W1_LINES)
+    self.read_patch.start()
+
+  def tearDown(self):
+    self.read_patch.stop()
+
+  def testSynchronousRead(self):
+    sensor = OneWireTempSensor("28-000004f65c4d")
+
+    self.assertAlmostEqual(sensor.get_temp(), 73.625)
+    self.assertEqual(sensor.sample_age_ms(), 0)
+
+  def testContinuousReadReturnsLatestSample(self):
+    sensor = OneWireTempSensor("28-000004f65c4d", continuous=True)
+    try:
+      self.assertAlmostEqual(sensor.get_temp(), 73.625)
+      self.failUnless(sensor.last_sample.sequence >= 1)
+      self.failUnless(sensor.sample_age_ms() >= 0)
+    finally:
+      sensor.close()
+
+    self.failUnless(sensor.acquisition is None)
+
+  def testStaleSampleIsNotUsed(self):
+    sensor = OneWireTempSensor("28-000004f65c4d", max_sample_age_ms=5000)
+    # reads failing in the background, the last good sample ages
+    sensor.acquisition = mock.Mock()
+    sensor.samples = LatestSample()
+    sensor.samples.publish(150.0, time.time() - 4)
+    self.assertEqual(sensor.get_temp(), 150.0)
+
+    sensor.samples.publish(150.0, time.time() - 6)
+    self.failUnless(sensor.get_temp() is None)
+    self.failUnless(sensor.sample_age_ms() > 5000)
+    self.assertEqual(OneWireTempSensor("28-000004f65c4d").max_sample_age_ms,
+                     OneWireTempSensor.MAX_SAMPLE_AGE_MS)
+
+  def testFailedCrcIsNotPublished(self):
+    bad_lines = [W1_LINES[0].replace("YES", "NO"), W1_LINES[1]]
+    with mock.patch.object(OneWireTempSensor, 'read_temp_file',
+                           return_value=bad_lines):
+      sensor = OneWireTempSensor("28-000004f65c4d")
+      # a failed read is no reading, not 0F
+      self.failUnless(sensor.get_temp() is None)
+      self.failUnless(sensor.read_temp() is None)
+
+  def testNoFirstSampleIsNoReading(self):
+    sensor = OneWireTempSensor("28-000004f65c4d")
+    sensor.acquisition = mock.Mock()
+    sensor.samples = LatestSample()
+
+    with mock.patch.object(OneWireTempSensor, 'FIRST_SAMPLE_TIMEOUT_S', 0.01):
+      self.failUnless(sensor.get_temp() is None)
+    self.failUnless(sensor.sample_age_ms() is None)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import mock
+import sys
+import time
+
+#  mock the spidev module
+sys.modules['spidev'] = mock.Mock()
+
+from beerery.gpio import AdcChannel, AdcScanner
+
+class AdcChannelTests(unittest.TestCase):
+  def testRingBufferAverage(self):
+    channel = AdcChannel(0, 3)
+    self.failUnless(channel.average() is None)
+
+    for i, value in enumerate([100.0, 200.0, 300.0, 400.0]):
+      channel.push(value, float(i), 4)
+
+    # oldest reading has been overwritten
+    self.assertEqual(channel.average(), 300.0)
+    self.assertEqual(channel.samples_per_second(4), 4.0)
+    self.assertEqual(channel.raw_reads, 16)
+
+class AdcScannerTests(unittest.TestCase):
+  def setUp(self):
+    self.reads = []
+    self.scanner = AdcScanner(scan_interval_s=0.005, oversample=4,
+                              buffer_size=8, read_function=self.read)
+
+  def tearDown(self):
+    self.scanner.stop()
+
+  def read(self, channel):
+    self.reads.append(channel)
+    return 500 + channel + len(self.reads) % 2
+
+  def testScanOversamplesEveryChannel(self):
+    self.scanner.register_channel(0)
+    self.scanner.register_channel(2)
+
+    self.scanner.scan()
+
+    self.assertEqual(sorted(self.reads), [0] * 4 + [2] * 4)
+    self.assertEqual(self.scanner.average(0, timeout=0), 500.5)
+    self.assertEqual(self.scanner.average(2, timeout=0), 502.5)
+    self.failUnless(self.scanner.average(1, timeout=0) is None)
+
+  def testChannelsAreReferenceCounted(self):
+    self.scanner.register_channel(0)
+    self.scanner.register_channel(0)
+    self.scanner.unregister_channel(0)
+    self.failUnless(0 in self.scanner.channels)
+
+    self.scanner.unregister_channel(0)
+    self.failIf(0 in self.scanner.channels)
+
+  def testBackgroundScanReportsRate(self):
+    self.scanner.register_channel(1)
+    self.scanner.start()
+
+    self.assertEqual(self.scanner.average(1), 501.5)
+    time.sleep(0.05)
+
+    self.failUnless(self.scanner.samples_per_second(1) > 0)
+    self.failUnless(1 in self.scanner.samples_per_second())
+
+  def testReadErrorsDoNotStopTheScanner(self):
+    failing = [True]
+    def read(channel):
+      if channel == 3 and failing[0]:
+        raise IOError("spi read failed")
+      return self.read(channel)
+
+    self.scanner.read_function = read
+    self.scanner.register_channel(1)
+    self.scanner.register_channel(3)
+    self.scanner.start()
+    time.sleep(0.05)
+
+    self.failUnless(self.scanner.is_alive())
+    self.failUnless(self.scanner.read_errors > 0)
+    self.failUnless(self.scanner.average(3, timeout=0) is None)
+    self.failUnless(self.scanner.sample_age_ms(3) is None)
+    self.failUnless(self.scanner.sample_age_ms(1) < 50)
+
+    failing[0] = False
+    self.failUnless(self.scanner.average(3) is not None)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import mock
+import sys
+import os
+
+#  mock the spidev module and the w1 modprobe calls
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.sensors.tempsensors as tempsensors
+
+class AdcTempSensorTests(unittest.TestCase):
+  def setUp(self):
+    self.scanner = mock.Mock()
+    self.scanner.sample_age_ms.return_value = 20
+    self.scanner_patch = mock.patch.object(tempsensors.AdcScanner, 'shared',
+                                           return_value=self.scanner)
+    self.scanner_patch.start()
+
+  def tearDown(self):
+    self.scanner_patch.stop()
+
+  def testThermistorTableMatchesFormula(self):
+    sensor = tempsensors.ThermistorSensor(0)
+    ohms = 3.3 * 10000 / (512 * 3.3 / 1023) - 10000
+
+    self.assertEqual(len(sensor.table), 1024)
+    self.assertAlmostEqual(sensor.value_from_adc(512),
+                           tempsensors.thermistor_ohm_to_f(ohms))
+    self.assertEqual(sensor.value_from_adc(0), 0)
+
+  def testFractionalCodesInterpolate(self):
+    sensor = tempsensors.ThermistorSensor(0)
+    midpoint = (sensor.table[600] + sensor.table[601]) / 2
+
+    self.assertAlmostEqual(sensor.value_from_adc(600.5), midpoint)
+
+  def testConfiguredCoefficientsAreUsed(self):
+    coefficients = {"a": 0.00116597, "b": 0.000220635,
+                    "c": 1.81284e-06, "d": 2.73396e-09}
+    default = tempsensors.ThermistorSensor(0)
+    calibrated = tempsensors.ThermistorSensor(0, coefficients=coefficients)
+
+    self.assertNotAlmostEqual(default.value_from_adc(512),
+                              calibrated.value_from_adc(512))
+
+  def testTmp36ReadsFromScanner(self):
+    self.scanner.average.return_value = 232.5
+    sensor = tempsensors.TMP36TempSensor(2)
+
+    # 0.75v is 25c
+    self.assertAlmostEqual(sensor.get_temp(), 77.0)
+    self.scanner.register_channel.assert_called_with(2)
+
+    sensor.close()
+    self.scanner.unregister_channel.assert_called_with(2)
+
+  def testMissingOrStaleReadingsAreNone(self):
+    sensor = tempsensors.TMP36TempSensor(2, max_sample_age_ms=1000)
+
+    self.scanner.average.return_value = None
+    self.failUnless(sensor.get_temp() is None)
+
+    # the scanner stopped reading the channel
+    self.scanner.average.return_value = 232.5
+    self.scanner.sample_age_ms.return_value = 1500
+    self.failUnless(sensor.get_temp() is None)
+    self.assertEqual(sensor.sample_age_ms(), 1500)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.autotune as autotune
+import beerery.controller as ctrl
+import beerery.pid as pid
+import beerery.simulator as simulator
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+SAMPLE_MS = 2000
+
+def run_plant(session, controller, vessel, ticks):
+  """time proportional control of a simulated vessel, one tick per sample"""
+  now = [0]
+  with mock.patch('beerery.pid.millis', lambda: now[0]):
+    for _ in range(ticks):
+      value = simulator.c_to_f(vessel.sensor_c)
+      controller.input = value
+      session.control(controller, now[0], value)
+      controller.compute()
+
+      on_ms = int(controller.output / 100.0 * SAMPLE_MS)
+      vessel.heater_on = True
+      vessel.step(on_ms, 20.0)
+      vessel.heater_on = False
+      vessel.step(SAMPLE_MS - on_ms, 20.0)
+
+      now[0] += SAMPLE_MS
+      if session.finished():
+        break
+
+class AutotuneTests(unittest.TestCase):
+  def testTuningRules(self):
+    gains = autotune.tuning_gains(10.0, 100.0, "ziegler_nichols")
+    self.assertAlmostEqual(gains["kp"], 6.0)
+    self.assertAlmostEqual(gains["ki"], 6.0 / 50.0)
+    self.assertAlmostEqual(gains["kd"], 6.0 * 12.5)
+
+    self.assertRaises(Exception, autotune.tuning_gains, 10.0, 100.0, "guess")
+
+  def testRelayMeasuresOscillation(self):
+    relay = autotune.RelayExperiment(100, hysteresis=0, cycles=2)
+    # square wave between 98 and 102 with a 40s period after a heat up
+    values = [90, 95, 99] + [101, 102, 101, 99, 98, 99] * 3
+    for index, value in enumerate(values):
+      output = relay.update(index * 5000, value)
+
+    self.failUnless(relay.complete())
+    self.assertEqual(relay.amplitude(), 2.0)
+    self.assertEqual(relay.ultimate_period_s(), 30.0)
+    self.assertAlmostEqual(relay.ultimate_gain(), 4 * 50 / (3.14159265 * 2), 4)
+    self.assertEqual(output, 100)
+
+  def testStepResponse(self):
+    response = autotune.StepResponse(0, 100.0, 110.0, 0.5)
+    for second, value in enumerate([100, 101, 104, 108, 109.5, 111, 110.6, 110.2, 110, 110]):
+      response.update(second * 1000, value)
+
+    report = response.report()
+    self.assertEqual(report["rise_time_s"], 3.0)
+    self.assertAlmostEqual(report["overshoot"], 1.0)
+    self.assertAlmostEqual(report["overshoot_percent"], 10.0)
+    self.assertEqual(report["settling_time_s"], 6.0)
+
+  def testTunesSimulatedVessel(self):
+    config = {"mode": 1, "kp": 20, "ki": 1, "kd": 5, "set_point": 150,
+              "sample_time_ms": SAMPLE_MS}
+    controller = pid.PidController(**config)
+    controller.set_output_limits(0, 100)
+    session = autotune.AutotuneSession(
+      "HLT", 150, {"rule": "some_overshoot", "verify_minutes": 20}, config)
+    vessel = simulator.Vessel("HLT", 40, 5500, 15, 8, simulator.f_to_c(140))
+
+    run_plant(session, controller, vessel, 5000)
+
+    self.assertEqual(session.state, autotune.DONE)
+    report = session.report()
+    self.failUnless(report["ultimate_gain"] > 0)
+    self.failUnless(report["ultimate_period_s"] > 0)
+    self.assertAlmostEqual(controller.kp, report["gains"]["kp"])
+    self.assertEqual(controller.set_point, 150)
+    self.failIf(report["response"]["rise_time_s"] is None)
+    self.failIf(report["response"]["settling_time_s"] is None)
+
+  def testGivesUpWithoutOscillation(self):
+    config = {"mode": 1, "kp": 20, "ki": 1, "kd": 5, "set_point": 150,
+              "sample_time_ms": SAMPLE_MS}
+    controller = pid.PidController(**config)
+    session = autotune.AutotuneSession("HLT", 150, {"max_minutes": 10}, config)
+    # far too small an element to ever reach the set point
+    vessel = simulator.Vessel("HLT", 40, 100, 15, 8, simulator.f_to_c(60))
+
+    run_plant(session, controller, vessel, 1000)
+
+    self.assertEqual(session.state, autotune.FAILED)
+    self.assertEqual(controller.mode, pid.PidController.AUTO_MODE)
+    self.assertEqual(controller.kp, 20)
+
+@mock.patch('beerery.sensors.tempsensors.OneWireTempSensor', autospec=True)
+class AutotuneControllerTests(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    shutil.copytree(CONFIG_DIR, os.path.join(self.base_dir, "config"))
+    os.mkdir(os.path.join(self.base_dir, "state"))
+    self.outputs_path = os.path.join(self.base_dir, "config", "outputs.json")
+    with open(self.outputs_path) as config_file:
+      outputs = json.load(config_file)
+    outputs[0]["active"] = True
+    outputs[0]["type"]["config"]["autotune"] = {"rule": "no_overshoot"}
+    with open(self.outputs_path, "w") as config_file:
+      json.dump(outputs, config_file)
+
+    self.controller = ctrl.Controller(self.base_dir)
+    self.controller.sample_ms = SAMPLE_MS
+
+  def tearDown(self):
+    observer = self.controller.controller_config["config_file_observer"]
+    if observer:
+      observer.stop()
+    shutil.rmtree(self.base_dir)
+
+  def testCompletedSessionSavesGainsAndReport(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    output = self.controller.outputs["HLT"]
+    self.failUnless(output.autotune is not None)
+
+    output.autotune.gains = {"kp": 3.5, "ki": 0.02, "kd": 40.0}
+    output.autotune.state = autotune.DONE
+    self.controller.complete_autotune(output)
+
+    with open(self.outputs_path) as config_file:
+      saved = json.load(config_file)[0]["type"]["config"]
+    self.failIf("autotune" in saved)
+    self.assertEqual((saved["kp"], saved["ki"], saved["kd"]), (3.5, 0.02, 40.0))
+    self.failUnless(output.autotune is None)
+
+    with open(os.path.join(self.base_dir, "state", "autotune_HLT.json")) as report_file:
+      self.assertEqual(json.load(report_file)["rule"], "no_overshoot")
+
+if __name__ == '__main__':
+  unittest.main()
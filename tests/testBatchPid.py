@@ -0,0 +1,92 @@
+import unittest
+import mock
+import random
+
+import beerery.batchpid as batchpid
+import beerery.pid as pid
+
+SAMPLE_MS = 1000
+
+def random_config(rand):
+  config = {"set_point": rand.uniform(60, 212), "sample_time_ms": SAMPLE_MS,
+            "kp": rand.uniform(1, 20), "ki": rand.uniform(0, 2),
+            "kd": rand.uniform(0, 5), "mode": rand.choice([0, 1]),
+            "output": rand.uniform(0, 100)}
+  if rand.random() < 0.5:
+    config["full_cycle_threshold"] = rand.uniform(1, 20)
+  return config
+
+class BatchPidTests(unittest.TestCase):
+  def setUp(self):
+    self.now = [0]
+    patcher = mock.patch('beerery.pid.millis', lambda: self.now[0])
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def assertSameState(self, scalar, slot):
+    for name in ["output", "i_term", "last_input", "mode", "set_point"]:
+      self.assertAlmostEqual(getattr(scalar, name), getattr(slot, name), 9, name)
+
+  @mock.patch('sys.stdout')
+  def testMatchesScalarController(self, mock_stdout):
+    rand = random.Random(7)
+    batch = batchpid.BatchPidController(capacity=4)
+    pairs = []
+    for _ in range(50):
+      config = random_config(rand)
+      scalar = pid.PidController(**config)
+      slot = batch.add(**config)
+      scalar.set_output_limits(0, 100)
+      slot.set_output_limits(0, 100)
+      pairs.append((scalar, slot))
+
+    self.assertEqual(len(batch), 50)
+    for step in range(200):
+      self.now[0] += rand.choice([400, 1000, 1500])
+      for scalar, slot in pairs:
+        value = None if rand.random() < 0.05 else rand.uniform(40, 220)
+        scalar.input = value
+        slot.input = value
+        # the scalar controller can't switch to auto without an input
+        if value is not None and rand.random() < 0.02:
+          mode = rand.choice([0, 1])
+          scalar.set_mode(mode)
+          slot.set_mode(mode)
+
+      batch.compute()
+      for scalar, slot in pairs:
+        self.assertEqual(scalar.compute(), slot.compute())
+        self.assertSameState(scalar, slot)
+
+  def testUpdateConfig(self):
+    batch = batchpid.BatchPidController()
+    config = {"set_point": 150, "sample_time_ms": SAMPLE_MS, "kp": 10,
+              "ki": 1, "kd": 5, "mode": 1}
+    slot = batch.add(**config)
+
+    slot.update_config({"mode": 0, "set_point": 160, "output": 40})
+    slot.input = 100
+    batch.compute()
+
+    self.failUnless(slot.compute())
+    self.assertEqual(slot.output, 40)
+    self.assertEqual(slot.set_point, 160)
+    self.assertEqual(slot.full_cycle_threshold, float("inf"))
+
+  def testReleasedSlotsAreReused(self):
+    batch = batchpid.BatchPidController(capacity=2)
+    config = {"set_point": 150, "sample_time_ms": SAMPLE_MS, "mode": 0,
+              "output": 50}
+    slots = [batch.add(**config) for _ in range(3)]
+    self.assertEqual(batch.capacity, 4)
+
+    slots[1].release()
+    slot = batch.add(**dict(config, output=20))
+
+    self.assertEqual(slot.index, slots[1].index)
+    self.assertEqual(slot.output, 20)
+    self.assertEqual(slots[2].output, 50)
+    self.assertEqual(len(batch), 3)
+
+if __name__ == '__main__':
+  unittest.main()
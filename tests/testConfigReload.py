@@ -0,0 +1,191 @@
+import unittest
+import mock
+from mock import patch
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.controller as ctrl
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+@patch('beerery.sensors.tempsensors.OneWireTempSensor', autospec=True)
+class ConfigReloadTests(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    shutil.copytree(CONFIG_DIR, os.path.join(self.base_dir, "config"))
+    self.update_outputs(lambda outputs: outputs[0].update(active=True))
+
+    self.controller = ctrl.Controller(self.base_dir)
+    self.controller.sample_ms = 2000
+
+  def tearDown(self):
+    observer = self.controller.controller_config["config_file_observer"]
+    if observer:
+      observer.stop()
+    shutil.rmtree(self.base_dir)
+
+  def update_config(self, file_name, update):
+    path = os.path.join(self.base_dir, "config", file_name)
+    with open(path) as config_file:
+      config = json.load(config_file)
+    update(config)
+    with open(path, "w") as config_file:
+      json.dump(config, config_file)
+
+  def update_outputs(self, update):
+    self.update_config("outputs.json", update)
+
+  def reload(self):
+    self.controller.controller_config["config_current"] = False
+    return self.controller.read_app_config()
+
+  def testOnlyChangedFilesAreReparsed(self, mock_onewire):
+    self.assertEqual(self.reload(),
+                     set(["controller", "inputs", "outputs", "logs"]))
+    self.assertEqual(self.reload(), set())
+
+    self.update_outputs(lambda outputs: outputs[0]["type"]["config"].update(set_point=165))
+    self.assertEqual(self.reload(), set(["outputs"]))
+
+  def testFailedBuildRereadsItsFiles(self, mock_onewire):
+    self.controller.load_config_if_needed()
+
+    self.update_config("controller.json", lambda config: config.update(history_minutes=60))
+    self.update_config("inputs.json", lambda inputs: inputs[1].update(type="bogus"))
+    self.controller.controller_config["config_current"] = False
+    self.assertRaises(Exception, self.controller.build_config)
+
+    self.update_config("inputs.json", lambda inputs: inputs[1].update(type="DS18B20"))
+    self.controller.controller_config["config_current"] = False
+    build = self.controller.build_config()
+
+    # the controller.json edit read by the failed build isn't lost
+    self.assertEqual(build.changed, set(["controller", "inputs"]))
+    self.controller.swap_config(build)
+    self.assertEqual(self.controller.controller_config["history_minutes"], 60)
+
+  def testSetpointEditKeepsControllerState(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    hlt_output = self.controller.outputs["HLT"]
+    hlt_output.controller.i_term = 42
+    inputs = dict(self.controller.inputs)
+
+    self.update_outputs(lambda outputs: outputs[0]["type"]["config"].update(set_point=165))
+    self.controller.controller_config["config_current"] = False
+    self.controller.load_config_if_needed()
+
+    self.failUnless(self.controller.outputs["HLT"] is hlt_output)
+    self.assertEqual(hlt_output.controller.set_point, 165)
+    self.assertEqual(hlt_output.controller.i_term, 42)
+    self.assertEqual(self.controller.inputs, inputs)
+
+  def testChangedEntitiesAreRebuilt(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    hlt_output = self.controller.outputs["HLT"]
+    mlt_input = self.controller.inputs["MLT"]
+    hlt_input = self.controller.inputs["HLT"]
+
+    self.update_outputs(lambda outputs: outputs[0].update(pin=23))
+    self.update_config("inputs.json", lambda inputs: inputs[2].update(address="28-1"))
+    self.controller.controller_config["config_current"] = False
+    self.controller.load_config_if_needed()
+
+    self.failIf(self.controller.outputs["HLT"] is hlt_output)
+    self.assertEqual(self.controller.outputs["HLT"].pin, 23)
+    self.failUnless(self.controller.inputs["MLT"] is mlt_input)
+    self.failIf(self.controller.inputs["HLT"] is hlt_input)
+    hlt_input.input_impl.close.assert_called_with()
+
+  def testBuildIsNotVisibleUntilSwapped(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    outputs = self.controller.outputs
+    hlt_output = outputs["HLT"]
+
+    self.update_outputs(lambda outputs: outputs[0]["type"]["config"].update(set_point=170))
+    self.controller.controller_config["config_current"] = False
+    build = self.controller.build_config()
+
+    self.assertEqual(hlt_output.controller.set_point, 160)
+    self.failUnless(self.controller.outputs is outputs)
+
+    self.controller.swap_config(build)
+
+    self.assertEqual(hlt_output.controller.set_point, 170)
+    self.failUnless(self.controller.outputs is build.outputs)
+    self.failUnless(build.swapped.is_set())
+    self.assertEqual(self.controller.config_stats["swaps"], 2)
+
+  def testBuildLeavesSharedStateToTheSwap(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    outputs_config = self.controller.controller_config["outputs"]
+
+    self.update_outputs(lambda outputs: outputs[1].update(active=True))
+    self.controller.controller_config["config_current"] = False
+    build = self.controller.build_config()
+
+    # the builder thread only parses config and builds plain objects
+    self.failUnless(self.controller.controller_config["outputs"] is outputs_config)
+    self.assertEqual(build.outputs["BK"].controller, None)
+    self.assertEqual(self.controller.pin_driver.mode(22), None)
+
+    self.controller.swap_config(build)
+
+    self.failIf(self.controller.controller_config["outputs"] is outputs_config)
+    self.failIf(self.controller.outputs["BK"].controller is None)
+    self.assertEqual(self.controller.pin_driver.mode(22), "out")
+
+  def testBackgroundBuilderSwapsBetweenIterations(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    self.controller.config_builder = ctrl.ConfigBuilder(self.controller)
+    self.controller.config_builder.start()
+
+    self.update_outputs(lambda outputs: outputs[0]["type"]["config"].update(set_point=155))
+    self.controller.controller_config["config_current"] = False
+
+    for _ in range(100):
+      self.controller.swap_config_if_ready()
+      if self.controller.config_stats["swaps"] == 2:
+        break
+      time.sleep(0.01)
+
+    self.assertEqual(self.controller.outputs["HLT"].controller.set_point, 155)
+    self.failUnless(self.controller.config_stats["last_swap_ms"] >= 0)
+
+  @patch('beerery.loggers.MongoClient')
+  def testSpillPathIsUnderTheBaseDirectory(self, mock_client, mock_onewire):
+    logs = self.controller.connect_logs(True, [{
+        "type": "mongodb", "db_uri": "uri", "database": "brewery",
+        "overflow": "spill", "spill_path": "spill.jsonl"}])
+    logs[0].close()
+
+    self.assertEqual(logs[0].spill_path,
+                     os.path.join(self.base_dir, "spill.jsonl"))
+
+  def testProgramOutputChangesAreSavedWithoutRebuild(self, mock_onewire):
+    self.controller.load_config_if_needed()
+    hlt_output = self.controller.outputs["HLT"]
+    hlt_output.controller.i_term = 42
+
+    hlt_output.set_control(0, set_point=150, output=80)
+    self.controller.unsaved_outputs.add("HLT")
+    self.controller.save_program_outputs(ctrl.millis())
+
+    with open(os.path.join(self.base_dir, "config", "outputs.json")) as config_file:
+      saved = json.load(config_file)[0]["type"]["config"]
+    self.assertEqual((saved["mode"], saved["set_point"], saved["output"]), (0, 150, 80))
+
+    self.assertEqual(self.reload(), set(["outputs"]))
+    self.assertEqual(self.controller.connect_outputs(dict(self.controller.outputs)), [])
+    self.assertEqual(hlt_output.controller.i_term, 42)
+
+if __name__ == "__main__":
+  unittest.main()
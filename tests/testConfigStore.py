@@ -0,0 +1,138 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.configstore as configstore
+import beerery.constants as constants
+import beerery.fileio as fileio
+import beerery.program as program
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+def pid_program(output_name, setpoint):
+  return {"name": "mash", "steps": [{"name": "strike", "actions": [
+    {"type": "PID", "output_name": output_name, "output": "PID",
+     "setpoint": setpoint}]}]}
+
+class ConfigStoreTests(unittest.TestCase):
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    shutil.copytree(CONFIG_DIR, os.path.join(self.base_dir, "config"))
+    fileio.set_base_directory(self.base_dir)
+    self.repository = configstore.outputs_repository()
+
+  def tearDown(self):
+    fileio.set_base_directory("")
+    shutil.rmtree(self.base_dir)
+
+  def read_outputs(self):
+    with open(os.path.join(self.base_dir, configstore.OUTPUTS_CONFIG_FILE)) as config_file:
+      return json.load(config_file)
+
+  def testSnapshotIsSharedAndImmutable(self):
+    snapshot = self.repository.snapshot()
+
+    self.failUnless(self.repository.snapshot() is snapshot)
+    self.failUnless(configstore.outputs_repository() is self.repository)
+    self.assertEqual(snapshot.get("HLT")["pin"], 18)
+    self.failUnless(snapshot.get("missing") is None)
+    self.assertRaises(TypeError, snapshot.get("HLT").__setitem__, "pin", 4)
+    self.assertRaises(TypeError, snapshot.get("HLT")["type"]["config"].update, {"mode": 0})
+
+  def testCommitCreatesNewVersion(self):
+    base = self.repository.snapshot()
+
+    current = self.repository.commit(base.version,
+      lambda outputs: outputs[0]["type"]["config"].update(set_point=170))
+
+    self.assertEqual(current.version, base.version + 1)
+    self.assertEqual(current.get("HLT")["type"]["config"]["set_point"], 170)
+    self.assertEqual(base.get("HLT")["type"]["config"]["set_point"], 160)
+    self.assertEqual(self.read_outputs()[0]["type"]["config"]["set_point"], 170)
+
+  def testStaleCommitConflicts(self):
+    base = self.repository.snapshot()
+    self.repository.commit(base.version, lambda outputs: None)
+
+    self.assertRaises(configstore.ConfigConflict, self.repository.commit,
+                      base.version, lambda outputs: None)
+
+  def testInvalidateOnlyReparsesChangedContent(self):
+    snapshot = self.repository.snapshot()
+
+    configstore.invalidate(configstore.OUTPUTS_CONFIG_FILE)
+    self.failUnless(self.repository.snapshot() is snapshot)
+
+    outputs = self.read_outputs()
+    outputs[1]["active"] = True
+    with open(os.path.join(self.base_dir, configstore.OUTPUTS_CONFIG_FILE), "w") as config_file:
+      json.dump(outputs, config_file)
+    configstore.invalidate(configstore.OUTPUTS_CONFIG_FILE)
+
+    self.assertEqual(self.repository.snapshot().version, snapshot.version + 1)
+    self.failUnless(self.repository.snapshot().get("BK")["active"])
+
+  def testCommitLatestRetriesAfterConflict(self):
+    commit = self.repository.commit
+
+    def conflicting_commit(base_version, update):
+      # another writer commits first, once
+      self.repository.commit = commit
+      commit(base_version, lambda outputs: outputs[1].update(active=True))
+      return commit(base_version, update)
+
+    self.repository.commit = conflicting_commit
+    self.repository.commit_latest(
+      lambda outputs: outputs[0]["type"]["config"].update(set_point=168))
+
+    snapshot = self.repository.snapshot()
+    self.assertEqual(snapshot.get("HLT")["type"]["config"]["set_point"], 168)
+    self.failUnless(snapshot.get("BK")["active"])
+
+  @mock.patch('beerery.fileio.log_program_state')
+  def testPidActionActivatesThroughRepository(self, mock_log):
+    mash = program.Program(pid_program("BK", 152))
+
+    mash.run(0, {}, {})
+    output = self.repository.snapshot().get("BK")
+    self.failUnless(output["active"])
+    self.assertEqual(output["type"]["config"]["mode"], 1)
+    self.assertEqual(output["type"]["config"]["set_point"], 152)
+    self.assertEqual(self.read_outputs()[1]["active"], True)
+
+    # waiting for the reload to start it, nothing more is written
+    version = self.repository.snapshot().version
+    mash.run(2000, {}, {})
+    self.assertEqual(self.repository.snapshot().version, version)
+    self.assertEqual(mash.state, constants.PROGRAM_RUNNING)
+
+  @mock.patch('beerery.fileio.log_program_state')
+  def testPidActionRetriesAfterConflict(self, mock_log):
+    mash = program.Program(pid_program("HLT", 168))
+    commit = self.repository.commit
+
+    def conflicting_commit(base_version, update):
+      # another writer commits first, once
+      self.repository.commit = commit
+      commit(base_version, lambda outputs: outputs[1].update(active=True))
+      return commit(base_version, update)
+
+    self.repository.commit = conflicting_commit
+    mash.run(0, {}, {})
+
+    snapshot = self.repository.snapshot()
+    self.failUnless(snapshot.get("HLT")["active"])
+    self.assertEqual(snapshot.get("HLT")["type"]["config"]["set_point"], 168)
+    self.failUnless(snapshot.get("BK")["active"])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import tempfile
+
+import beerery.fileio as fileio
+
+class StateWriterTests(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "input_HLT.json")
+
+  def tearDown(self):
+    fileio.stop_state_writer()
+    shutil.rmtree(self.directory)
+
+  def read(self):
+    with open(self.path) as state_file:
+      return json.load(state_file)
+
+  def testWriteJsonLeavesNoTempFile(self):
+    fileio.write_json(self.path, {"value": 150})
+
+    self.assertEqual(self.read(), {"value": 150})
+    self.assertEqual(os.listdir(self.directory), ["input_HLT.json"])
+
+  def testTempFileIsSyncedBeforeRename(self):
+    calls = mock.Mock()
+    calls.fsync.side_effect = os.fsync
+    calls.rename.side_effect = os.rename
+    with mock.patch('os.fsync', calls.fsync), \
+        mock.patch('os.rename', calls.rename):
+      fileio.write_text(self.path, "150")
+
+    self.assertEqual([c[0] for c in calls.mock_calls], ["fsync", "rename"])
+    self.assertEqual(open(self.path).read(), "150")
+
+  def testWritesAreCoalesced(self):
+    writer = fileio.StateWriter(60000)
+    for value in range(5):
+      writer.write(self.path, {"value": value})
+
+    self.failIf(os.path.exists(self.path))
+    writer.flush()
+
+    self.assertEqual(self.read(), {"value": 4})
+    stats = writer.stats()
+    self.assertEqual(stats["writes_requested"], 5)
+    self.assertEqual(stats["writes_avoided"], 4)
+    self.assertEqual(stats["files_written"], 1)
+
+  def testStopFlushesPendingWrites(self):
+    fileio.start_state_writer(60000)
+    fileio.write_state(self.path, {"value": 152})
+    fileio.stop_state_writer()
+
+    self.assertEqual(self.read(), {"value": 152})
+    self.failUnless(fileio.state_writer is None)
+
+class LiveStateTests(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "live.bin")
+    self.table = fileio.LiveStateTable(self.path, 4)
+
+  def tearDown(self):
+    self.table.close()
+    shutil.rmtree(self.directory)
+
+  def testSnapshotContainsInputsAndOutputs(self):
+    self.table.publish_input(u"HLT", {"value": 150.5, "units": "f",
+                                      "age_ms": 12})
+    self.table.publish_output(u"HLT", {"mode": "TPC", "output_value": 40,
+                                       "input_value": 150.5, "set_point": 160})
+
+    snapshot = fileio.read_live_state(self.path)
+
+    self.assertEqual(snapshot["generation"], 4)
+    self.assertEqual(snapshot["inputs"]["HLT"]["value"], 150.5)
+    self.assertEqual(snapshot["inputs"]["HLT"]["units"], "f")
+    self.assertEqual(snapshot["outputs"]["HLT"]["output_value"], 40)
+    self.assertEqual(snapshot["outputs"]["HLT"]["set_point"], 160)
+
+  def testSlotsAreReusedAndPruned(self):
+    self.table.publish_input(u"HLT", {"value": 1})
+    self.table.publish_input(u"HLT", {"value": 2})
+    self.table.publish_input(u"MLT", {"value": 3})
+    self.table.prune([u"MLT"], [])
+
+    reader = fileio.LiveStateReader(self.path)
+    snapshot = reader.snapshot()
+    reader.close()
+
+    self.assertEqual(snapshot["inputs"].keys(), [u"MLT"])
+
+  def testFullTableDropsNewEntities(self):
+    for name in [u"a", u"b", u"c", u"d", u"e"]:
+      self.table.publish_input(name, {"value": 1})
+
+    self.assertEqual(self.table.dropped, 1)
+    self.assertEqual(len(fileio.read_live_state(self.path)["inputs"]), 4)
+
+  def testTornReadIsRetried(self):
+    reader = fileio.LiveStateReader(self.path)
+    self.table.set_generation(1)
+    self.assertRaises(Exception, reader.snapshot, 3)
+
+    self.table.set_generation(2)
+    self.assertEqual(reader.snapshot()["generation"], 2)
+    reader.close()
+
+  def testRestartKeepsTheFileMapped(self):
+    self.table.close()
+    self.table = fileio.LiveStateTable(self.path, 8)
+    self.table.publish_input(u"HLT", {"value": 150})
+    reader = fileio.LiveStateReader(self.path)
+    self.table.close()
+
+    # a restarted controller opens the table while the reader maps it
+    self.table = fileio.LiveStateTable(self.path, 4)
+
+    self.assertEqual(os.path.getsize(self.path), fileio.live_state_size(8))
+    self.assertEqual(reader.snapshot()["inputs"], {})
+    reader.close()
+
+if __name__ == "__main__":
+  unittest.main()
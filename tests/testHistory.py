@@ -0,0 +1,62 @@
+import unittest
+
+import beerery.history as history
+
+class RingBufferTests(unittest.TestCase):
+  def testOverwritesOldestAndSearches(self):
+    ring = history.RingBuffer(4)
+    for i in range(6):
+      ring.append(i * 10, i * 1.5)
+
+    self.assertEqual(ring.count, 4)
+    self.assertEqual(ring.range(0, 100), [(20, 3.0), (30, 4.5), (40, 6.0), (50, 7.5)])
+    self.assertEqual(ring.range(25, 45), [(30, 4.5), (40, 6.0)])
+    self.assertEqual(ring.range(60, 70), [])
+
+class HistoryTests(unittest.TestCase):
+  def setUp(self):
+    self.history = history.History(10, {10000: 5, 60000: 5})
+
+  def testRawQuery(self):
+    for i in range(20):
+      self.history.record_input("HLT", i * 2000, 150 + i)
+
+    self.assertEqual(self.history.query("input_HLT", 30000, 34000),
+                     [(30000, 165.0), (32000, 166.0), (34000, 167.0)])
+    self.assertEqual(self.history.latest("input_HLT"), (38000, 169.0))
+    self.assertEqual(self.history.query("input_MLT", 0, 40000), [])
+
+  def testRollups(self):
+    for i in range(20):
+      self.history.record_output("HLT", i * 2000, i)
+
+    buckets = self.history.query("output_HLT", 0, 40000, 10000)
+    self.assertEqual(buckets[0], (0, 0, 4, 2, 5))
+    # the open bucket is included
+    self.assertEqual(buckets[-1], (30000, 15, 19, 17, 5))
+
+    minute = self.history.query("output_HLT", 0, 40000, 60000)
+    self.assertEqual(minute, [(0, 0, 19, 9.5, 20)])
+
+    self.assertRaises(Exception, self.history.query, "output_HLT", 0, 1, 5)
+
+  def testNoneValuesAreSkipped(self):
+    self.history.record_output("BK", 1000, None)
+    self.assertEqual(self.history.series_names(), [])
+
+  def testBestResolution(self):
+    self.assertEqual(self.history.best_resolution(0, 3600000, 100), 60000)
+    self.assertEqual(self.history.best_resolution(0, 60000, 100), 10000)
+
+    for i in range(20):
+      self.history.record_output("HLT", i * 2000, i)
+    # the last 10 raw samples fit, older ones were overwritten
+    self.assertEqual(self.history.best_resolution(20000, 38000, 10, "output_HLT"),
+                     history.RAW_RESOLUTION)
+    self.assertEqual(self.history.best_resolution(20000, 38000, 9, "output_HLT"),
+                     10000)
+    self.assertEqual(self.history.best_resolution(0, 38000, 100, "output_HLT"),
+                     10000)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,233 @@
+import unittest
+import mock
+import httplib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.controller as ctrl
+import beerery.liveapi as liveapi
+import beerery.pid as PID
+
+def output_state(name, value, date="2016-01-01 00:00:00"):
+  return {"name": name, "output_value": value, "date_utc": date}
+
+def client_frame(payload):
+  mask = bytearray("abcd")
+  masked = bytearray(payload)
+  for index in range(len(masked)):
+    masked[index] ^= mask[index % 4]
+  return struct.pack("!BB", 0x81, 0x80 | len(payload)) + bytes(mask) + \
+      bytes(masked)
+
+class WebSocket(object):
+  def __init__(self, port):
+    self.sock = socket.create_connection(("127.0.0.1", port), 2)
+    self.sock.sendall("GET /ws HTTP/1.1\r\nHost: localhost\r\n"
+                      "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                      "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+                      "Sec-WebSocket-Version: 13\r\n\r\n")
+    self.data = bytearray()
+    while "\r\n\r\n" not in self.data:
+      self.data.extend(self.sock.recv(4096))
+    headers, _, rest = bytes(self.data).partition("\r\n\r\n")
+    self.headers = headers
+    self.data = bytearray(rest)
+
+  def receive(self):
+    while True:
+      frame = liveapi.decode_frame(self.data)
+      if frame is not None:
+        del self.data[:frame[4]]
+        return json.loads(frame[3])
+      self.data.extend(self.sock.recv(4096))
+
+  def send(self, message):
+    self.sock.sendall(client_frame(json.dumps(message)))
+
+  def close(self):
+    self.sock.close()
+
+class LiveApiTests(unittest.TestCase):
+  def setUp(self):
+    self.controller = mock.Mock(outputs={"HLT": None, "BK": None},
+                                programs={"brew": mock.Mock()})
+
+  def serve(self, **kwargs):
+    server = liveapi.LiveApiServer(self.controller, "127.0.0.1", 0, **kwargs)
+    server.start()
+    self.addCleanup(server.stop)
+    return server
+
+  def request(self, server, method, path, body=None):
+    connection = httplib.HTTPConnection("127.0.0.1", server.port, timeout=2)
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    content = response.read()
+    connection.close()
+    return response.status, json.loads(content) if content else None
+
+  def testStateIsServedFromMemory(self):
+    server = self.serve()
+    server.publish(4, {"outputs": {"HLT": output_state("HLT", 40)}},
+                   {"outputs": ["HLT"]})
+
+    status, state = self.request(server, "GET", "/api/state")
+    self.assertEqual(status, 200)
+    self.assertEqual(state["sequence"], 4)
+    self.assertEqual(state["outputs"]["HLT"]["output_value"], 40)
+    self.assertEqual(self.request(server, "GET", "/api/outputs/HLT")[1],
+                     output_state("HLT", 40))
+    self.assertEqual(self.request(server, "GET", "/api/outputs/BK")[0], 404)
+    self.assertEqual(self.request(server, "DELETE", "/api/state")[0], 405)
+
+  def testControlChangesAreHeldForTheNextTick(self):
+    server = self.serve()
+
+    status, _ = self.request(server, "POST", "/api/outputs/HLT",
+                             json.dumps({"mode": "manual", "output": 40}))
+    self.assertEqual(status, 202)
+    self.assertEqual(self.request(server, "POST", "/api/outputs/MLT",
+                                  json.dumps({"set_point": 150}))[0], 404)
+    self.assertEqual(self.request(server, "POST", "/api/outputs/HLT",
+                                  json.dumps({"output": 140}))[0], 400)
+    self.assertEqual(self.request(server, "POST", "/api/outputs/HLT",
+                                  "not json")[0], 400)
+    for body in ['{"set_point": NaN}', '{"output": -Infinity}',
+                 '{"set_point": Infinity}']:
+      self.assertEqual(self.request(server, "POST", "/api/outputs/HLT",
+                                    body)[0], 400)
+
+    self.assertEqual(server.take_changes(), [
+      ("HLT", {"mode": PID.PidController.MANUAL_MODE, "set_point": None,
+               "output": 40})])
+    self.assertEqual(server.take_changes(), [])
+
+  def testProgramAlarmsAreAcknowledged(self):
+    server = self.serve()
+
+    self.assertEqual(self.request(server, "POST",
+                                  "/api/programs/brew/acknowledge")[0], 202)
+    self.assertEqual(self.request(server, "POST",
+                                  "/api/programs/mash/acknowledge")[0], 404)
+    self.controller.programs["brew"].acknowledge.assert_called_once_with()
+
+  def testWebsocketGetsTheStateThenDeltas(self):
+    server = self.serve()
+    server.publish(1, {"outputs": {"HLT": output_state("HLT", 40),
+                                   "BK": output_state("BK", 85)}},
+                   {"outputs": ["HLT", "BK"]})
+    client = WebSocket(server.port)
+    self.addCleanup(client.close)
+
+    self.failUnless("Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+                    in client.headers)
+    state = client.receive()
+    self.assertEqual(state["type"], "state")
+    self.assertEqual(sorted(state["outputs"]), ["BK", "HLT"])
+
+    # only the date changed, nothing is sent
+    server.publish(2, {"outputs": {"HLT": output_state("HLT", 40, "later")}},
+                   {"outputs": ["HLT", "BK"]})
+    server.publish(3, {"outputs": {"BK": output_state("BK", 90)}},
+                   {"outputs": ["BK"]})
+
+    self.assertEqual(client.receive(), {
+      "type": "delta", "sequence": 3,
+      "outputs": {"BK": output_state("BK", 90)},
+      "removed": {"outputs": ["HLT"]}})
+
+  def testSubscribingDuringAPublishGetsItsChanges(self):
+    server = liveapi.LiveApiServer(self.controller)
+    client = mock.Mock(queue=liveapi.SendQueue(8))
+    full_message = server.full_message
+    publisher = threading.Thread(target=server.publish, args=(
+      1, {"outputs": {"HLT": output_state("HLT", 40)}}, {"outputs": ["HLT"]}))
+
+    def publish_while_subscribing():
+      message = full_message()
+      publisher.start()
+      publisher.join(0.2)
+      return message
+
+    server.full_message = publish_while_subscribing
+    server.subscribe(client)
+    publisher.join()
+
+    frames = [json.loads(liveapi.decode_frame(bytearray(frame))[3])
+              for frame in iter(client.queue.take, None)]
+    self.assertEqual([frame["type"] for frame in frames], ["state", "delta"])
+    self.assertEqual(frames[1]["outputs"], {"HLT": output_state("HLT", 40)})
+
+  def testWebsocketControlMessages(self):
+    server = self.serve()
+    client = WebSocket(server.port)
+    self.addCleanup(client.close)
+    client.receive()
+
+    client.send({"type": "control", "output": "HLT", "set_point": 155})
+    self.assertEqual(client.receive(), {"type": "accepted", "output": "HLT"})
+    client.send({"type": "control", "output": "HLT", "mode": "off"})
+    self.assertEqual(client.receive()["type"], "error")
+    client.send({"type": "control", "output": "HLT",
+                 "set_point": float("nan")})
+    self.assertEqual(client.receive()["type"], "error")
+
+    self.assertEqual(server.take_changes(), [
+      ("HLT", {"mode": None, "set_point": 155, "output": None})])
+
+  def testConnectionsOverTheLimitAreRefused(self):
+    server = self.serve(max_clients=1)
+    client = WebSocket(server.port)
+    self.addCleanup(client.close)
+    client.receive()
+
+    self.assertEqual(self.request(server, "GET", "/api/state")[0], 503)
+    self.assertEqual(server.stats()["refused"], 1)
+    self.assertEqual(server.stats()["websockets"], 1)
+
+  def testSlowClientsAreResynced(self):
+    server = liveapi.LiveApiServer(self.controller)
+    client = mock.Mock(queue=liveapi.SendQueue(2))
+    server.subscribers.add(client)
+
+    for sequence in range(4):
+      server.publish(sequence, {"outputs": {"HLT": output_state("HLT", sequence)}},
+                     {"outputs": ["HLT"]})
+
+    # the third delta overflowed the queue, the fourth publish resyncs
+    self.failIf(client.queue.stale)
+    self.assertEqual(client.queue.dropped, 2)
+    self.assertEqual(server.stats()["resyncs"], 1)
+    frame = liveapi.decode_frame(bytearray(client.queue.take()))
+    self.assertEqual(json.loads(frame[3])["type"], "state")
+    self.assertEqual(client.queue.take(), None)
+
+  def testControllerAppliesChangesOnTheNextTick(self):
+    config = {"name": "HLT", "pin": 18, "mode": "TPC", "input": "HLT",
+              "type": {"controller": "PID", "config": {
+                "mode": 1, "kp": 20, "ki": 1, "kd": 5, "set_point": 150}}}
+    output = ctrl.Output(config)
+    output.set_type(config["type"], config, 2000)
+    controller = ctrl.Controller()
+    controller.outputs = {"HLT": output}
+    controller.live_api = liveapi.LiveApiServer(controller)
+
+    controller.live_api.queue_change("HLT", {"set_point": 165})
+    self.assertEqual(output.controller.set_point, 150)
+    controller.apply_live_changes()
+
+    self.assertEqual(output.controller.set_point, 165)
+    self.assertEqual(output.controller.mode, PID.PidController.AUTO_MODE)
+    self.assertEqual(controller.unsaved_outputs, set(["HLT"]))
+
+if __name__ == '__main__':
+  unittest.main()
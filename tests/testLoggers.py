@@ -0,0 +1,138 @@
+import unittest
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import beerery.constants as constants
+import beerery.loggers as loggers
+
+class MongoDBLoggerTests(unittest.TestCase):
+  def setUp(self):
+    self.client_patch = mock.patch('beerery.loggers.MongoClient')
+    self.client = self.client_patch.start()
+    self.database = mock.MagicMock()
+    self.client.return_value.__getitem__.return_value = self.database
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.client_patch.stop()
+    shutil.rmtree(self.directory)
+
+  def inserted(self):
+    return [c[0][0] for c in self.database.__getitem__.return_value.insert.call_args_list]
+
+  def testRecordsAreWrittenInBulk(self):
+    logger = loggers.MongoDBLogger("uri", "brewery", batch_size=3,
+                                   batch_age_ms=60000)
+    for value in range(3):
+      logger.log_input("HLT", {"value": value})
+
+    logger.close()
+
+    self.assertEqual(self.inserted(), [[{"value": 0}, {"value": 1}, {"value": 2}]])
+    self.database.__getitem__.assert_called_with("input_HLT")
+    self.assertEqual(logger.get_metrics()["batches"], 1)
+
+  def testOldRecordsAreFlushed(self):
+    logger = loggers.MongoDBLogger("uri", "brewery", batch_size=100,
+                                   batch_age_ms=10)
+    logger.log_output("HLT", {"output_value": 50})
+    time.sleep(0.1)
+
+    self.assertEqual(self.inserted(), [[{"output_value": 50}]])
+    logger.close()
+
+  def testQueuedRecordIsACopy(self):
+    logger = loggers.MongoDBLogger("uri", "brewery", batch_size=1)
+    state = {"value": 1}
+    logger.log_input("HLT", state)
+    logger.close()
+
+    self.failIf(self.inserted()[0][0] is state)
+
+  def testDropOldestAndDropNewest(self):
+    for policy, expected in [(constants.LOG_OVERFLOW_DROP_OLDEST, [1, 2]),
+                             (constants.LOG_OVERFLOW_DROP_NEWEST, [0, 1])]:
+      logger = loggers.MongoDBLogger("uri", "brewery", max_queue=2,
+                                     batch_size=10, batch_age_ms=60000,
+                                     overflow=policy)
+      for value in range(3):
+        logger.log_input("HLT", {"value": value})
+
+      self.assertEqual([r[1]["value"] for r in logger.queue], expected)
+      self.assertEqual(logger.get_metrics()["dropped"], 1)
+      self.assertEqual(logger.get_metrics()["queue_depth"], 2)
+      logger.close()
+
+  def testSpilledRecordsAreReplayed(self):
+    spill_path = os.path.join(self.directory, "spill.jsonl")
+    spill_config = {"max_queue": 1, "batch_size": 10, "batch_age_ms": 60000,
+                    "overflow": constants.LOG_OVERFLOW_SPILL,
+                    "spill_path": spill_path}
+    logger = loggers.MongoDBLogger("uri", "brewery", **spill_config)
+    for value in range(3):
+      logger.log_input("HLT", {"value": value})
+
+    logger.close()
+
+    self.assertEqual(logger.get_metrics()["spilled"], 2)
+    self.assertEqual(self.inserted(), [[{"value": 0}]])
+    self.failUnless(os.path.exists(spill_path))
+
+    # the next logger replays the spill file once its queue is empty
+    spill_config["batch_age_ms"] = 10
+    replay_logger = loggers.MongoDBLogger("uri", "brewery", **spill_config)
+    time.sleep(0.1)
+    replay_logger.close()
+
+    self.assertEqual(self.inserted(), [[{"value": 0}], [{"value": 1}], [{"value": 2}]])
+    self.failIf(os.path.exists(spill_path))
+
+  def testSpillingIsLeftToTheFlusher(self):
+    spill_path = os.path.join(self.directory, "spill.jsonl")
+    logger = loggers.MongoDBLogger("uri", "brewery", max_queue=1,
+                                   batch_size=10, batch_age_ms=60000,
+                                   overflow=constants.LOG_OVERFLOW_SPILL,
+                                   spill_path=spill_path)
+    spill = logger.spill
+    spilling_threads = []
+
+    def record_thread(records):
+      spilling_threads.append(threading.current_thread())
+      spill(records)
+
+    logger.spill = record_thread
+    for value in range(3):
+      logger.log_input("HLT", {"value": value})
+    logger.close()
+
+    self.failUnless(spilling_threads)
+    self.failUnless(all(thread is logger.flusher
+                        for thread in spilling_threads))
+    self.assertEqual(logger.get_metrics()["spilled"], 2)
+
+  @mock.patch('beerery.loggers.BatchingLogger.RETRY_S', 0.01)
+  def testOnlyUnwrittenCollectionsAreRetried(self):
+    insert = self.database.__getitem__.return_value.insert
+    insert.side_effect = [None, Exception("insert failed"), None]
+    logger = loggers.MongoDBLogger("uri", "brewery", batch_size=2,
+                                   batch_age_ms=10)
+    logger.log_input("HLT", {"value": 1})
+    logger.log_output("HLT", {"output_value": 50})
+    time.sleep(0.1)
+    logger.close()
+
+    self.assertEqual(self.inserted(), [[{"value": 1}], [{"output_value": 50}],
+                                       [{"output_value": 50}]])
+    self.assertEqual(logger.get_metrics()["written"], 2)
+    self.assertEqual(logger.get_metrics()["failed_batches"], 1)
+
+  def testUnknownOverflowPolicy(self):
+    self.assertRaises(Exception, loggers.MongoDBLogger, "uri", "brewery",
+                      overflow="block")
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import mock
+import sys
+import os
+import threading
+import time
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import random
+
+import beerery.batchpid as batchpid
+import beerery.controller as ctrl
+import beerery.pid as PID
+import beerery.records as records
+
+class LoopManagerTests(unittest.TestCase):
+  def setUp(self):
+    self.loop_manager = ctrl.LoopManager(50)
+    self.loop_manager.start()
+    self.fired = []
+
+  def tearDown(self):
+    self.loop_manager.stop()
+
+  def record(self, name):
+    return lambda: self.fired.append(name)
+
+  def testCallbacksFireInDeadlineOrder(self):
+    self.loop_manager.schedule_callback(self.record("late"), 40)
+    self.loop_manager.schedule_callback(self.record("early"), 10)
+    self.loop_manager.schedule_callback(self.record("now"), 0)
+
+    time.sleep(0.1)
+
+    self.assertEqual(self.fired, ["now", "early", "late"])
+
+  def testCancelledCallbackDoesNotFire(self):
+    handle = self.loop_manager.schedule_callback(self.record("cancelled"), 20)
+    self.failUnless(handle.cancel())
+
+    time.sleep(0.05)
+
+    self.assertEqual(self.fired, [])
+    self.failIf(handle.fired)
+
+  def testNewWindowSupersedesGroup(self):
+    self.loop_manager.schedule_callback(self.record("old_low"), 30, "HLT")
+    self.loop_manager.schedule_callback(self.record("other"), 30, "BK")
+
+    self.assertEqual(self.loop_manager.cancel_group("HLT"), 1)
+    self.loop_manager.schedule_callback(self.record("new_high"), 0, "HLT")
+
+    time.sleep(0.06)
+
+    self.assertEqual(self.fired, ["new_high", "other"])
+
+  def testLatenessIsRecorded(self):
+    handle = self.loop_manager.schedule_callback(self.record("edge"), 10)
+
+    time.sleep(0.05)
+
+    stats = self.loop_manager.timing_stats()
+    self.assertEqual(stats["fired"], 1)
+    self.failUnless(handle.lateness_ms() >= 0)
+    self.assertEqual(stats["max_ms"], handle.lateness_ms())
+
+  def testIdleThreadWakesForANewEdge(self):
+    loop_manager = ctrl.LoopManager(10000)
+    loop_manager.start()
+    self.addCleanup(loop_manager.stop)
+    latencies = []
+
+    for _ in range(4):
+      # long enough idle for a polling wait to back off to 50ms sleeps
+      time.sleep(0.25)
+      fired = threading.Event()
+      fired_at = []
+      def edge():
+        fired_at.append(time.time())
+        fired.set()
+      scheduled = time.time()
+      loop_manager.schedule_callback(edge, 0)
+      self.failUnless(fired.wait(1))
+      latencies.append((fired_at[0] - scheduled) * 1000)
+
+    self.failUnless(max(latencies) < 10, latencies)
+
+  def testStopEndsTheThread(self):
+    self.loop_manager.stop()
+    self.failIf(self.loop_manager.is_alive())
+    self.assertEqual(self.loop_manager.wake_read, None)
+
+  def testPidComputesEveryJitteredTick(self):
+    loop_manager = ctrl.LoopManager(100)
+    loop_manager.start()
+    self.addCleanup(loop_manager.stop)
+    config = {"mode": PID.PidController.AUTO_MODE, "kp": 20, "ki": 1,
+              "kd": 5, "set_point": 150, "sample_time_ms": 100}
+    scalar = PID.PidController(**config)
+    batch = batchpid.BatchPidController()
+    slot = batch.add(**config)
+    rand = random.Random(3)
+    missed = []
+
+    for sequence in range(30):
+      loop_manager.next_iteration().wait()
+      tick = records.LoopTick(sequence, loop_manager.begin_loop(),
+                              time.time())
+      # input reads take a varying time before the outputs compute
+      time.sleep(rand.uniform(0, 0.01))
+      scalar.input = 140
+      batch.set_inputs([slot], [140])
+      batch.compute(tick.tick_ms)
+      computed = (scalar.compute(tick.tick_ms), slot.compute(tick.tick_ms))
+      if sequence and computed != (True, True):
+        missed.append((sequence, computed))
+
+    self.assertEqual(missed, [])
+
+  def testLoopIsSignalled(self):
+    self.failUnless(self.loop_manager.next_iteration().wait(0.2))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.metrics as metrics
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+class HistogramTests(unittest.TestCase):
+  def testPercentilesWithinBucketError(self):
+    histogram = metrics.Histogram()
+    for value in range(1, 10001):
+      histogram.record(value / 10.0)
+
+    snapshot = histogram.snapshot()
+    self.assertEqual(snapshot["count"], 10000)
+    self.assertEqual(snapshot["min_ms"], 0.1)
+    self.assertEqual(snapshot["max_ms"], 1000.0)
+    self.assertAlmostEqual(snapshot["mean_ms"], 500.05, 3)
+    self.assertAlmostEqual(snapshot["p50_ms"], 500.0, delta=500.0 * 0.02)
+    self.assertAlmostEqual(snapshot["p99_ms"], 990.0, delta=990.0 * 0.02)
+    self.assertAlmostEqual(snapshot["p99.9_ms"], 999.0, delta=999.0 * 0.02)
+
+  def testBucketsRoundTrip(self):
+    for value in [0, 1, 127, 128, 129, 255, 256, 1000, 123456, 10 ** 9]:
+      lowest, width = metrics.bucket_range(metrics.bucket_index(value))
+      self.failUnless(lowest <= value < lowest + width)
+
+  def testEmptyAndReset(self):
+    histogram = metrics.Histogram()
+    self.assertEqual(histogram.percentile(50), None)
+    histogram.record(5)
+    histogram.reset()
+    self.assertEqual(histogram.snapshot()["count"], 0)
+    self.assertEqual(histogram.snapshot()["max_ms"], None)
+
+class LoopMetricsTests(unittest.TestCase):
+  def tearDown(self):
+    clock.use_system_clock()
+
+  def testLoopManagerRecordsJitterAndLateness(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    loop_metrics = metrics.LoopMetrics()
+    loop_manager = ctrl.LoopManager(1000, loop_metrics)
+
+    loop_manager.begin_loop()
+    loop_manager.schedule_callback(lambda: None, 250)
+    loop_manager.wait_for_next_loop()
+    virtual.advance(30)
+    loop_manager.begin_loop()
+
+    snapshot = loop_metrics.snapshot()
+    self.assertEqual(snapshot["loop_period"]["count"], 1)
+    self.assertEqual(snapshot["loop_jitter"]["max_ms"], 30)
+    self.assertEqual(snapshot["tpc_lateness"]["max_ms"], 0)
+
+  @mock.patch('beerery.sensors.tempsensors.OneWireTempSensor')
+  def testControlLoopRecordsPhasesAndWritesSnapshot(self, mock_onewire):
+    mock_onewire.return_value.get_temp.return_value = 100
+    mock_onewire.return_value.units.return_value = "f"
+    mock_onewire.return_value.sample_age_ms.return_value = 0
+    base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, base_dir)
+    shutil.copytree(CONFIG_DIR, os.path.join(base_dir, "config"))
+    os.mkdir(os.path.join(base_dir, "state"))
+    with open(os.path.join(base_dir, "config", "controller.json")) as config_file:
+      config = json.load(config_file)
+    config["metrics_interval_ms"] = 0
+    with open(os.path.join(base_dir, "config", "controller.json"), "w") as config_file:
+      json.dump(config, config_file)
+
+    clock.set_clock(clock.VirtualClock())
+    controller = ctrl.Controller(base_dir)
+    loops = []
+
+    def on_loop():
+      loops.append(1)
+      return len(loops) >= 3
+
+    with mock.patch('beerery.controller.DEV_LOGGING', False), \
+        mock.patch('beerery.program.fileio.log_program_state'):
+      controller.control(on_loop)
+
+    # stopped by the callback, not a crash
+    self.failIf(os.path.exists(os.path.join(base_dir, ctrl.TRACE_CRASH_FILE)))
+
+    histograms = controller.metrics_snapshot()["histograms"]
+    for phase in ["config", "inputs", "programs", "outputs", "logging.outputs",
+                  "iteration", "wait", "loop_jitter"]:
+      self.failUnless(phase in histograms, phase)
+    self.assertEqual(histograms["iteration"]["count"], 3)
+    self.failUnless(any(name.startswith("input.") for name in histograms))
+
+    with open(os.path.join(base_dir, "state", "loop_metrics.json")) as state_file:
+      self.failUnless("iteration" in json.load(state_file)["histograms"])
+
+if __name__ == '__main__':
+  unittest.main()
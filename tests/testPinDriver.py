@@ -0,0 +1,123 @@
+import unittest
+import mock
+import os
+import sys
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.pindriver as pindriver
+
+def tpc_output(name, pin, output, driver):
+  config = {"name": name, "pin": pin, "mode": "TPC", "input": name,
+            "type": {"controller": "PID", "config": {
+              "mode": 0, "output": output, "kp": 20, "ki": 1, "kd": 5,
+              "set_point": 150}}}
+  io_output = ctrl.Output(config)
+  io_output.set_type(config["type"], config, 1000, pin_driver=driver)
+  return io_output
+
+class PinDriverTests(unittest.TestCase):
+  def setUp(self):
+    self.backend = pindriver.MemoryBackend()
+    self.driver = pindriver.PinDriver(self.backend)
+
+  def tearDown(self):
+    clock.use_system_clock()
+
+  def testRedundantWritesAreDropped(self):
+    self.driver.setup_output(18)
+    for _ in range(3):
+      self.driver.write(18, True)
+    self.driver.write(18, False)
+
+    self.assertEqual(self.backend.edges(18), [(None, True), (None, False)])
+    stats = self.driver.stats()
+    self.assertEqual(stats["requested"], 4)
+    self.assertEqual(stats["redundant"], 2)
+    self.assertEqual(stats["pin_writes"], 2)
+
+  def testWritesToUnknownPinsAreRefused(self):
+    self.driver.write(4, True)
+    self.driver.setup_output(4)
+    self.driver.release(4)
+    self.driver.write(4, True)
+
+    self.assertEqual(self.backend.writes, [])
+    self.assertEqual(self.driver.stats()["refused"], 2)
+    self.assertEqual(self.driver.mode(4), None)
+
+  def testBatchAppliesOneSetAndOneClear(self):
+    for pin in [18, 22, 23]:
+      self.driver.setup_output(pin, pin == 23)
+
+    self.driver.begin_batch()
+    self.driver.write(18, True)
+    self.driver.write_many([(22, True), (23, False), (18, True)])
+    self.assertEqual(self.backend.writes, [])
+    self.driver.end_batch()
+
+    self.assertEqual(self.backend.writes, [(None, True, (18, 22)),
+                                           (None, False, (23,))])
+    self.assertEqual(self.driver.stats()["bulk_writes"], 2)
+    self.assertEqual(self.driver.level(23), False)
+
+  def testRpioBackendSkipsModeReads(self):
+    rpio = mock.Mock()
+    driver = pindriver.PinDriver(pindriver.RpioBackend(rpio))
+    driver.setup_output(18)
+    driver.write(18, True)
+    driver.write(18, True)
+
+    rpio.setup.assert_called_once_with(18, rpio.OUT, initial=rpio.LOW)
+    rpio.output.assert_called_once_with(18, True)
+    self.failIf(rpio.gpio_function.called)
+
+  def testTpcEdgesAtTheSameInstantAreOneBulkWrite(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    start = virtual.millis()
+    backend = pindriver.MemoryBackend(lambda: clock.millis() - start)
+    driver = pindriver.PinDriver(backend)
+    loop_manager = ctrl.LoopManager(1000, pin_driver=driver)
+    outputs = [tpc_output("HLT", 18, 50, driver),
+               tpc_output("BK", 22, 50, driver),
+               tpc_output("MLT", 23, 100, driver)]
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      for _ in range(3):
+        for io_output in outputs:
+          io_output.calculate(None, None, 1000, loop_manager)
+        loop_manager.wait_for_next_loop()
+
+    self.assertEqual(backend.writes, [
+      (0, True, (18, 22, 23)), (500, False, (18, 22)),
+      (1000, True, (18, 22)), (1500, False, (18, 22)),
+      (2000, True, (18, 22)), (2500, False, (18, 22))])
+    # 3 outputs for 3 windows, the 100% output is only written once
+    self.assertEqual(driver.stats()["requested"], 15)
+    self.assertEqual(driver.stats()["redundant"], 2)
+    self.assertEqual(driver.stats()["bulk_writes"], 6)
+
+  def testClosingMidWindowCancelsTheLowEdge(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    loop_manager = ctrl.LoopManager(1000, pin_driver=self.driver)
+    hlt = tpc_output("HLT", 18, 50, self.driver)
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      hlt.calculate(None, None, 1000, loop_manager)
+    loop_manager.execute_callbacks(clock.millis())
+    self.assertEqual(self.driver.level(18), True)
+
+    hlt.close(loop_manager)
+
+    self.assertEqual(self.driver.level(18), False)
+    self.assertEqual(loop_manager.pending_callbacks(), 0)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,192 @@
+import unittest
+import mock
+import os
+import sys
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.configstore as configstore
+import beerery.constants as constants
+import beerery.controller as ctrl
+import beerery.pid as PID
+import beerery.pindriver as pindriver
+import beerery.program as program
+
+MINUTE_MS = 60 * 1000
+
+def pid_output(name):
+  config = {"name": name, "pin": 18, "mode": "TPC", "active": True,
+            "input": name,
+            "type": {"controller": "PID",
+                     "config": {"kp": 20, "ki": 1, "kd": 5, "mode": 0,
+                                "set_point": 70, "output": 0}}}
+  output = ctrl.Output(config)
+  output.set_type(config["type"], config, 2000)
+  return output
+
+class FakeInput(object):
+  def __init__(self, value):
+    self.last_value = value
+
+@mock.patch('beerery.fileio.log_program_state')
+class ProgramTests(unittest.TestCase):
+  def setUp(self):
+    self.outputs = {"HLT": pid_output("HLT")}
+    self.inputs = {"HLT": FakeInput(60)}
+    bk_config = dict(pid_output("BK").config, active=False)
+    self.repository = mock.Mock()
+    self.repository.snapshot.return_value = configstore.ConfigSnapshot(
+      1, None, [self.outputs["HLT"].config, bk_config])
+
+  def program(self, *actions):
+    return program.Program({"name": "brew", "active": True, "steps": [
+      {"name": "step", "actions": list(actions)}]}, self.repository)
+
+  def tick(self, prog, now_ms):
+    return prog.run(now_ms, self.inputs, self.outputs)
+
+  def controller(self):
+    return self.outputs["HLT"].controller
+
+  def testActionChangesOutputInMemory(self, mock_log):
+    prog = self.program({"type": "PID", "output_name": "HLT",
+                         "output": 100, "setpoint": 145})
+
+    self.tick(prog, 0)
+
+    self.assertEqual(self.controller().mode, PID.PidController.MANUAL_MODE)
+    self.assertEqual(self.controller().output, 100)
+    self.assertEqual(self.controller().set_point, 145)
+    self.assertEqual(prog.take_changed_outputs(), set(["HLT"]))
+    self.assertEqual(prog.state, constants.PROGRAM_RUNNING)
+
+  def testTransitionTakesEffectInSameTick(self, mock_log):
+    prog = self.program(
+      {"type": "PID", "output_name": "HLT", "output": 100, "setpoint": 145},
+      {"type": "PID", "output_name": "HLT", "output": "PID", "setpoint": 150,
+       "end": "hold"})
+
+    self.tick(prog, 0)
+    self.inputs["HLT"].last_value = 146
+    self.failUnless(self.tick(prog, 2000))
+
+    # reached 145, the next action already set the pid to 150
+    self.assertEqual(self.controller().mode, PID.PidController.AUTO_MODE)
+    self.assertEqual(self.controller().set_point, 150)
+    self.assertEqual(prog.current()[1].setpoint, 150)
+
+  def testDurationTimerThenOff(self, mock_log):
+    prog = self.program({"type": "PID", "output_name": "HLT", "output": "PID",
+                         "setpoint": 150, "duration": 60, "end": "off"})
+
+    self.tick(prog, 0)
+    self.inputs["HLT"].last_value = 150
+    self.tick(prog, 59 * MINUTE_MS)
+    self.assertEqual(prog.state, constants.PROGRAM_RUNNING)
+    self.assertEqual(prog.program_state(59 * MINUTE_MS)["remaining_ms"], MINUTE_MS)
+
+    self.tick(prog, 60 * MINUTE_MS)
+    self.assertEqual(prog.state, constants.PROGRAM_COMPLETE)
+    self.assertEqual(self.controller().mode, PID.PidController.MANUAL_MODE)
+    self.assertEqual(self.controller().output, 0)
+
+  def testHoldTimerStartsAtSetpoint(self, mock_log):
+    prog = self.program({"type": "PID", "output_name": "HLT", "output": "PID",
+                         "setpoint": 150, "hold": 10})
+
+    self.tick(prog, 0)
+    self.tick(prog, 5 * MINUTE_MS)
+    self.inputs["HLT"].last_value = 151
+    self.tick(prog, 20 * MINUTE_MS)
+    self.tick(prog, 29 * MINUTE_MS)
+    self.assertEqual(prog.state, constants.PROGRAM_RUNNING)
+
+    self.tick(prog, 30 * MINUTE_MS)
+    self.assertEqual(prog.state, constants.PROGRAM_COMPLETE)
+
+  def testAlarmWaitsForAcknowledge(self, mock_log):
+    prog = self.program({"action": "alarm,wait", "alarm_seconds": 5},
+                        {"type": "PID", "output_name": "HLT", "output": 50})
+
+    self.tick(prog, 0)
+    self.assertEqual(prog.state, constants.PROGRAM_WAITING)
+    self.failUnless(prog.alarm())
+
+    self.tick(prog, 5000)
+    self.failIf(prog.alarm())
+    self.assertEqual(prog.state, constants.PROGRAM_WAITING)
+
+    prog.acknowledge()
+    self.tick(prog, 6000)
+    self.assertEqual(prog.state, constants.PROGRAM_COMPLETE)
+    self.assertEqual(self.controller().output, 50)
+
+  def testAlarmDrivesTheAlarmOutput(self, mock_log):
+    prog = self.program({"action": "alarm", "alarm_seconds": 5},
+                        {"action": "wait"})
+    driver = pindriver.PinDriver(pindriver.MemoryBackend())
+    controller = ctrl.Controller(pin_driver=driver)
+    controller.controller_config.update(alarm_output_name="alarm",
+                                       programs_current=True)
+    controller.programs = {"brew": prog}
+    controller.inputs, controller.outputs = self.inputs, self.outputs
+    self.repository.snapshot.return_value = configstore.ConfigSnapshot(
+      1, None, [{"name": "alarm", "type": "manual", "pin": 25,
+                 "active": False}])
+
+    with mock.patch('beerery.configstore.outputs_repository',
+                    return_value=self.repository):
+      controller.evaluate_programs(0)
+      self.assertEqual(driver.mode(25), "out")
+      self.assertEqual(driver.level(25), True)
+      controller.evaluate_programs(5000)
+
+    self.assertEqual(driver.level(25), False)
+    self.assertEqual(prog.state, constants.PROGRAM_WAITING)
+
+  def testWaitTimer(self, mock_log):
+    prog = self.program({"action": "wait", "wait": 1})
+
+    self.tick(prog, 0)
+    self.tick(prog, MINUTE_MS - 1)
+    self.assertEqual(prog.state, constants.PROGRAM_WAITING)
+    self.tick(prog, MINUTE_MS)
+    self.assertEqual(prog.state, constants.PROGRAM_COMPLETE)
+
+  def testInactiveOutputIsActivated(self, mock_log):
+    prog = self.program({"type": "PID", "output_name": "BK", "output": 50})
+
+    self.tick(prog, 0)
+    self.assertEqual(prog.state, constants.PROGRAM_RUNNING)
+    self.assertEqual(self.repository.commit_latest.call_count, 1)
+    outputs = configstore.thaw(self.repository.snapshot().config)
+    self.repository.commit_latest.call_args[0][0](outputs)
+    self.failUnless(outputs[1]["active"])
+    self.assertEqual(outputs[1]["type"]["config"]["mode"],
+                     PID.PidController.MANUAL_MODE)
+    self.assertEqual(outputs[1]["type"]["config"]["output"], 50)
+
+    self.outputs["BK"] = pid_output("BK")
+    self.tick(prog, 2000)
+    self.assertEqual(prog.state, constants.PROGRAM_COMPLETE)
+
+  def testNonPidOutputFailsProgram(self, mock_log):
+    self.outputs["HLT"].config = {"type": {"controller": "manual"}}
+    prog = self.program({"type": "PID", "output_name": "HLT", "output": 50})
+
+    self.tick(prog, 0)
+    self.assertEqual(prog.state, constants.PROGRAM_FAILED)
+    self.failUnless("must be type PID" in prog.error)
+
+  def testMissingOutputFailsProgram(self, mock_log):
+    prog = self.program({"type": "PID", "output_name": "MLT", "output": 50})
+
+    self.tick(prog, 0)
+    self.assertEqual(prog.state, constants.PROGRAM_FAILED)
+    self.failUnless("'MLT' not found" in prog.error)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.pindriver as pindriver
+import beerery.pwm as pwm
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+
+class EdgeRecorder(object):
+  """mocked RPIO that records (ms into the run, pin, level) for each write"""
+  OUT = 0
+  LOW = False
+  HIGH = True
+
+  def __init__(self, start_ms):
+    self.start_ms = start_ms
+    self.edges = []
+
+  def setup(self, pin, mode, initial=None):
+    pass
+
+  def cleanup(self):
+    pass
+
+  def gpio_function(self, pin):
+    return self.OUT
+
+  def output(self, pin, level):
+    self.edges.append((clock.millis() - self.start_ms, pin, level))
+
+  def edges_for(self, pin):
+    return [(at, level) for at, edge_pin, level in self.edges if edge_pin == pin]
+
+class PwmTests(unittest.TestCase):
+  def setUp(self):
+    self.virtual = clock.VirtualClock()
+    clock.set_clock(self.virtual)
+    self.rpio = EdgeRecorder(self.virtual.millis())
+
+  def tearDown(self):
+    clock.use_system_clock()
+
+  def driver(self, *pins):
+    driver = pindriver.PinDriver(pindriver.RpioBackend(self.rpio))
+    for pin in pins:
+      driver.setup_output(pin)
+    return driver
+
+  def testEdgeSchedule(self):
+    schedule = pwm.edge_schedule({18: 25, 22: 25, 23: 0, 24: 100, 25: 60}, 200)
+
+    self.assertEqual(schedule, [
+      (0, [(18, True), (22, True), (23, False), (24, True), (25, True)]),
+      (50, [(18, False), (22, False)]),
+      (120, [(25, False)])])
+
+  def testPinsShareOneCallbackPerEdge(self):
+    loop_manager = ctrl.LoopManager(1000)
+    driver = self.driver(18, 22, 23)
+    scheduler = pwm.PwmScheduler(loop_manager, 100, driver.write_many)
+    scheduler.set_duty(18, 25)
+    scheduler.set_duty(22, 25)
+    scheduler.set_duty(23, 60)
+    loop_manager.wait_for_next_loop()
+
+    self.assertEqual(self.rpio.edges_for(18)[:4],
+                     [(0, True), (25, False), (100, True), (125, False)])
+    self.assertEqual(self.rpio.edges_for(23)[:2], [(0, True), (60, False)])
+    self.assertEqual(len(self.rpio.edges_for(22)), 21)
+
+    # 10 periods of 3 edges plus the start of the 11th at 1000ms
+    self.assertEqual(scheduler.stats()["edges"], 31)
+    self.assertEqual(loop_manager.fired_count, 31)
+    self.assertEqual(loop_manager.timing_stats()["max_ms"], 0)
+
+  def testDutyChangesAtNextPeriodAndRemoveSetsLow(self):
+    loop_manager = ctrl.LoopManager(100)
+    owner = object()
+    scheduler = pwm.PwmScheduler(loop_manager, 100, self.driver(18).write_many)
+    scheduler.set_duty(18, 50, owner)
+    loop_manager.wait_for_next_loop()
+    # the period starting at 100ms has begun, 100% applies from 200ms
+    scheduler.set_duty(18, 100, owner)
+    loop_manager.wait_for_next_loop()
+    loop_manager.wait_for_next_loop()
+    scheduler.remove(18, object())
+    scheduler.remove(18, owner)
+    loop_manager.wait_for_next_loop()
+
+    # the pin is already high at 300ms so only the remove writes
+    self.assertEqual(self.rpio.edges_for(18),
+                     [(0, True), (50, False), (100, True), (150, False),
+                      (200, True), (300, False)])
+    self.assertEqual(scheduler.stats()["pins"], 0)
+
+  @mock.patch('beerery.sensors.tempsensors.OneWireTempSensor')
+  def testControllerDrivesPwmOutput(self, mock_onewire):
+    mock_onewire.return_value.get_temp.return_value = 100
+    mock_onewire.return_value.units.return_value = "f"
+    mock_onewire.return_value.sample_age_ms.return_value = 0
+    base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, base_dir)
+    shutil.copytree(CONFIG_DIR, os.path.join(base_dir, "config"))
+    os.mkdir(os.path.join(base_dir, "state"))
+    outputs_path = os.path.join(base_dir, "config", "outputs.json")
+    with open(outputs_path) as config_file:
+      outputs = json.load(config_file)
+    outputs[0].update({"active": True, "mode": "PWM"})
+    outputs[0]["type"]["config"].update({"mode": 0, "output": 30})
+    with open(outputs_path, "w") as config_file:
+      json.dump(outputs[:1], config_file)
+    with open(os.path.join(base_dir, "config", "programs.json"), "w") as config_file:
+      json.dump([], config_file)
+
+    loops = []
+    def on_loop():
+      loops.append(1)
+      return len(loops) >= 3
+
+    with mock.patch('beerery.controller.RPIO', self.rpio), \
+        mock.patch('beerery.controller.DEV_LOGGING', False):
+      ctrl.Controller(base_dir).control(on_loop)
+
+    pin = outputs[0]["pin"]
+    edges = self.rpio.edges_for(pin)
+    # the 200ms carrier is independent of the 2000ms control sample time
+    highs = [at for at, level in edges if level]
+    lows = [at for at, level in edges if not level]
+    self.failUnless(len(highs) >= 20)
+    self.assertEqual([b - a for a, b in zip(highs, highs[1:])],
+                     [200] * (len(highs) - 1))
+    self.assertEqual([low - high for high, low in zip(highs, lows)][:-1],
+                     [60] * (len(highs) - 1))
+    # stopping the controller leaves the pin low
+    self.assertEqual(edges[-1][1], False)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import mock
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.fileio as fileio
+import beerery.records as records
+
+class RecordTests(unittest.TestCase):
+  def setUp(self):
+    self.tick = records.LoopTick(7, 1000, clock.VIRTUAL_EPOCH_MS / 1000.0)
+
+  def testRecordReadsLikeAStateDict(self):
+    record = records.InputRecord(self.tick, "HLT", 150.5, "f", 12)
+
+    self.assertEqual(record["value"], 150.5)
+    self.assertEqual(record.get("units"), "f")
+    self.assertEqual(record.get("missing", 1), 1)
+    self.assertEqual(record["date_utc"], "2016-01-01 00:00:00")
+    self.failUnless("age_ms" in record)
+    self.assertRaises(KeyError, lambda: record["missing"])
+    self.assertRaises(AttributeError, setattr, record, "extra", 1)
+
+  def testDatesFormattedOncePerTick(self):
+    first = records.InputRecord(self.tick, "HLT", 150.5, "f", 12)
+    second = records.OutputRecord(self.tick, "HLT", "TPC", 40, 150.5, 160,
+                                  "HLT")
+    self.assertEqual(self.tick.dates, None)
+
+    with mock.patch('beerery.records.datetime') as mock_datetime:
+      mock_datetime.fromtimestamp.return_value.strftime.return_value = "local"
+      mock_datetime.utcfromtimestamp.return_value.strftime.return_value = "utc"
+      first.as_dict()
+      state = second.as_dict()
+
+    self.assertEqual(mock_datetime.fromtimestamp.call_count, 1)
+    self.assertEqual(state, {"name": "HLT", "mode": "TPC", "output_value": 40,
+                             "input_value": 150.5, "set_point": 160,
+                             "input_name": "HLT", "date_servertime": "local",
+                             "date_utc": "utc"})
+
+  def testStateFilesAreSerializedFromRecords(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, "input_HLT.json")
+
+    fileio.write_json(path, records.InputRecord(self.tick, "HLT", 150.5, "f", 12))
+
+    with open(path) as state_file:
+      self.assertEqual(json.load(state_file)["date_servertime"],
+                       self.tick.formatted_dates()[0])
+
+  @mock.patch('beerery.sensors.tempsensors.OneWireTempSensor')
+  def testInputsShareTheTick(self, mock_onewire):
+    mock_onewire.return_value.get_temp.return_value = 100
+    mock_onewire.return_value.units.return_value = "f"
+    mock_onewire.return_value.sample_age_ms.return_value = 0
+
+    io_input = ctrl.Input("HLT", 0.5)
+    io_input.set_type("DS18B20", {"address": "28-000004f65c4d"})
+    with mock.patch('beerery.fileio.log_input_state') as log_input_state:
+      record = io_input.calculate(tick=self.tick)
+
+    self.failUnless(record.tick is self.tick)
+    self.assertEqual(record.value, 100.5)
+    log_input_state.assert_called_with("HLT", record)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import mock
+from mock import patch
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.simulator as simulator
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "config")
+MINUTE_MS = 60 * 1000
+
+class SimulatorTests(unittest.TestCase):
+  def tearDown(self):
+    clock.use_system_clock()
+
+  def testVesselHeatsAndCoolsLikeWater(self):
+    vessel = simulator.Vessel("HLT", 40, 5500, 0, 0, 20.0)
+    vessel.heater_on = True
+    vessel.step(60 * 1000, 20.0)
+
+    # 5500W into 40kg of water for a minute
+    self.assertAlmostEqual(vessel.temperature_c, 20 + 5500 * 60 / (40 * 4186.0), 6)
+
+    cooling = simulator.Vessel("HLT", 40, 5500, 15, 0, 80.0)
+    cooling.step(MINUTE_MS, 20.0)
+    self.failUnless(20.0 < cooling.temperature_c < 80.0)
+
+  def testSensorLagsAndWaterBoils(self):
+    vessel = simulator.Vessel("BK", 10, 5500, 0, 30, 99.0)
+    vessel.heater_on = True
+    vessel.step(10 * 1000, 20.0)
+
+    self.assertEqual(vessel.temperature_c, 100.0)
+    self.failUnless(99.0 < vessel.sensor_c < 100.0)
+
+  def testLoopManagerRunsOnVirtualClock(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    start = virtual.millis()
+    loop_manager = ctrl.LoopManager(2000)
+    fired = []
+
+    loop_manager.schedule_callback(lambda: fired.append(clock.millis()), 500)
+    loop_manager.wait_for_next_loop()
+
+    self.assertEqual(fired, [start + 500])
+    self.assertEqual(virtual.millis(), start + 2000)
+    self.assertEqual(loop_manager.timing_stats()["max_ms"], 0)
+
+  def simulate(self, minutes):
+    base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, base_dir)
+    shutil.copytree(CONFIG_DIR, os.path.join(base_dir, "config"))
+    os.mkdir(os.path.join(base_dir, "state"))
+    with open(os.path.join(base_dir, "config", "outputs.json")) as config_file:
+      outputs = json.load(config_file)
+    outputs[0]["active"] = True
+    with open(os.path.join(base_dir, "config", "outputs.json"), "w") as config_file:
+      json.dump(outputs, config_file)
+    with open(os.path.join(base_dir, "config", "logs.json"), "w") as config_file:
+      json.dump([], config_file)
+    with open(os.path.join(base_dir, "config", "inputs.json")) as config_file:
+      inputs = json.load(config_file)
+
+    simulation = simulator.Simulation.from_config(
+      {"ambient_f": 68, "vessels": [{"name": "HLT", "volume_l": 40,
+       "element_watts": 5500, "initial_f": 60}]}, inputs, outputs)
+    end_ms = simulation.clock.millis() + minutes * MINUTE_MS
+
+    def on_loop():
+      return simulation.clock.millis() >= end_ms
+
+    with patch('beerery.sensors.tempsensors.OneWireTempSensor'), \
+        patch('beerery.sensors.tempsensors.ThermistorSensor'), \
+        patch('beerery.sensors.tempsensors.TMP36TempSensor'), \
+        patch('beerery.controller.RPIO', simulator.FakeRPIO(simulation)), \
+        patch('beerery.controller.DEV_LOGGING', False), \
+        patch('beerery.program.fileio.log_program_state'):
+      simulation.install()
+      ctrl.Controller(base_dir).control(on_loop)
+
+    return simulation.vessel_states()["HLT"]
+
+  def testControllerHeatsVesselDeterministically(self):
+    first = self.simulate(40)
+    second = self.simulate(40)
+
+    self.assertEqual(first, second)
+    # the brew program heats the HLT to 145 and then holds it at 150
+    self.assertAlmostEqual(first["temperature_f"], 150, delta=1.5)
+    self.failUnless(0 < first["duty"] < 1)
+
+if __name__ == '__main__':
+  unittest.main()
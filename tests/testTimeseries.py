@@ -0,0 +1,83 @@
+import unittest
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+
+import beerery.timeseries as timeseries
+
+class ChunkEncodingTests(unittest.TestCase):
+  def roundTrip(self, samples):
+    data = timeseries.encode_chunk(samples)
+    return timeseries.decode_chunk(samples[0][0], len(samples), data)
+
+  def testRegularSamples(self):
+    samples = [(1400000000000 + i * 2000, 150.0 + (i % 7) * 0.0625)
+               for i in range(120)]
+
+    self.assertEqual(self.roundTrip(samples), samples)
+
+  def testIrregularTimestampsAndValues(self):
+    random.seed(3)
+    timestamp = 1400000000000
+    samples = []
+    for _ in range(200):
+      timestamp += random.choice([1, 2000, 2003, 1997, 60000, 10 ** 9])
+      samples.append((timestamp, random.uniform(-500, 500)))
+
+    self.assertEqual(self.roundTrip(samples), samples)
+
+  def testSpecialValues(self):
+    samples = [(0, 0.0), (1, -0.0), (2, float("inf")), (3, 1e-300), (4, 0.0)]
+    decoded = self.roundTrip(samples + [(5, float("nan"))])
+
+    self.assertEqual(decoded[:5], samples)
+    self.failUnless(math.isnan(decoded[5][1]))
+
+  def testCompressesBrewDayData(self):
+    # DS18B20 readings have a resolution of 1/16 c
+    samples = [(1400000000000 + i * 2000, (20 + i / 16.0) * 1.8 + 32)
+               for i in range(120)]
+    json_size = len(json.dumps([{"name": "HLT", "value": v, "units": "f",
+                                 "date_servertime": "2014-05-13 11:53:20",
+                                 "date_utc": "2014-05-13 16:53:20"}
+                                for _, v in samples]))
+
+    self.failUnless(len(timeseries.encode_chunk(samples)) * 10 < json_size)
+
+class TimeSeriesStoreTests(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testQueryAcrossChunksAndSegments(self):
+    store = timeseries.TimeSeriesStore(self.directory, chunk_size=10,
+                                       max_segment_bytes=100)
+    for i in range(95):
+      store.append("input_HLT", i * 1000, 100.0 + i)
+
+    series_directory = os.path.join(self.directory, "input_HLT")
+    self.failUnless(len([f for f in os.listdir(series_directory)
+                         if f.endswith(".seg")]) > 1)
+
+    samples = store.query("input_HLT", 25000, 93000)
+    self.assertEqual(samples, [(i * 1000, 100.0 + i) for i in range(25, 94)])
+
+    store.flush()
+    reopened = timeseries.TimeSeriesStore(self.directory)
+    self.assertEqual(len(reopened.query("input_HLT", 0, 10 ** 6)), 95)
+    self.assertEqual(reopened.series_names(), ["input_HLT"])
+
+  def testMissingValuesAreStoredAsNan(self):
+    store = timeseries.TimeSeriesStore(self.directory)
+    store.append("output_HLT", 1000, None)
+
+    self.failUnless(math.isnan(store.query("output_HLT", 0, 2000)[0][1]))
+    self.assertEqual(store.query("output_BK", 0, 2000), [])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import mock
+import os
+import sys
+
+#  mock the RPIO & spidev modules
+sys.modules['RPIO'] = mock.Mock()
+sys.modules['spidev'] = mock.Mock()
+os.system = mock.Mock()
+
+import beerery.clock as clock
+import beerery.controller as ctrl
+import beerery.pid as PID
+import beerery.pindriver as pindriver
+import beerery.tpcload as tpcload
+
+def on_ms(pieces):
+  return sum(end - start for start, end in pieces)
+
+def tpc_output(name, pin, output, watts, driver, scheduler):
+  config = {"name": name, "pin": pin, "mode": "TPC", "input": name,
+            "watts": watts,
+            "type": {"controller": "PID", "config": {
+              "mode": 0, "output": output, "kp": 20, "ki": 1, "kd": 5,
+              "set_point": 150}}}
+  io_output = ctrl.Output(config)
+  io_output.set_type(config["type"], config, 2000, pin_driver=driver,
+                     tpc_scheduler=scheduler)
+  return io_output
+
+class TpcLoadTests(unittest.TestCase):
+  def tearDown(self):
+    clock.use_system_clock()
+
+  def testHalfDutiesAreInterleaved(self):
+    placement, peak = tpcload.stagger(
+      [("HLT", 5500, 1000), ("BK", 5500, 1000)], 2000)
+
+    self.assertEqual(placement, {"BK": [(0, 1000)], "HLT": [(1000, 2000)]})
+    self.assertEqual(peak, 5500)
+
+  def testOverlapIsKeptShortAndDutiesPreserved(self):
+    loads = [("HLT", 5500, 1200), ("BK", 5500, 1400), ("RIMS", 1500, 900)]
+    placement, peak = tpcload.stagger(loads, 2000)
+
+    for name, _, wanted_ms in loads:
+      self.assertEqual(on_ms(placement[name]), wanted_ms)
+    # the elements only overlap for the time they have to
+    self.assertEqual(placement["BK"], [(0, 1400)])
+    self.assertEqual(placement["HLT"], [(800, 2000)])
+    self.assertEqual(placement["RIMS"], [(0, 900)])
+    self.assertEqual(peak, 12500)
+
+  def testOnTimesUnderTheWindowEndLow(self):
+    placement, _ = tpcload.stagger(
+      [("HLT", 5500, 1999.9), ("BK", 5500, 2000)], 2000)
+
+    self.assertEqual(placement["HLT"], [(0, 1999)])
+    self.assertEqual(tpcload.edges([(800, 2000)], 2000),
+                     [(0, False), (800, True), (2000, False)])
+    self.assertEqual(tpcload.edges([(0, 2000)], 2000), [(0, True)])
+    self.assertEqual(tpcload.edges([], 2000), [(0, False)])
+
+  def testWindowsAreStaggeredAndReported(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    start = virtual.millis()
+    backend = pindriver.MemoryBackend(lambda: clock.millis() - start)
+    driver = pindriver.PinDriver(backend)
+    loop_manager = ctrl.LoopManager(2000, pin_driver=driver)
+    scheduler = tpcload.TpcLoadScheduler(loop_manager, 30)
+    outputs = [tpc_output("HLT", 18, 50, 5500, driver, scheduler),
+               tpc_output("BK", 22, 50, 5500, driver, scheduler)]
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      for _ in range(2):
+        for io_output in outputs:
+          io_output.calculate(None, None, 2000, loop_manager)
+        window = scheduler.schedule_window(2000)
+        loop_manager.wait_for_next_loop()
+
+    self.assertEqual(backend.edges(18),
+                     [(1000, True), (2000, False), (3000, True), (4000, False)])
+    self.assertEqual(backend.edges(22),
+                     [(0, True), (1000, False), (2000, True), (3000, False)])
+    self.assertEqual(window["peak_watts"], 5500)
+    self.assertEqual(window["aligned_watts"], 11000)
+    self.failIf(window["over_budget"])
+    self.assertEqual(scheduler.stats()["windows"], 2)
+    self.assertEqual(scheduler.stats()["max_peak_watts"], 5500)
+
+  def testPinGoesLowWithoutANextWindow(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    start = virtual.millis()
+    backend = pindriver.MemoryBackend(lambda: clock.millis() - start)
+    driver = pindriver.PinDriver(backend)
+    loop_manager = ctrl.LoopManager(2000, pin_driver=driver)
+    scheduler = tpcload.TpcLoadScheduler(loop_manager)
+    hlt = tpc_output("HLT", 18, 60, 5500, driver, scheduler)
+    bk = tpc_output("BK", 22, 60, 5500, driver, scheduler)
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      hlt.calculate(None, None, 2000, loop_manager)
+      bk.calculate(None, None, 2000, loop_manager)
+      scheduler.schedule_window(2000)
+      loop_manager.wait_for_next_loop()
+      # HLT doesn't compute in the next window
+      bk.calculate(None, None, 2000, loop_manager)
+      scheduler.schedule_window(2000)
+      loop_manager.wait_for_next_loop()
+
+    self.assertEqual(backend.edges(18), [(800, True), (2000, False)])
+    self.assertEqual(driver.level(18), False)
+
+  def testOutputWithoutAnInputGoesLow(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    driver = pindriver.PinDriver(pindriver.MemoryBackend())
+    loop_manager = ctrl.LoopManager(2000, pin_driver=driver)
+    scheduler = tpcload.TpcLoadScheduler(loop_manager)
+    hlt = tpc_output("HLT", 18, 100, 5500, driver, scheduler)
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      hlt.calculate(None, None, 2000, loop_manager)
+      scheduler.schedule_window(2000)
+      loop_manager.execute_callbacks(clock.millis())
+      self.assertEqual(driver.level(18), True)
+
+      # the probe went stale in auto mode
+      hlt.controller.set_mode(PID.PidController.AUTO_MODE)
+      hlt.calculate(None, None, 2000, loop_manager)
+
+    self.assertEqual(driver.level(18), False)
+    self.assertEqual(loop_manager.pending_callbacks(), 0)
+
+  def testRemovedOutputGoesLowAndItsEdgesAreCancelled(self):
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    driver = pindriver.PinDriver(pindriver.MemoryBackend())
+    loop_manager = ctrl.LoopManager(2000, pin_driver=driver)
+    scheduler = tpcload.TpcLoadScheduler(loop_manager)
+    hlt = tpc_output("HLT", 18, 100, 5500, driver, scheduler)
+
+    with mock.patch('beerery.fileio.log_output_state'):
+      hlt.calculate(None, None, 2000, loop_manager)
+    scheduler.schedule_window(2000)
+    loop_manager.execute_callbacks(clock.millis())
+    self.assertEqual(driver.level(18), True)
+
+    hlt.close(loop_manager)
+
+    self.assertEqual(driver.level(18), False)
+    self.assertEqual(loop_manager.pending_callbacks(), 0)
+
+  def testPeaksOverTheBudgetAreCounted(self):
+    loop_manager = mock.Mock()
+    scheduler = tpcload.TpcLoadScheduler(loop_manager, 30)
+    hlt = mock.Mock(watts=5500)
+    hlt.name = "HLT"
+    bk = mock.Mock(watts=5500)
+    bk.name = "BK"
+
+    scheduler.request(hlt, 1600)
+    scheduler.request(bk, 1600)
+    window = scheduler.schedule_window(2000)
+
+    self.failUnless(window["over_budget"])
+    self.assertAlmostEqual(window["peak_amps"], 11000 / 240.0)
+    self.assertEqual(scheduler.stats()["over_budget"], 1)
+    loop_manager.cancel_group.assert_any_call("HLT")
+    self.assertEqual(scheduler.schedule_window(2000), None)
+
+if __name__ == '__main__':
+  unittest.main()
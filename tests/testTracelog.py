@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import StringIO
+import tempfile
+
+import beerery.tracelog as tracelog
+
+class Unformattable(object):
+  def __format__(self, spec):
+    raise AssertionError("formatted on the calling thread")
+
+class TracelogTests(unittest.TestCase):
+  def setUp(self):
+    self.stream = StringIO.StringIO()
+    tracelog.set_stream(self.stream)
+    tracelog.configure(default_level=tracelog.INFO, ring_size=16)
+
+  def tearDown(self):
+    tracelog.flush()
+    tracelog.set_stream(None)
+    tracelog.configure(default_level=tracelog.INFO,
+                       ring_size=tracelog.RING_SIZE)
+
+  def testLevelsPerSubsystem(self):
+    tracelog.configure(default_level="info", levels={"config": "debug"})
+    tracelog.get_logger("config").debug("config {}", 1)
+    tracelog.get_logger("inputs").debug("inputs {}", 2)
+    tracelog.get_logger("inputs").warning("inputs {}", 3)
+    tracelog.flush()
+
+    lines = self.stream.getvalue().splitlines()
+    self.assertEqual(len(lines), 2)
+    self.failUnless(lines[0].endswith("DEBUG   config: config 1"))
+    self.failUnless(lines[1].endswith("WARNING inputs: inputs 3"))
+
+    # events below the written level are still traced
+    messages = [tracelog.format_message(e) for e in tracelog.recent_events()]
+    self.failUnless("inputs 2" in messages)
+
+  def testFormattingIsDeferred(self):
+    logger = tracelog.get_logger("outputs")
+    logger.debug("pin {}", Unformattable())
+    logger.info("value {:.1f}", 2.25)
+
+    self.assertEqual(self.stream.getvalue(), "")
+    tracelog.flush()
+    self.failUnless(self.stream.getvalue().endswith("outputs: value 2.2\n"))
+
+  def testRingKeepsMostRecentEvents(self):
+    logger = tracelog.get_logger("loop")
+    for i in range(40):
+      logger.debug("event {}", i)
+
+    messages = [tracelog.format_message(e) for e in tracelog.recent_events()]
+    self.assertEqual(messages, ["event {}".format(i) for i in range(24, 40)])
+
+  def testDumpRoundTrip(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    logger = tracelog.get_logger("config")
+    logger.error(u"build failed: {}", u"caf\xe9")
+    logger.debug({"not": "a template"})
+
+    path = os.path.join(directory, "trace.bin")
+    self.assertEqual(tracelog.dump(path), 2)
+
+    events = tracelog.read_dump(path)
+    self.assertEqual([e["message"] for e in events],
+                     [u"build failed: caf\xe9", "{'not': 'a template'}"])
+    self.assertEqual(events[0]["level"], "ERROR")
+    tracelog.flush()
+    self.failUnless(self.stream.getvalue().endswith("caf\xc3\xa9\n"))
+    self.assertEqual(events[0]["subsystem"], "config")
+    self.failUnless(events[0]["sequence"] < events[1]["sequence"])
+
+if __name__ == '__main__':
+  unittest.main()
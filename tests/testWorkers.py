@@ -0,0 +1,45 @@
+import unittest
+import threading
+
+import beerery.workers as workers
+
+class WorkerPoolTests(unittest.TestCase):
+  def setUp(self):
+    self.pool = workers.WorkerPool()
+
+  def tearDown(self):
+    self.pool.shutdown()
+
+  def testGatherReturnsResultsInOrder(self):
+    futures = [self.pool.submit(key, lambda x: x * 2, i)
+               for i, key in enumerate(["w1", "spi", "w1"])]
+
+    self.assertEqual(self.pool.gather(futures), [0, 2, 4])
+
+  def testWorkersAreReused(self):
+    for _ in range(5):
+      self.pool.gather([self.pool.submit("w1", threading.current_thread),
+                        self.pool.submit("spi", threading.current_thread)])
+
+    self.assertEqual(self.pool.threads_started, 2)
+
+  def testSameKeyRunsOnSameThread(self):
+    threads = self.pool.gather([self.pool.submit("w1", threading.current_thread)
+                                for _ in range(3)])
+
+    self.assertEqual(len(set(threads)), 1)
+    self.failIf(threads[0] is threading.current_thread())
+
+  def testExceptionsAreReturnedOrRaised(self):
+    def fail():
+      raise ValueError("bad read")
+
+    futures = [self.pool.submit("w1", fail), self.pool.submit("w1", int, "3")]
+    results = self.pool.gather(futures, return_exceptions=True)
+
+    self.failUnless(isinstance(results[0], ValueError))
+    self.assertEqual(results[1], 3)
+    self.assertRaises(ValueError, self.pool.gather, futures)
+
+if __name__ == "__main__":
+  unittest.main()
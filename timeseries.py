@@ -0,0 +1,421 @@
+"""
+compact on disk time series storage for input and output history.
+samples are compressed gorilla style: timestamps as delta-of-deltas and
+values as the XOR with the previous value, both packed at the bit level.
+
+each series is stored in its own directory as append-only segment files.
+a segment is a sequence of independently decodable chunks, and a sidecar
+index file holds the time range and offset of every chunk so range
+queries only decode the chunks they need.
+"""
+import os
+import binascii
+import bisect
+import struct
+import threading
+import time
+
+SEGMENT_MAGIC = "BTS1"
+SEGMENT_EXTENSION = ".seg"
+INDEX_EXTENSION = ".idx"
+# first timestamp, last timestamp, sample count, byte length
+CHUNK_HEADER = struct.Struct("<qqHI")
+# first timestamp, last timestamp, chunk offset
+INDEX_ENTRY = struct.Struct("<qqQ")
+
+# delta-of-delta buckets: (prefix, prefix bits, value bits)
+TIMESTAMP_BUCKETS = [
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+]
+TIMESTAMP_FALLBACK = (0b1111, 4, 64)
+
+
+def float_to_bits(value):
+    """the ieee 754 bits of a float as an integer"""
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def bits_to_float(bits):
+    """a float from its ieee 754 bits"""
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+def leading_zeros(value):
+    """leading zero bits of a 64 bit integer"""
+    return 64 - value.bit_length()
+
+
+def trailing_zeros(value):
+    """trailing zero bits of a non zero 64 bit integer"""
+    return (value & -value).bit_length() - 1
+
+
+class BitWriter(object):
+
+    """packs values into a byte array at the bit level"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.current = 0
+        self.bit_count = 0
+
+    def write(self, value, bits):
+        """write the low `bits` bits of value"""
+        self.current = (self.current << bits) | (value & ((1 << bits) - 1))
+        self.bit_count += bits
+
+        while self.bit_count >= 8:
+            self.bit_count -= 8
+            self.data.append((self.current >> self.bit_count) & 0xff)
+
+        self.current &= (1 << self.bit_count) - 1
+
+    def to_bytes(self):
+        """the written bits, padded with zeros to a whole byte"""
+        data = bytearray(self.data)
+        if self.bit_count:
+            data.append((self.current << (8 - self.bit_count)) & 0xff)
+
+        return bytes(data)
+
+
+class BitReader(object):
+
+    """reads values written by a BitWriter"""
+
+    def __init__(self, data):
+        self.total_bits = len(data) * 8
+        self.bits = int(binascii.hexlify(data), 16) if data else 0
+        self.position = 0
+
+    def read(self, bits):
+        """read `bits` bits as an unsigned integer"""
+        self.position += bits
+        shift = self.total_bits - self.position
+        if shift < 0:
+            raise ValueError("Read past the end of the chunk.")
+
+        return (self.bits >> shift) & ((1 << bits) - 1)
+
+    def read_signed(self, bits):
+        """read a two's complement integer"""
+        value = self.read(bits)
+        if value >> (bits - 1):
+            value -= 1 << bits
+
+        return value
+
+
+def encode_chunk(samples):
+    """
+    compress a list of (timestamp_ms, value) samples into bytes
+    """
+    writer = BitWriter()
+
+    first_time, first_value = samples[0]
+    previous_bits = float_to_bits(first_value)
+    writer.write(previous_bits, 64)
+
+    previous_time = first_time
+    previous_delta = 0
+    previous_leading = 65
+    previous_trailing = 0
+
+    for timestamp, value in samples[1:]:
+        delta = timestamp - previous_time
+        delta_of_delta = delta - previous_delta
+        previous_time = timestamp
+        previous_delta = delta
+
+        if delta_of_delta == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in TIMESTAMP_BUCKETS:
+                limit = 1 << (value_bits - 1)
+                if -limit <= delta_of_delta < limit:
+                    break
+            else:
+                prefix, prefix_bits, value_bits = TIMESTAMP_FALLBACK
+
+            writer.write(prefix, prefix_bits)
+            writer.write(delta_of_delta, value_bits)
+
+        bits = float_to_bits(value)
+        xor = bits ^ previous_bits
+        previous_bits = bits
+
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        writer.write(1, 1)
+        leading = min(leading_zeros(xor), 31)
+        trailing = trailing_zeros(xor)
+
+        if leading >= previous_leading and trailing >= previous_trailing:
+            # fits in the previous window of meaningful bits
+            writer.write(0, 1)
+            meaningful = 64 - previous_leading - previous_trailing
+            writer.write(xor >> previous_trailing, meaningful)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            # 64 meaningful bits is stored as 0
+            writer.write(meaningful & 63, 6)
+            writer.write(xor >> trailing, meaningful)
+            previous_leading = leading
+            previous_trailing = trailing
+
+    return writer.to_bytes()
+
+
+def decode_chunk(first_time, count, data):
+    """
+    decompress a chunk written by encode_chunk into (timestamp_ms, value)
+    """
+    reader = BitReader(data)
+
+    previous_bits = reader.read(64)
+    samples = [(first_time, bits_to_float(previous_bits))]
+
+    previous_time = first_time
+    previous_delta = 0
+    previous_leading = 0
+    previous_trailing = 0
+
+    for _ in xrange(count - 1):
+        if reader.read(1) == 0:
+            delta_of_delta = 0
+        else:
+            # each bucket adds a one to the prefix, a zero ends it
+            value_bits = TIMESTAMP_FALLBACK[2]
+            for _, _, bucket_bits in TIMESTAMP_BUCKETS:
+                if reader.read(1) == 0:
+                    value_bits = bucket_bits
+                    break
+
+            delta_of_delta = reader.read_signed(value_bits)
+
+        previous_delta += delta_of_delta
+        previous_time += previous_delta
+
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                previous_leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                previous_trailing = 64 - previous_leading - meaningful
+
+            meaningful = 64 - previous_leading - previous_trailing
+            previous_bits ^= reader.read(meaningful) << previous_trailing
+
+        samples.append((previous_time, bits_to_float(previous_bits)))
+
+    return samples
+
+
+class Series(object):
+
+    """
+    a single time series, buffers samples and appends compressed chunks
+    to the current segment of the series directory
+    """
+
+    def __init__(self, directory, chunk_size, chunk_age_s,
+                 max_segment_bytes, max_segment_age_s):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.chunk_age_s = chunk_age_s
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_s = max_segment_age_s
+        self.pending = []
+        self.pending_since = None
+        self.segment_path = None
+        self.segment_started = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def append(self, timestamp_ms, value):
+        """buffer a sample, writing a chunk when the buffer is full or old"""
+        if self.pending and timestamp_ms < self.pending[-1][0]:
+            # samples must be in time order for the delta encoding
+            timestamp_ms = self.pending[-1][0]
+
+        if not self.pending:
+            self.pending_since = time.time()
+
+        self.pending.append((timestamp_ms, value))
+
+        if len(self.pending) >= self.chunk_size or \
+                time.time() - self.pending_since >= self.chunk_age_s:
+            self.flush()
+
+    def segment_for_write(self):
+        """the segment to append to, rotating it if it is too big or old"""
+        if self.segment_path:
+            too_big = os.path.getsize(self.segment_path) >= \
+                self.max_segment_bytes
+            too_old = time.time() - self.segment_started >= \
+                self.max_segment_age_s
+            if too_big or too_old:
+                self.segment_path = None
+
+        if not self.segment_path:
+            first_time = self.pending[0][0]
+            self.segment_path = os.path.join(
+                self.directory, "{:020d}{}".format(first_time,
+                                                   SEGMENT_EXTENSION))
+            self.segment_started = time.time()
+            with open(self.segment_path, "ab") as segment:
+                segment.seek(0, os.SEEK_END)
+                if not segment.tell():
+                    segment.write(SEGMENT_MAGIC)
+
+        return self.segment_path
+
+    def flush(self):
+        """write the buffered samples as a chunk"""
+        if not self.pending:
+            return
+
+        data = encode_chunk(self.pending)
+        segment_path = self.segment_for_write()
+        first_time = self.pending[0][0]
+        last_time = self.pending[-1][0]
+
+        with open(segment_path, "ab") as segment:
+            segment.seek(0, os.SEEK_END)
+            offset = segment.tell()
+            segment.write(CHUNK_HEADER.pack(first_time, last_time,
+                                            len(self.pending), len(data)))
+            segment.write(data)
+
+        index_path = segment_path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+        with open(index_path, "ab") as index:
+            index.write(INDEX_ENTRY.pack(first_time, last_time, offset))
+
+        self.pending = []
+        self.pending_since = None
+
+    def segments(self):
+        """(start_ms, segment path) of every segment, oldest first"""
+        segments = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(SEGMENT_EXTENSION):
+                start = int(file_name[:-len(SEGMENT_EXTENSION)])
+                segments.append((start, os.path.join(self.directory,
+                                                     file_name)))
+
+        return sorted(segments)
+
+    def query(self, start_ms, end_ms):
+        """samples with start_ms <= timestamp <= end_ms, oldest first"""
+        samples = []
+        segments = self.segments()
+        starts = [s[0] for s in segments]
+
+        # the segment containing start_ms is the last one starting before it
+        first = max(bisect.bisect_right(starts, start_ms) - 1, 0)
+        for segment_start, segment_path in segments[first:]:
+            if segment_start > end_ms:
+                break
+
+            samples.extend(read_segment(segment_path, start_ms, end_ms))
+
+        samples.extend(s for s in self.pending if start_ms <= s[0] <= end_ms)
+        return samples
+
+
+def read_index(segment_path):
+    """index entries of a segment"""
+    index_path = segment_path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+    if not os.path.exists(index_path):
+        return []
+
+    with open(index_path, "rb") as index:
+        data = index.read()
+
+    count = len(data) // INDEX_ENTRY.size
+    return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+            for i in xrange(count)]
+
+
+def read_segment(segment_path, start_ms, end_ms):
+    """decode the chunks of a segment that overlap the time range"""
+    entries = read_index(segment_path)
+    last_times = [e[1] for e in entries]
+
+    samples = []
+    with open(segment_path, "rb") as segment:
+        for first_time, _, offset in \
+                entries[bisect.bisect_left(last_times, start_ms):]:
+            if first_time > end_ms:
+                break
+
+            segment.seek(offset)
+            first_time, _, count, length = CHUNK_HEADER.unpack(
+                segment.read(CHUNK_HEADER.size))
+            chunk = decode_chunk(first_time, count, segment.read(length))
+            samples.extend(s for s in chunk if start_ms <= s[0] <= end_ms)
+
+    return samples
+
+
+class TimeSeriesStore(object):
+
+    """
+    directory of compressed time series, one sub directory per series
+    """
+
+    def __init__(self, directory, chunk_size=120, chunk_age_s=300,
+                 max_segment_bytes=1024 * 1024, max_segment_age_s=86400):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.chunk_age_s = chunk_age_s
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_s = max_segment_age_s
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def get_series(self, name):
+        """get or create a series, called with the lock held"""
+        series = self.series.get(name)
+        if series is None:
+            series = Series(os.path.join(self.directory, name),
+                            self.chunk_size, self.chunk_age_s,
+                            self.max_segment_bytes, self.max_segment_age_s)
+            self.series[name] = series
+
+        return series
+
+    def append(self, name, timestamp_ms, value):
+        """append a sample to a series"""
+        value = float("nan") if value is None else float(value)
+
+        with self.lock:
+            self.get_series(name).append(int(timestamp_ms), value)
+
+    def query(self, name, start_ms, end_ms):
+        """samples of a series within a time range"""
+        with self.lock:
+            if not os.path.isdir(os.path.join(self.directory, name)):
+                return []
+
+            return self.get_series(name).query(start_ms, end_ms)
+
+    def series_names(self):
+        """names of all of the stored series"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        return sorted(n for n in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, n)))
+
+    def flush(self):
+        """write all buffered samples"""
+        with self.lock:
+            for series in self.series.values():
+                series.flush()
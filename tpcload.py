@@ -0,0 +1,239 @@
+"""
+load aware scheduling of the TPC output windows. every TPC output shares
+the control window, instead of switching every heater on at the start of
+the window each output's on time is placed in the window to keep the
+concurrent load low. each output is still on for its full duty of every
+window, and an on time under the whole window always ends with a low edge
+at or before the end of the window so a pin never stays on waiting for
+the next window
+"""
+import collections
+import threading
+import beerery.clock as clock
+import beerery.tracelog as tracelog
+
+LOG = tracelog.get_logger("tpcload")
+
+DEFAULT_VOLTS = 240
+RECENT_WINDOWS = 30
+
+
+def segments(start_ms, on_ms, window_ms):
+    """
+    the (start, end) pieces of an on time starting at start_ms, the on
+    time must end within the window
+    """
+    if on_ms <= 0:
+        return []
+    if on_ms >= window_ms:
+        return [(0, window_ms)]
+
+    return [(start_ms, start_ms + on_ms)]
+
+
+def peak_load(placed, within=None):
+    """
+    the peak concurrent watts of [(watts, segments)], only while one of
+    the within segments is on if given
+    """
+    peak = 0
+    for _, pieces in placed:
+        for at_ms, _ in pieces:
+            if within is not None and not any(
+                    start <= at_ms < end for start, end in within):
+                continue
+
+            peak = max(peak, sum(
+                watts for watts, others in placed
+                if any(start <= at_ms < end for start, end in others)))
+
+    return peak
+
+
+def overlap(pieces, placed):
+    """watt milliseconds of placed load that pieces overlap"""
+    total = 0
+    for watts, others in placed:
+        for start, end in pieces:
+            for other_start, other_end in others:
+                total += watts * max(
+                    0, min(end, other_end) - max(start, other_start))
+
+    return total
+
+
+def stagger(loads, window_ms):
+    """
+    place the on times of loads, a list of (key, watts, on ms), in a
+    window. the largest loads are placed first, each at the offset that
+    gives the lowest peak, then the lowest peak while it is on and then
+    the least overlap. returns
+    ({key: [(start, end)]}, peak watts)
+    """
+    placed = []
+    placement = {}
+    ordered = sorted(loads, key=lambda load: (-load[1], -load[2], load[0]))
+    for key, watts, on_ms in ordered:
+        full = on_ms >= window_ms
+        on_ms = int(round(min(max(on_ms, 0), window_ms)))
+        if not full:
+            # just under the whole window still has to go low
+            on_ms = min(on_ms, window_ms - 1)
+
+        # the best offset lines the start or the end of the on time up
+        # with the start or end of something already placed, or with
+        # the end of the window
+        candidates = set([0, window_ms - on_ms])
+        for _, pieces in placed:
+            for start, end in pieces:
+                for edge in (start, end):
+                    candidates.add(edge)
+                    candidates.add(edge - on_ms)
+
+        best = None
+        for start_ms in sorted(candidates):
+            if start_ms < 0 or start_ms + on_ms > window_ms:
+                continue
+
+            pieces = segments(start_ms, on_ms, window_ms)
+            trial = placed + [(watts, pieces)]
+            rank = (peak_load(trial), peak_load(trial, pieces),
+                    overlap(pieces, placed), start_ms)
+            if best is None or rank < best[0]:
+                best = (rank, pieces)
+
+        placement[key] = best[1]
+        placed.append((watts, best[1]))
+
+    return placement, peak_load(placed)
+
+
+def edges(pieces, window_ms):
+    """
+    the (offset ms, level) writes for an on time. offset 0 always sets
+    the level the window starts with, an on time under the whole window
+    always has its low edge, even at the end of the window
+    """
+    starts_on = any(start == 0 for start, _ in pieces)
+    writes = [(0, starts_on)]
+    for start, end in sorted(pieces):
+        if start > 0:
+            writes.append((start, True))
+        if end - start < window_ms:
+            writes.append((end, False))
+
+    return writes
+
+
+class TpcLoadScheduler(object):
+
+    """
+    schedules the pin edges of the TPC outputs for each control window.
+    outputs request their on time as they calculate, the window is
+    placed once every output has calculated
+    """
+
+    def __init__(self, loop_manager, budget_amps=None, volts=DEFAULT_VOLTS):
+        self.loop_manager = loop_manager
+        self.budget_amps = budget_amps
+        self.volts = volts
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.windows = 0
+        self.over_budget = 0
+        self.max_peak_watts = 0
+        self.last_window = None
+        self.recent = collections.deque(maxlen=RECENT_WINDOWS)
+
+    def set_budget(self, budget_amps, volts=DEFAULT_VOLTS):
+        """the panel current budget, None for no budget"""
+        self.budget_amps = budget_amps
+        self.volts = volts
+
+    def request(self, output, on_ms):
+        """an output wants on_ms of the next window"""
+        with self.lock:
+            self.requests[output.name] = (output, on_ms)
+
+    def remove(self, output):
+        """
+        drop an output that is going away, its pending edges are
+        cancelled and its pin is set low
+        """
+        with self.lock:
+            if self.requests.get(output.name, (None,))[0] is output:
+                del self.requests[output.name]
+
+        self.loop_manager.cancel_group(output.name)
+        output.set_pin_low()
+
+    def schedule_window(self, window_ms):
+        """
+        place the requested on times and schedule their edges, a new
+        window supersedes any edges left from the previous one.
+        returns the report for the window
+        """
+        with self.lock:
+            requests = self.requests
+            self.requests = {}
+
+        if not requests:
+            return None
+
+        placement, peak_watts = stagger(
+            [(name, output.watts, on_ms)
+             for name, (output, on_ms) in requests.items()], window_ms)
+
+        for name, (output, _) in sorted(requests.items()):
+            self.loop_manager.cancel_group(name)
+            for offset_ms, level in edges(placement[name], window_ms):
+                self.loop_manager.schedule_callback(
+                    output.set_pin_high if level else output.set_pin_low,
+                    offset_ms, name)
+
+        return self.report(requests, placement, peak_watts)
+
+    def report(self, requests, placement, peak_watts):
+        """record the achieved peak load of a window"""
+        # what the window would have drawn with every output
+        # switched on at the start
+        aligned_watts = sum(output.watts for output, on_ms
+                            in requests.values() if on_ms > 0)
+        window = {
+            "tick_ms": clock.millis(),
+            "peak_watts": peak_watts,
+            "peak_amps": peak_watts / float(self.volts),
+            "aligned_watts": aligned_watts,
+            "budget_amps": self.budget_amps,
+            "over_budget": self.budget_amps is not None and
+            peak_watts / float(self.volts) > self.budget_amps,
+            "placement": placement
+        }
+
+        self.windows += 1
+        self.max_peak_watts = max(self.max_peak_watts, peak_watts)
+        self.last_window = window
+        self.recent.append((window["tick_ms"], peak_watts))
+
+        if window["over_budget"]:
+            self.over_budget += 1
+            LOG.warning("TPC window peak {:.1f}A is over the {}A budget",
+                        window["peak_amps"], self.budget_amps)
+        else:
+            LOG.debug("TPC window peak {}W, {}W if aligned", peak_watts,
+                      aligned_watts)
+
+        return window
+
+    def stats(self):
+        """peak load counters for the TPC windows"""
+        return {
+            "windows": self.windows,
+            "over_budget": self.over_budget,
+            "budget_amps": self.budget_amps,
+            "volts": self.volts,
+            "max_peak_watts": self.max_peak_watts,
+            "last_peak_watts": self.last_window["peak_watts"]
+                               if self.last_window else None,
+            "recent_peak_watts": list(self.recent)
+        }
@@ -0,0 +1,329 @@
+"""
+structured, leveled logging for the control threads. a log call only
+checks the level and appends the unformatted event, messages are
+formatted and written by a background thread. every recorded event also
+goes into an always-on ring buffer of the last RING_SIZE events that can
+be dumped to a compact binary file for post-mortem analysis:
+
+    LOG = tracelog.get_logger("inputs")
+    LOG.debug("calculating {}", name)
+"""
+import collections
+import itertools
+import struct
+import sys
+import thread
+import threading
+import time
+import beerery.fileio as fileio
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING",
+               ERROR: "ERROR"}
+LEVELS = dict((name.lower(), level) for level, name in LEVEL_NAMES.items())
+
+RING_SIZE = 8192
+EMIT_QUEUE_SIZE = 10000  # events waiting to be written, oldest dropped
+EMIT_INTERVAL_S = 0.1
+
+DUMP_MAGIC = "BTRACE1\n"
+# sequence, time, level, thread, subsystem length, message length
+DUMP_RECORD = struct.Struct("<QdBQHI")
+
+# event tuple fields
+SEQUENCE, TIME, LEVEL, THREAD, SUBSYSTEM, TEMPLATE, ARGS = range(7)
+
+
+def level_from_name(name):
+    """level for a name like "debug", levels pass through"""
+    if isinstance(name, int):
+        return name
+
+    if name.lower() not in LEVELS:
+        raise Exception("Unknown log level '{}'".format(name))
+
+    return LEVELS[name.lower()]
+
+
+def format_message(event):
+    """
+    the message of an event formatted from its template and args,
+    as a utf-8 encoded str
+    """
+    template, args = event[TEMPLATE], event[ARGS]
+    if not isinstance(template, basestring):
+        return repr(template)
+
+    try:
+        message = template.format(*args) if args else template
+    except Exception:  # pylint: disable=W0703
+        message = "{!r} {!r}".format(template, args)
+
+    if isinstance(message, unicode):
+        message = message.encode("utf-8")
+
+    return message
+
+
+def format_event(event):
+    """one line of log output for an event"""
+    return "{}.{:03d} {:<7} {}: {}".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event[TIME])),
+        int(event[TIME] * 1000) % 1000, LEVEL_NAMES.get(event[LEVEL]),
+        event[SUBSYSTEM], format_message(event))
+
+
+class TraceRing(object):
+
+    """
+    fixed size ring of the most recent events. slots are assigned from
+    the event sequence so appending needs no lock
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.events = [None] * size
+
+    def append(self, event):
+        """add an event, overwriting the oldest once full"""
+        self.events[event[SEQUENCE] % self.size] = event
+
+    def snapshot(self):
+        """the events in the ring, oldest first"""
+        return sorted((event for event in list(self.events) if event),
+                      key=lambda event: event[SEQUENCE])
+
+    def clear(self):
+        """drop every event"""
+        self.events = [None] * self.size
+
+
+class Emitter(threading.Thread):
+
+    """
+    formats and writes emitted events on a background thread
+    """
+
+    def __init__(self, stream=None):
+        super(Emitter, self).__init__(name="tracelog-emitter")
+        self.daemon = True
+        self.stream = stream
+        self.queue = collections.deque(maxlen=EMIT_QUEUE_SIZE)
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            time.sleep(EMIT_INTERVAL_S)
+            self.flush()
+
+    def flush(self):
+        """write every waiting event"""
+        with self.lock:
+            stream = self.stream or sys.stdout
+            lines = []
+            while self.queue:
+                lines.append(format_event(self.queue.popleft()))
+
+            if lines:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+
+
+class Logger(object):
+
+    """
+    logger for a subsystem. events at or above level are written out,
+    events at or above the ring level are kept in the trace ring
+    """
+
+    def __init__(self, subsystem, level):
+        self.subsystem = subsystem
+        self.level = level
+        self.record_level = min(level, sys.modules[__name__].ring_level)
+
+    def set_level(self, level):
+        """change the level events are written out at"""
+        self.level = level_from_name(level)
+        self.record_level = min(self.level,
+                                sys.modules[__name__].ring_level)
+
+    def is_enabled(self, level):
+        """True if events at the level are written out"""
+        return level >= self.level
+
+    def log(self, level, template, *args):
+        """record an event, args are only formatted when written"""
+        if level >= self.record_level:
+            self.record(level, template, args)
+
+    def record(self, level, template, args):
+        """trace and write out an event that passed the record level"""
+        event = (next(sequence), time.time(), level, thread.get_ident(),
+                 self.subsystem, template, args)
+
+        if level >= ring_level:
+            # TraceRing.append inlined, this is the hot path
+            ring.events[event[SEQUENCE] % ring.size] = event
+
+        if level >= self.level:
+            emit(event)
+
+    def debug(self, template, *args):
+        """record a debug event"""
+        if DEBUG >= self.record_level:
+            self.record(DEBUG, template, args)
+
+    def info(self, template, *args):
+        """record an info event"""
+        if INFO >= self.record_level:
+            self.record(INFO, template, args)
+
+    def warning(self, template, *args):
+        """record a warning event"""
+        if WARNING >= self.record_level:
+            self.record(WARNING, template, args)
+
+    def error(self, template, *args):
+        """record an error event"""
+        if ERROR >= self.record_level:
+            self.record(ERROR, template, args)
+
+
+sys.modules[__name__].loggers = {}
+sys.modules[__name__].default_level = INFO
+sys.modules[__name__].ring_level = DEBUG
+sys.modules[__name__].ring = TraceRing()
+sys.modules[__name__].sequence = itertools.count()
+sys.modules[__name__].emitter = None
+sys.modules[__name__].emitter_lock = threading.Lock()
+
+
+def get_logger(subsystem):
+    """the logger for a subsystem, created when first used"""
+    loggers = sys.modules[__name__].loggers
+    if subsystem not in loggers:
+        loggers.setdefault(subsystem, Logger(
+            subsystem, sys.modules[__name__].default_level))
+
+    return loggers[subsystem]
+
+
+def configure(default_level=None, levels=None, ring_level=None,
+              ring_size=None):
+    """
+    set the level of every logger, with per subsystem levels from
+    levels, e.g. {"config": "debug"}
+    """
+    module = sys.modules[__name__]
+    if ring_level is not None:
+        module.ring_level = level_from_name(ring_level)
+    if ring_size is not None and ring_size != module.ring.size:
+        module.ring = TraceRing(ring_size)
+    if default_level is not None:
+        module.default_level = level_from_name(default_level)
+
+    levels = levels or {}
+    for subsystem in levels:
+        get_logger(subsystem)
+
+    for subsystem, logger in module.loggers.items():
+        logger.set_level(levels.get(subsystem, module.default_level))
+
+
+def emit(event):
+    """queue an event to be written, starting the emitter when needed"""
+    module = sys.modules[__name__]
+    if module.emitter is None:
+        with module.emitter_lock:
+            if module.emitter is None:
+                emitter = Emitter()
+                emitter.start()
+                module.emitter = emitter
+
+    module.emitter.queue.append(event)
+
+
+def set_stream(stream):
+    """write emitted events to a stream instead of stdout"""
+    flush()
+    module = sys.modules[__name__]
+    with module.emitter_lock:
+        if module.emitter is None:
+            module.emitter = Emitter(stream)
+            module.emitter.start()
+        else:
+            module.emitter.stream = stream
+
+
+def flush():
+    """write every queued event now"""
+    emitter = sys.modules[__name__].emitter
+    if emitter is not None:
+        emitter.flush()
+
+
+def recent_events():
+    """events in the trace ring, oldest first"""
+    return sys.modules[__name__].ring.snapshot()
+
+
+def encode_events(events):
+    """binary dump of events"""
+    chunks = [DUMP_MAGIC]
+    for event in events:
+        subsystem = event[SUBSYSTEM].encode("utf-8")
+        message = format_message(event)
+
+        chunks.append(DUMP_RECORD.pack(
+            event[SEQUENCE], event[TIME], event[LEVEL], event[THREAD],
+            len(subsystem), len(message)))
+        chunks.append(subsystem)
+        chunks.append(message)
+
+    return "".join(chunks)
+
+
+def decode_events(data):
+    """events from a binary dump, as dicts"""
+    if not data.startswith(DUMP_MAGIC):
+        raise Exception("Not a trace dump")
+
+    events = []
+    offset = len(DUMP_MAGIC)
+    while offset < len(data):
+        sequence, event_time, level, thread_id, subsystem_length, \
+            message_length = DUMP_RECORD.unpack_from(data, offset)
+        offset += DUMP_RECORD.size
+        subsystem = data[offset:offset + subsystem_length].decode("utf-8")
+        offset += subsystem_length
+        message = data[offset:offset + message_length].decode("utf-8")
+        offset += message_length
+
+        events.append({
+            "sequence": sequence,
+            "time": event_time,
+            "level": LEVEL_NAMES.get(level, level),
+            "thread": thread_id,
+            "subsystem": subsystem,
+            "message": message
+        })
+
+    return events
+
+
+def dump(file_path):
+    """write the trace ring to a binary file, returns the event count"""
+    events = recent_events()
+    fileio.write_text(file_path, encode_events(events))
+    return len(events)
+
+
+def read_dump(file_path):
+    """events from a dump file"""
+    with open(file_path, "rb") as dump_file:
+        return decode_events(dump_file.read())
+
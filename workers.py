@@ -0,0 +1,145 @@
+"""
+long lived worker threads for running blocking work (sensor reads, etc.)
+off of the control loop thread
+"""
+import threading
+import Queue
+
+
+class Future(object):
+
+    """
+    result of a request submitted to a worker.
+    result() blocks until the worker has completed the request
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def set_result(self, value):
+        """set the result and wake any waiters"""
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, error):
+        """set the exception raised by the request and wake any waiters"""
+        self.error = error
+        self.event.set()
+
+    def done(self):
+        """True if the request has completed"""
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """wait for the request to complete, returns done()"""
+        return self.event.wait(timeout)
+
+    def exception(self, timeout=None):
+        """returns the exception raised by the request or None"""
+        if not self.wait(timeout):
+            raise RuntimeError("Request did not complete in time.")
+
+        return self.error
+
+    def result(self, timeout=None):
+        """returns the request result, re-raising any exception"""
+        if self.exception(timeout) is not None:
+            raise self.error
+
+        return self.value
+
+
+class Worker(threading.Thread):
+
+    """
+    worker thread that processes requests from its queue in order
+    """
+
+    _STOP = object()
+
+    def __init__(self, name):
+        super(Worker, self).__init__(name="worker-{}".format(name))
+        self.daemon = True
+        self.requests = Queue.Queue()
+        self.processed = 0
+
+    def submit(self, function, args):
+        """queue a request, returns a Future for the result"""
+        future = Future()
+        self.requests.put((future, function, args))
+        return future
+
+    def stop(self):
+        """stop the worker once the queued requests are done"""
+        self.requests.put(Worker._STOP)
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is Worker._STOP:
+                return
+
+            future, function, args = request
+            try:
+                future.set_result(function(*args))
+            except Exception as error:  # pylint: disable=W0703
+                future.set_exception(error)
+
+            self.processed += 1
+
+
+class WorkerPool(object):
+
+    """
+    pool of long lived workers keyed by bus or device class.
+    requests with the same key are processed in order by the same worker,
+    requests with different keys run in parallel. workers are created the
+    first time a key is seen so the steady state starts no new threads
+    """
+
+    def __init__(self):
+        self.workers = {}
+        self.workers_lock = threading.Lock()
+        self.threads_started = 0
+
+    def worker_for(self, key):
+        """get or create the worker for a key"""
+        with self.workers_lock:
+            worker = self.workers.get(key)
+            if worker is None:
+                worker = Worker(key)
+                worker.start()
+                self.workers[key] = worker
+                self.threads_started += 1
+
+            return worker
+
+    def submit(self, key, function, *args):
+        """run function(*args) on the worker for key, returns a Future"""
+        return self.worker_for(key).submit(function, args)
+
+    def gather(self, futures, return_exceptions=False):
+        """
+        wait for all of the futures and return their results in order.
+        with return_exceptions failed requests return their exception
+        instead of raising it
+        """
+        results = []
+        for future in futures:
+            error = future.exception()
+            if error is not None and not return_exceptions:
+                raise error
+
+            results.append(error if error is not None else future.value)
+
+        return results
+
+    def shutdown(self):
+        """stop all of the workers"""
+        with self.workers_lock:
+            for worker in self.workers.values():
+                worker.stop()
+
+            self.workers.clear()